@@ -0,0 +1,95 @@
+from json import dumps as json_dumps_
+from json import loads as json_loads
+from os import fsync, makedirs
+from os import path as os_path
+from datetime import datetime
+from threading import Lock
+
+
+class CheckpointStore:
+    """
+        Durable per-job checkpoint on local disk.
+
+        every completed device is appended (and fsynced) as one json line to: '{checkpoints_dir}/{job_id}.jsonl'
+            {"device": "<device name>", "result": <json serializable result>, "successful": bool}
+
+        a new job given the same job_id resumes from it: completed devices are loaded back with their result
+        and only the remaining devices are processed, devices recorded as failed are processed again
+        (the last record of a device wins).
+
+        keep_results: False to only keep the offset of each result in memory (eg: report rows of a whole estate),
+                      results are then read back from disk by get_result().
+    """
+    def __init__(self, checkpoints_dir:str, job_id:str="", keep_results:bool=True):
+        if not os_path.exists(checkpoints_dir):
+            makedirs(checkpoints_dir)
+        self.job_id = job_id or datetime.now().strftime('%Y%m%d-%H%M%S')
+        self.file_path = f"{checkpoints_dir}/{self.job_id}.jsonl"
+        self.keep_results = keep_results
+        self.lock = Lock()
+        # {device name: offset of its line in the checkpoint file}
+        self.offsets = {}
+        # devices whose last record is a failure, see remaining()
+        self.failed = set()
+        self.completed = self.load()
+
+    def load(self):
+        completed = {}
+        if not os_path.exists(self.file_path):
+            return completed
+        with open(self.file_path, mode='rb+') as f:
+            offset = 0
+            for line in f:
+                try:
+                    entry = json_loads(line)
+                except ValueError:
+                    # last line may be truncated if the previous job was killed while writing it,
+                    # drop it so that the next record starts on its own line
+                    if not line.endswith(b"\n"):
+                        f.truncate(offset)
+                        break
+                    offset += len(line)
+                    continue
+                completed[entry["device"]] = entry["result"] if self.keep_results else None
+                self.offsets[entry["device"]] = offset
+                if entry.get("successful", True):
+                    self.failed.discard(entry["device"])
+                else:
+                    self.failed.add(entry["device"])
+                offset += len(line)
+        return completed
+
+    def record(self, device_name:str, result, successful:bool=True):
+        line = json_dumps_({"device": device_name, "result": result, "successful": successful}, default=str)
+        with self.lock:
+            with open(self.file_path, mode='ab') as f:
+                offset = f.tell()
+                f.write(f"{line}\n".encode())
+                f.flush()
+                fsync(f.fileno())
+            self.offsets[device_name] = offset
+            self.completed[device_name] = json_loads(line)["result"] if self.keep_results else None
+            if successful:
+                self.failed.discard(device_name)
+            else:
+                self.failed.add(device_name)
+
+    def get_result(self, device_name:str):
+        if self.keep_results:
+            return self.completed[device_name]
+        with open(self.file_path, mode='rb') as f:
+            f.seek(self.offsets[device_name])
+            return json_loads(f.readline())["result"]
+
+    def iter_results(self):
+        "yields (device name, result) of every completed device, results being read back one at a time"
+        for device_name in list(self.completed):
+            yield device_name, self.get_result(device_name)
+
+    def is_completed(self, device_name:str):
+        "True if the device is recorded in the checkpoint, successfully or not"
+        return device_name in self.completed
+
+    def remaining(self, devices:list):
+        "returns the devices that are not yet recorded in the checkpoint, or whose last record is a failure"
+        return [device for device in devices if device.name not in self.completed or device.name in self.failed]
@@ -0,0 +1,136 @@
+"""
+    report columns registry: each column declares how its value is extracted and the data it depends on,
+    a report run only fetches the NSO paths and loads the Netbox relations needed by its selected columns.
+    like common.utils.parsing, this module must stay free of Django/ORM imports (rows are built in worker processes).
+"""
+
+
+# NSO live-status paths, keyed by the source name the extractors read
+NSO_SOURCES = {
+    "state": "ietf-interfaces:interfaces-state",
+    "properties": "Cisco-IOS-XR-ifmgr-oper:interface-properties/data-nodes",
+    "optics": "tailf-ned-cisco-ios-xr-stats:controllers/Optics",
+}
+# source filled from the low priority lane cache rather than fetched inline, see common.utils.ethernet_oper
+ETHERNET_OPER_SOURCE = "ethernet-oper"
+
+
+class ReportColumn:
+    """
+        header: column name in the report outputs
+        extractor: method(row) returning the cell value, row being:
+            {
+                "device": device record, "interface": interface record,
+                "service-policy": local context service-policy of the interface,
+                "<source>": reduced NSO data of the interface for each of NSO_SOURCES and ETHERNET_OPER_SOURCE,
+            }
+        sources: NSO sources read by the extractor, or applied to the interface fields it reads
+                 (eg: "state" for the fields overwritten by common.utils.report.apply_interfaces_state)
+        fields: interface record fields read by the extractor (see common.utils.report.INTERFACE_FIELDS)
+        relations: Netbox interface relations these fields need
+        device_relations: Netbox device relations of the device record
+        column_type: "int" for typed columns of the columnar output formats, strings otherwise
+    """
+    def __init__(self, header:str, extractor, sources:tuple=(), fields:tuple=(), relations:tuple=(), device_relations:tuple=(), column_type:str=None):
+        self.header = header
+        self.extractor = extractor
+        self.sources = sources
+        self.fields = fields
+        self.relations = relations
+        self.device_relations = device_relations
+        self.column_type = column_type
+
+
+def get_output_policy(row:dict, idx:int):
+    output_policies = (row["service-policy"].get("output-list", []) + [{"name": "N/A"}, {"name": "N/A"}])[0:2]
+    return output_policies[idx].get("name")
+
+
+def get_line_state(row:dict):
+    line_state = row["properties"].get("line-state")
+    if not line_state:
+        return "N/A"
+    return "up" if line_state == "im-state-up" else "down"
+
+
+REPORT_COLUMNS = [
+    ReportColumn("device-name", lambda row: row["device"]["name"]),
+    ReportColumn("interface-name", lambda row: row["interface"]["name"], fields=("name",)),
+    ReportColumn("device-model", lambda row: row["device"]["model"], device_relations=("device_type",)),
+    ReportColumn("device-version", lambda row: row["device"]["os-version"]),
+    ReportColumn("device-location", lambda row: row["device"]["site"], device_relations=("site",)),
+    ReportColumn("interface-type", lambda row: row["interface"]["type"], fields=("type",)),
+    ReportColumn("interface-description", lambda row: row["interface"]["description"], fields=("description",)),
+    # live NSO state applied to the Netbox interface (and synced back) before the record is taken
+    ReportColumn("interface-admin-state", lambda row: "up" if row["interface"]["enabled"] else "down", sources=("state",), fields=("enabled",)),
+    ReportColumn("interface-oper-state", lambda row: row["state"].get("oper-status", "N/A"), sources=("state",)),
+    ReportColumn("interface-link-state", get_line_state, sources=("properties",)),
+    ReportColumn(
+        "bandwidth",
+        lambda row: int(row["properties"]["bandwidth"]) // 1000000 if row["properties"].get("bandwidth") else "N/A",
+        sources=("properties",),
+        column_type="int",
+    ),
+    ReportColumn("speed (mbps)", lambda row: row["interface"]["speed"] or "N/A", sources=("state",), fields=("speed",), column_type="int"),
+    ReportColumn("optics-type", lambda row: row["optics"].get("optics-type", "N/A"), sources=("optics",), fields=("optics-id",)),
+    ReportColumn("optics-part_number", lambda row: row["optics"].get("part-number", "N/A"), sources=("optics",), fields=("optics-id",)),
+    ReportColumn("optics-WaveLength", lambda row: row[ETHERNET_OPER_SOURCE].get("optics-wavelength", "N/A"), sources=(ETHERNET_OPER_SOURCE,)),
+    ReportColumn("MTU", lambda row: row["interface"]["mtu"] or "N/A", fields=("mtu",), column_type="int"),
+    ReportColumn("MTU-IP", lambda row: row["properties"].get("mtu-ip", "N/A"), sources=("properties",), column_type="int"),
+    ReportColumn("ipv4-address", lambda row: row["interface"]["ipv4-addresses"], fields=("ipv4-addresses",), relations=("ip_addresses",)),
+    ReportColumn("ipv6-address", lambda row: row["interface"]["ipv6-addresses"], fields=("ipv6-addresses",), relations=("ip_addresses",)),
+    ReportColumn("interface-mac_address", lambda row: row["interface"]["mac-address"], sources=("state",), fields=("mac-address",)),
+    ReportColumn("members-count", lambda row: row["interface"]["members-count"], fields=("members-count",), relations=("member_interfaces",), column_type="int"),
+    ReportColumn("parent-interface", lambda row: row["interface"]["parent-interface"], fields=("parent-interface",), relations=("lag",)),
+    ReportColumn("802.1Q-mode", lambda row: row["interface"]["mode"], fields=("mode",)),
+    ReportColumn("untagged-vlan", lambda row: row["interface"]["untagged-vlan"], fields=("untagged-vlan",), relations=("untagged_vlan",)),
+    ReportColumn("tagged-vlan(s)", lambda row: row["interface"]["tagged-vlans"], fields=("tagged-vlans",), relations=("tagged_vlans",)),
+    ReportColumn("VRF", lambda row: row["interface"]["vrf"], fields=("vrf",), relations=("vrf",)),
+    ReportColumn("peer-name", lambda row: row["interface"]["peer-name"], fields=("peer-name",), relations=("_path",)),
+    ReportColumn("peer-interface", lambda row: row["interface"]["peer-interface"], fields=("peer-interface",), relations=("_path",)),
+    ReportColumn("peer-interface-parent", lambda row: row["interface"]["peer-interface-parent"], fields=("peer-interface-parent",), relations=("_path",)),
+    ReportColumn("Service-Policy Input", lambda row: (row["service-policy"].get("input-list", []) or [{"name": "N/A"}])[0].get("name")),
+    ReportColumn("Service-Policy Output_1", lambda row: get_output_policy(row, 0)),
+    ReportColumn("Service-Policy Output_2", lambda row: get_output_policy(row, 1)),
+]
+REPORT_COLUMNS_BY_HEADER = {column.header: column for column in REPORT_COLUMNS}
+
+# named column selections
+REPORT_PRESETS = {
+    "all": [column.header for column in REPORT_COLUMNS],
+    # Netbox only, no NSO call
+    "inventory": [column.header for column in REPORT_COLUMNS if not column.sources],
+}
+
+
+def select_columns(selection:str=""):
+    """
+        selection: comma separated column headers and/or preset names (see REPORT_PRESETS), all the columns if empty.
+        returns: [headers] in the selection order, raises ValueError on unknown columns.
+    """
+    headers = []
+    for name in [name.strip() for name in selection.split(",") if name.strip()] or ["all"]:
+        if name in REPORT_PRESETS:
+            headers.extend(REPORT_PRESETS[name])
+        elif name in REPORT_COLUMNS_BY_HEADER:
+            headers.append(name)
+        else:
+            raise ValueError(f"unknown report column: '{name}', supported: {list(REPORT_PRESETS)} or {list(REPORT_COLUMNS_BY_HEADER)}")
+    return list(dict.fromkeys(headers))
+
+
+def get_dependencies(headers:list):
+    """
+        returns: the data the given columns depend on:
+            {"sources": set, "fields": set, "relations": set, "device_relations": set}
+    """
+    dependencies = {"sources": set(), "fields": set(), "relations": set(), "device_relations": set()}
+    for header in headers:
+        column = REPORT_COLUMNS_BY_HEADER[header]
+        for key in dependencies:
+            dependencies[key].update(getattr(column, key))
+    return dependencies
+
+
+def get_column_types(headers:list):
+    return {header: REPORT_COLUMNS_BY_HEADER[header].column_type for header in headers if REPORT_COLUMNS_BY_HEADER[header].column_type}
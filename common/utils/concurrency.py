@@ -0,0 +1,94 @@
+from datetime import datetime
+from threading import Condition, Lock
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+        AIMD limit on the number of device tasks running concurrently, driven by the NSO response latency
+        and error/timeout rate (observed through Nso.add_latency_observer).
+
+        every `window` NSO responses:
+            > error rate above `max_error_rate` or average latency above `latency_tolerance` x the best
+              average seen so far (NSO is saturating): limit = limit x `decrease_factor` (multiplicative decrease)
+            > otherwise: limit = limit + 1 (additive increase)
+        the limit always stays within [min_workers, max_workers], the executor must have max_workers threads.
+
+        usage:
+            with limiter:
+                process(device)
+    """
+    def __init__(self, min_workers:int, max_workers:int, log_info, window:int=20, max_error_rate:float=0.1, latency_tolerance:float=2.0, decrease_factor:float=0.75):
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        self.limit = self.min_workers
+        self.log_info = log_info
+        self.window = window
+        self.max_error_rate = max_error_rate
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+
+        self.condition = Condition()
+        self.active = 0
+        self.samples_lock = Lock()
+        self.samples = []
+        self.best_latency = None
+        self.adjustments = []
+
+    def __enter__(self):
+        with self.condition:
+            while self.active >= self.limit:
+                self.condition.wait()
+            self.active += 1
+        return self
+
+    def __exit__(self, *args):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def observe(self, latency:float, error:bool):
+        "Nso latency observer: called after every NSO request"
+        with self.samples_lock:
+            self.samples.append((latency, error))
+            if len(self.samples) < self.window:
+                return
+            samples, self.samples = self.samples, []
+        avg_latency = sum(latency for latency, _ in samples) / len(samples)
+        error_rate = sum(1 for _, error in samples if error) / len(samples)
+        self.adjust(avg_latency, error_rate)
+
+    def adjust(self, avg_latency:float, error_rate:float):
+        with self.condition:
+            if self.best_latency is None or avg_latency < self.best_latency:
+                self.best_latency = avg_latency
+            previous_limit = self.limit
+            if error_rate > self.max_error_rate or avg_latency > self.best_latency * self.latency_tolerance:
+                self.limit = max(self.min_workers, int(self.limit * self.decrease_factor))
+                reason = "decrease"
+            else:
+                self.limit = min(self.max_workers, self.limit + 1)
+                reason = "increase"
+            # wake up waiting tasks if the limit was raised
+            self.condition.notify_all()
+            active = self.active
+        if self.limit != previous_limit:
+            self.adjustments.append({
+                "time": datetime.now().strftime('%H:%M:%S'),
+                "from": previous_limit,
+                "to": self.limit,
+                "avg_latency": avg_latency,
+                "error_rate": error_rate,
+            })
+            self.log_info(
+                f"{datetime.now().strftime('%H:%M:%S')} - concurrency {reason}: '{previous_limit}' -> '{self.limit}' workers "
+                f"(active: '{active}' avg NSO latency: '{avg_latency:.2f}s' best: '{self.best_latency:.2f}s' error rate: '{error_rate:.0%}')"
+            )
+
+    def get_adjustments_summary(self):
+        summary = [
+            "|  time  |  workers  |  avg NSO latency (s)  |  error rate  |",
+            "| :----: | :-------: | :-------------------: | :----------: |",
+        ]
+        for adjustment in self.adjustments:
+            summary.append(f"| {adjustment['time']} | {adjustment['from']} -> {adjustment['to']} | {adjustment['avg_latency']:.2f} | {adjustment['error_rate']:.0%} |")
+        return "\n".join(summary)
@@ -0,0 +1,192 @@
+from contextlib import contextmanager
+from re import compile as re_compile
+from threading import Lock, current_thread
+from time import monotonic
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from common.utils.functions import BoundedThreadPoolExecutor
+
+
+def ensure_usable_connection(alias:str=DEFAULT_DB_ALIAS):
+    """
+        health check of the current thread's DB connection, to be called between tasks (outside of any transaction):
+        a connection left broken (eg: by a DB restart) is closed, Django reconnects lazily on the next query.
+        returns: True if the connection was dropped
+    """
+    connection = connections[alias]
+    if connection.connection is None or connection.in_atomic_block:
+        return False
+    if connection.is_usable():
+        return False
+    connection.close()
+    return True
+
+
+class QueryProfiler:
+    """
+        connection.execute_wrapper counting the SQL queries and DB time per device and phase,
+        each query being attributed to the innermost tracer span open on the executing thread
+        (see common.utils.tracing.Tracer.current).
+        queries are also grouped by shape (literals replaced by '?') to spot the slowest and most repeated ones.
+
+        the wrapper is per connection, hence per thread: DatabaseThreadPoolExecutor(query_profiler=...) installs it
+        on its workers, install() on the current thread.
+    """
+    LITERALS = re_compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+    IN_LISTS = re_compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+        self.lock = Lock()
+        # {(device, phase): {"queries": int, "db_time": seconds}}
+        self.spans = {}
+        # {shape: {"count": int, "db_time": seconds, "max": seconds}}
+        self.shapes = {}
+
+    def get_shape(self, sql:str):
+        return self.IN_LISTS.sub("(?...)", self.LITERALS.sub("?", sql))
+
+    def __call__(self, execute, sql, params, many, context):
+        started = monotonic()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = monotonic() - started
+            device_name, phase = self.tracer.current() or ("N/A", "untraced")
+            shape = self.get_shape(sql)
+            with self.lock:
+                stats = self.spans.setdefault((device_name, phase), {"queries": 0, "db_time": 0.0})
+                stats["queries"] += 1
+                stats["db_time"] += duration
+                shape_stats = self.shapes.setdefault(shape, {"count": 0, "db_time": 0.0, "max": 0.0})
+                shape_stats["count"] += 1
+                shape_stats["db_time"] += duration
+                shape_stats["max"] = max(shape_stats["max"], duration)
+
+    @contextmanager
+    def install(self, alias:str=DEFAULT_DB_ALIAS):
+        "profiles the queries of the current thread"
+        with connections[alias].execute_wrapper(self):
+            yield self
+
+    def get_data(self):
+        "picklable/json-able counters, see merge"
+        with self.lock:
+            return {
+                "spans": [{"device": device_name, "phase": phase, **stats} for (device_name, phase), stats in self.spans.items()],
+                "shapes": {shape: dict(stats) for shape, stats in self.shapes.items()},
+            }
+
+    def merge(self, data:dict):
+        "adds the counters of another profiler (eg: returned by a shard job)"
+        with self.lock:
+            for span in data["spans"]:
+                stats = self.spans.setdefault((span["device"], span["phase"]), {"queries": 0, "db_time": 0.0})
+                stats["queries"] += span["queries"]
+                stats["db_time"] += span["db_time"]
+            for shape, shape_data in data["shapes"].items():
+                stats = self.shapes.setdefault(shape, {"count": 0, "db_time": 0.0, "max": 0.0})
+                stats["count"] += shape_data["count"]
+                stats["db_time"] += shape_data["db_time"]
+                stats["max"] = max(stats["max"], shape_data["max"])
+
+    def get_phases_summary(self):
+        phases = {}
+        with self.lock:
+            for (device_name, phase), stats in self.spans.items():
+                phase_stats = phases.setdefault(phase, {"devices": set(), "queries": 0, "db_time": 0.0})
+                phase_stats["devices"].add(device_name)
+                phase_stats["queries"] += stats["queries"]
+                phase_stats["db_time"] += stats["db_time"]
+        summary = [
+            "|  phase  |  devices  |  queries  |  queries/device  |  DB time (s)  |",
+            "| :-----: | :-------: | :-------: | :--------------: | :-----------: |",
+        ]
+        for phase, stats in sorted(phases.items(), key=lambda item: item[1]["queries"], reverse=True):
+            summary.append(f"| {phase} | {len(stats['devices'])} | {stats['queries']} | {stats['queries'] / len(stats['devices']):.1f} | {stats['db_time']:.1f} |")
+        return "\n".join(summary)
+
+    def get_shapes_summary(self, top:int=5, max_length:int=200):
+        with self.lock:
+            shapes = [(shape, dict(stats)) for shape, stats in self.shapes.items()]
+        summary = []
+        for title, key in (("slowest", "max"), ("most repeated", "count")):
+            summary.append(f"|  {title} SQL  |  count  |  DB time (s)  |  max (ms)  |")
+            summary.append("| :---------: | :-----: | :-----------: | :--------: |")
+            for shape, stats in sorted(shapes, key=lambda item: item[1][key], reverse=True)[:top]:
+                sql = shape[:max_length].replace("|", "\\|")
+                summary.append(f"| `{sql}` | {stats['count']} | {stats['db_time']:.1f} | {stats['max'] * 1000:.0f} |")
+            summary.append("")
+        return "\n".join(summary)
+
+
+class DatabaseThreadPoolExecutor(BoundedThreadPoolExecutor):
+    """
+        BoundedThreadPoolExecutor owning one Django DB connection per worker thread:
+            > the connection opened by the first task of a worker is reused by every later task of that worker
+            > health check before each task, see ensure_usable_connection
+            > the connections of all the workers are closed on shutdown, not left to the DB to time out
+            > per-thread query count and DB time, see get_db_summary
+            > optional QueryProfiler installed on every worker connection
+    """
+    def __init__(self, max_workers:int, alias:str=DEFAULT_DB_ALIAS, query_profiler=None, **kwargs):
+        super().__init__(max_workers=max_workers, initializer=self._init_worker, **kwargs)
+        self.alias = alias
+        self.query_profiler = query_profiler
+        self.worker_connections = []
+        self.db_stats = {}
+
+    def _init_worker(self):
+        stats = {"tasks": 0, "queries": 0, "db_time": 0.0, "reconnects": 0}
+        connection = connections[self.alias]
+
+        def count_queries(execute, sql, params, many, context):
+            started = monotonic()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                stats["queries"] += 1
+                stats["db_time"] += monotonic() - started
+
+        connection.execute_wrappers.append(count_queries)
+        if self.query_profiler:
+            connection.execute_wrappers.append(self.query_profiler)
+        with self.lock:
+            self.db_stats[current_thread().name] = stats
+            self.worker_connections.append(connection)
+
+    def _run_task(self, task_name:str, submitted_at:float, fn, *args, **kwargs):
+        stats = self.db_stats[current_thread().name]
+        stats["tasks"] += 1
+        if ensure_usable_connection(self.alias):
+            stats["reconnects"] += 1
+        return super()._run_task(task_name, submitted_at, fn, *args, **kwargs)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        super().shutdown(wait=wait, cancel_futures=cancel_futures)
+        if wait:
+            self.close_connections()
+
+    def close_connections(self):
+        "closes the worker connections, the workers must have exited"
+        with self.lock:
+            worker_connections, self.worker_connections = self.worker_connections, []
+        for connection in worker_connections:
+            # the connection belongs to the (exited) worker thread
+            connection.inc_thread_sharing()
+            try:
+                connection.close()
+            finally:
+                connection.dec_thread_sharing()
+
+    def get_db_summary(self):
+        with self.lock:
+            db_stats = dict(self.db_stats)
+        summary = [
+            "|  worker  |  tasks  |  queries  |  DB time (s)  |  reconnects  |",
+            "| :------: | :-----: | :-------: | :-----------: | :----------: |",
+        ]
+        for thread_name, stats in sorted(db_stats.items()):
+            summary.append(f"| {thread_name} | {stats['tasks']} | {stats['queries']} | {stats['db_time']:.1f} | {stats['reconnects']} |")
+        return "\n".join(summary)
@@ -0,0 +1,71 @@
+from contextlib import contextmanager
+from threading import local
+from time import monotonic
+
+from requests.exceptions import Timeout as TimeoutException
+
+
+class DeadlineExceeded(TimeoutException):
+    """
+        raised by Nso requests once the time budget of the current device task is spent.
+        subclass of the requests Timeout so that callers already handling NSO timeouts handle it as well.
+    """
+    pass
+
+
+_current = local()
+
+
+class Deadline:
+    """
+        total time budget of a task, optionally bounded by a parent deadline (eg: the job deadline).
+        seconds: budget of the task, None/0 means only bounded by the parent.
+    """
+    # seconds, shortest timeout given to a call made within the budget
+    MIN_TIMEOUT = 0.1
+
+    def __init__(self, seconds:float=None, parent=None):
+        self.expires_at = monotonic() + seconds if seconds else None
+        if parent is not None and parent.expires_at is not None:
+            self.expires_at = parent.expires_at if self.expires_at is None else min(self.expires_at, parent.expires_at)
+
+    def remaining(self):
+        "remaining seconds, None if unbounded"
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - monotonic())
+
+    def expired(self):
+        return self.expires_at is not None and monotonic() >= self.expires_at
+
+    def check(self, action:str=""):
+        if self.expired():
+            raise DeadlineExceeded(f"time budget exceeded before: '{action}'")
+
+    def get_timeout(self, timeout:float, action:str=""):
+        """
+            timeout of a call made within the budget: at most what is left of it, at least MIN_TIMEOUT.
+            raises DeadlineExceeded once the budget is spent, rather than handing out a zero timeout.
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        if remaining <= 0:
+            raise DeadlineExceeded(f"time budget exceeded before: '{action}'")
+        return max(self.MIN_TIMEOUT, min(timeout, remaining))
+
+
+def get_current_deadline():
+    "deadline of the task running on the current thread, None if no budget was set"
+    return getattr(_current, "deadline", None)
+
+
+@contextmanager
+def deadline_scope(deadline:Deadline):
+    "sets the deadline seen by every Nso request made from the current thread"
+    previous = get_current_deadline()
+    _current.deadline = deadline
+    try:
+        yield deadline
+    finally:
+        _current.deadline = previous
@@ -12,10 +12,14 @@ from manuf import manuf
 from datetime import datetime
 from common.utils.nso import Nso, UnsupportedInterfacefType, SkipInterfaceType, UnsupportedNedError
 from django.core.exceptions import ValidationError
+from django.db import connection, transaction, IntegrityError
 from json import dumps as json_dumps_
 from sys import exc_info
 from traceback import format_exc
 from requests.exceptions import Timeout as TimeoutException
+from threading import Lock
+from common.utils.tracing import Tracer, traced
+from common.utils.db import QueryProfiler
 
 
 class UnsupportedDeviceTypeOnboardingError(Exception):
@@ -44,6 +48,28 @@ class BannerNotCompliantError(Exception):
     pass
 
 
+# errors rolling back only the onboarding phase that raised them, see DeviceManager.run_onboarding_phase
+ONBOARDING_PHASE_ERRORS = (
+    LLDPNeighborsListEmpty,
+    InterfaceNotFoundOnNSOError,
+    UnsupportedNedError,
+    TimeoutException,
+    ValidationError,
+    IntegrityError,
+)
+# transient errors only, the other phase errors would be raised again by a retry (see retry_onboarding_phases)
+ONBOARDING_RETRYABLE_ERRORS = (
+    TimeoutException,
+    IntegrityError,
+)
+# optional onboarding phases, in order: addresses, vlans and cables depend on the device interfaces
+ONBOARDING_PHASES = ("interfaces", "addresses", "vlans", "cables")
+# serializes the creation of the global vlans, see DeviceManager.get_or_create_vlans:
+# the lock covers the threads of the process, the advisory lock the other processes (eg: RQ shards)
+VLANS_LOCK = Lock()
+VLANS_ADVISORY_LOCK_ID = 0x766c616e
+
+
 def split_interface_name(interface_name):
     match = re_match(r'([a-zA-Z\-]+)(\d.*)', interface_name)
     if match:
@@ -81,6 +107,48 @@ def get_manufacturer_by_mac(mac_address):
     return p.get_manuf(mac_address)
 
 
+class NsoDeviceData:
+    """
+        NSO payloads of a single device, fetched ahead of the Netbox writes (see DeviceManager.fetch_device_nso_data).
+        fetch errors are kept per item and re-raised when the item is read, so that the persist stage
+        handles them exactly where the inline NSO call would have raised.
+    """
+    def __init__(self, device_name:str, tracer=None):
+        self.device_name = device_name
+        self.tracer = tracer or Tracer()
+        self.items = {}
+        self.errors = {}
+        # {key: (method, args, kwargs)} of each fetched item, see refetch_failed
+        self.requests = {}
+
+    def fetch(self, key:str, method, *args, **kwargs):
+        self.requests[key] = (method, args, kwargs)
+        self.errors.pop(key, None)
+        # keys such as "peer:<name>" are traced under their prefix
+        try:
+            with self.tracer.span(self.device_name, f"nso:{key.split(':')[0]}"):
+                self.items[key] = method(*args, **kwargs)
+        except Exception as e:
+            self.errors[key] = e
+        return self.items.get(key)
+
+    def get(self, key:str, method, *args, **kwargs):
+        if key in self.errors:
+            raise self.errors[key]
+        if key in self.items:
+            return self.items[key]
+        # not prefetched, fallback to a live NSO call
+        return method(*args, **kwargs)
+
+    def refetch_failed(self):
+        "fetches again the items which failed to be fetched, returns their keys"
+        failed_keys = list(self.errors)
+        for key in failed_keys:
+            method, args, kwargs = self.requests[key]
+            self.fetch(key, method, *args, **kwargs)
+        return failed_keys
+
+
 class DeviceManager:
     def __init__(self, nso:object=None, with_logs:bool=True, log=[]):
         self.nso = None
@@ -103,10 +171,106 @@ class DeviceManager:
             self.log_failure = log[2]
             self.log_debug = log[3]
         self.duplex_mapping = {value: label.lower() for value, label in InterfaceDuplexChoices.CHOICES}
-
+        # per-run change tracking: {model name: {"saved": int, "skipped": int}}
+        self.changes = {}
+        self.changes_lock = Lock()
+        # per device/phase timings, see common.utils.tracing
+        self.tracer = Tracer()
+        # SQL queries per device/phase, installed on the worker connections (see DatabaseThreadPoolExecutor)
+        self.query_profiler = QueryProfiler(self.tracer)
+        # optional EthernetOperLane: interfaces operational mac addresses, see update_device_interfaces
+        self.ethernet_oper = None
+        # retries of the onboarding phases rolled back, see retry_onboarding_phases
+        self.phase_retries = 1
 
         ###########################################################################################
 
+    def has_changed(self, obj):
+        """
+            compares the object current field values against the snapshot() taken before it was updated.
+            objects without snapshot are considered as changed.
+        """
+        prechange_snapshot = getattr(obj, '_prechange_snapshot', None)
+        if prechange_snapshot is None:
+            return True
+        return obj.serialize_object() != prechange_snapshot
+
+    def save_if_changed(self, obj):
+        """
+            full_clean and save the object only if its fields were changed since its last snapshot(),
+            the snapshot is then refreshed so that the next call compares against the saved state.
+
+            returns True if the object was saved.
+        """
+        changed = self.has_changed(obj)
+        if changed:
+            obj.full_clean()
+            obj.save()
+            obj.snapshot()
+        with self.changes_lock:
+            self.changes.setdefault(type(obj).__name__, {"saved": 0, "skipped": 0})["saved" if changed else "skipped"] += 1
+        return changed
+
+    def get_changes_summary(self):
+        changes_summary = [
+            "|     object    |  saved  |  skipped (unchanged)  |",
+            "| :-----------: | :-----: | :-------------------: |",
+        ]
+        for model_name, counters in sorted(self.changes.items()):
+            changes_summary.append(f"| {model_name} | {counters['saved']} | {counters['skipped']} |")
+        return "\n".join(changes_summary)
+
+    def get_nso_data(self, nso_data, key:str, method, *args, **kwargs):
+        "returns the prefetched NSO item if any, calls NSO directly otherwise"
+        if nso_data is None:
+            return method(*args, **kwargs)
+        return nso_data.get(key, method, *args, **kwargs)
+
+    @traced("fetch")
+    def fetch_device_nso_data(self, device, onboard_interfaces:bool, retry:int, timeout:int):
+        """
+            fetch stage of the onboarding pipeline: pulls every NSO payload onboard_device needs
+            (banner, device-type, platform, interfaces config/oper-status, lldp and peers data)
+            without touching Netbox.
+        """
+        self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Started fetching NSO data for device: '{device.name}'") if self.with_logs else None
+        nso_data = NsoDeviceData(device.name, tracer=self.tracer)
+        nso_data.fetch("banner", self.nso.get_device_config, device=device.name, attribute="banner")
+        nso_data.fetch("device-type", self.nso.get_device, device=device.name, attribute="device-type")
+        nso_data.fetch("platform", self.nso.get_device, device=device.name, attribute="platform")
+        if onboard_interfaces:
+            nso_data.fetch("interface-data", self.get_device_interface_data, device, retry=retry, timeout=timeout)
+            lldp_data = nso_data.fetch(
+                "lldp",
+                self.nso.get_device_live_status,
+                device=device.name,
+                path="tailf-ned-cisco-ios-xr-stats:lldp",
+                retry=retry,
+                timeout=timeout
+            )
+            device_lldp_neighbors = lldp_data[0].get('neighbors', []) if lldp_data else []
+            for lldp_peering_data in device_lldp_neighbors:
+                peer_device_name = lldp_peering_data['device-id']
+                peer_interface_name = lldp_peering_data['port-id']
+                nso_peer_device_exists = nso_data.fetch(
+                    f"peer:{peer_device_name}",
+                    self.nso.get_device,
+                    device=peer_device_name,
+                    attribute="name"
+                )
+                if nso_peer_device_exists and nso_peer_device_exists[0] and not peer_interface_name.startswith("Bundle"):
+                    formatted_inter_name = peer_interface_name.replace('/', '%2F')
+                    nso_data.fetch(
+                        f"speed-duplex:{peer_device_name}:{peer_interface_name}",
+                        self.nso.get_device_live_status,
+                        device=peer_device_name,
+                        path=f"Cisco-IOS-XR-drivers-media-eth-oper:ethernet-interface/interfaces/interface={formatted_inter_name}/layer1-info?fields=speed;duplex",
+                        retry=retry,
+                        timeout=timeout,
+                    )
+        self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Finished fetching NSO data for device: '{device.name}'") if self.with_logs else None
+        return nso_data
+
     def get_or_create_csg_devices(self, limit_devices:list=[], limit:int=0, offset:int=0):
         if self.nso:
             # getting CSG devices from netbox
@@ -185,13 +349,13 @@ class DeviceManager:
         self.log_info(f"Updating device: '{device.name}' with tags: '{tag_name}'") if self.with_logs else None
         device.tags.add(tag)
 
-    def get_device_banner(self, device):
+    def get_device_banner(self, device, nso_data=None):
         self.log_info(f"Getting device: '{device.name}' banner from NSO.'") if self.with_logs else None
-        banner, resp = self.nso.get_device_config(device=device.name, attribute="banner")
+        banner, resp = self.get_nso_data(nso_data, "banner", self.nso.get_device_config, device=device.name, attribute="banner")
         return banner
 
-    def update_device_site(self, device):
-        banner = self.get_device_banner(device)
+    def update_device_site(self, device, nso_data=None):
+        banner = self.get_device_banner(device, nso_data=nso_data)
         nso_parsed_site_name = banner["exec"]["message"]
         if nso_parsed_site_name:
             site_name_match = re_search(r'site\s(\S+)', nso_parsed_site_name)
@@ -209,22 +373,22 @@ class DeviceManager:
         else:
             raise BannerNotCompliantError(f"has no exec banner message")
 
-    def get_device_type(self, device):
+    def get_device_type(self, device, nso_data=None):
         self.log_info(f"getting device type from NSO for device: '{device.name}'.'") if self.with_logs else None
-        nso_device_type, resp = self.nso.get_device(device=device.name, attribute="device-type")
+        nso_device_type, resp = self.get_nso_data(nso_data, "device-type", self.nso.get_device, device=device.name, attribute="device-type")
         try:
             return nso_device_type["cli"]["ned-id"]["#text"]
         except KeyError:
             raise UnsupportedDeviceTypeOnboardingError(f"device onboarding for: '{device.name}' from NSO to netbox is not supported for ned: '{nso_device_type}'")
 
-    def update_device_manufacturer(self, device):
-        nso_device_type = self.get_device_type(device)
+    def update_device_manufacturer(self, device, nso_data=None):
+        nso_device_type = self.get_device_type(device, nso_data=nso_data)
         if "cisco" in nso_device_type.casefold():
             nb_manufacturer = Manufacturer.objects.get(name="Cisco")
         else:
             raise UnsupportedDeviceTypeOnboardingError(f"device onboarding from NSO to netbox is not supported for ned: '{nso_device_type}'")
         self.log_info(f"getting/updating device model from NSO.'") if self.with_logs else None
-        nso_device_platform, resp = self.nso.get_device(device=device.name, attribute="platform")
+        nso_device_platform, resp = self.get_nso_data(nso_data, "platform", self.nso.get_device, device=device.name, attribute="platform")
         if nso_device_platform:
             if device.device_type.model == nso_device_platform["model"]:
                 self.log_info(f"device model is compliant with NSO: '{nso_device_platform['model']}'") if self.with_logs else None
@@ -247,15 +411,12 @@ class DeviceManager:
         )
         if created:
             self.log_info(f"Created new platform: '{device_platform['name']}' on netbox from NSO") if self.with_logs else None
-        else:
-            platform.snapshot()
+        platform.snapshot()
         platform.name = device_platform["name"]
         platform.slug = slugify(device_platform["name"])
         platform.manufacturer = device.device_type.manufacturer
 
-        platform.full_clean()
-
-        platform.save()
+        self.save_if_changed(platform)
         device.platform = platform
 
     def update_device_os_version(self, device, device_platform):
@@ -324,6 +485,7 @@ class DeviceManager:
             #######################################################################################
         return nso_local_device_interf_config, nso_interface_properties
 
+    @traced("match-interfaces")
     def get_or_create_device_interfaces(self, device, nso_interface_properties, nso_interf_config):
         # Query existing interfaces for the provided device
         interface_names = list(nso_interface_properties.keys())
@@ -484,17 +646,14 @@ class DeviceManager:
             )
             if created:
                 self.log_info(f"created '{afi}' ip_address: '{address_cidr}'") if self.with_logs else None
-            else:
-                ip_address.snapshot()
+            ip_address.snapshot()
             self.log_info(f"Assigning '{afi}' ip_address: '{address_cidr}' to device: '{device.name}' interface: '{nb_interface.name}'") if self.with_logs else None
             ip_address.assigned_object = nb_interface
-            ip_address.full_clean()
-            ip_address.save()
-        matched_interface.pop(afi)
+            self.save_if_changed(ip_address)
 
-    def create_device_connections(self, device, retry:int, timeout:int):
+    def create_device_connections(self, device, retry:int, timeout:int, nso_data=None):
         def get_nso_peer_device(peer_device_name):
-            nso_peer_device_exists, resp = self.nso.get_device(device=peer_device_name, attribute="name")
+            nso_peer_device_exists, resp = self.get_nso_data(nso_data, f"peer:{peer_device_name}", self.nso.get_device, device=peer_device_name, attribute="name")
             if not nso_peer_device_exists:
                 if peer_device_name not in self.peers_not_onboarded_on_nso:
                     self.peers_not_onboarded_on_nso.append(peer_device_name)
@@ -534,12 +693,10 @@ class DeviceManager:
             )
             if created:
                 self.log_info(f"created peer-device: '{peer_device.name}' on netbox") if self.with_logs else None
-            else:
-                peer_device.snapshot()
+            peer_device.snapshot()
 
             peer_device.device_type.manufacturer = nb_peer_manuf
-            peer_device.full_clean()
-            peer_device.save()
+            self.save_if_changed(peer_device)
             return peer_device
 
         def get_peer_device_interface(peer_device, peer_interface_name):
@@ -549,13 +706,15 @@ class DeviceManager:
             )
             if created:
                 self.log_info(f"created interface: '{peer_interface.name}' for peer-device: '{peer_device.name}' on netbox") if self.with_logs else None
-            else:
-                peer_interface.snapshot()
+            peer_interface.snapshot()
             return peer_interface
 
         def update_speed_duplex(peer_device, peer_interface, retry:int, timeout:int):
             formatted_inter_name = peer_interface.name.replace('/', '%2F')
-            peer_inter_speed_duplex, resp = self.nso.get_device_live_status(
+            peer_inter_speed_duplex, resp = self.get_nso_data(
+                nso_data,
+                f"speed-duplex:{peer_device.name}:{peer_interface.name}",
+                self.nso.get_device_live_status,
                 device=peer_device.name,
                 path=f"Cisco-IOS-XR-drivers-media-eth-oper:ethernet-interface/interfaces/interface={formatted_inter_name}/layer1-info?fields=speed;duplex",
                 retry=retry,
@@ -656,18 +815,19 @@ class DeviceManager:
                 peer_interface.mtu = local_interface.mtu
                 peer_interface.type = local_interface.type
                 create_cable_connection(local_interface, peer_interface, peer_device)
-            peer_interface.full_clean()
-            peer_interface.save()
+            self.save_if_changed(peer_interface)
 
         def create_peer_lags(peer_interfaces, retry:int, timeout:int):
             for lag_member_inter in peer_interfaces['interfaces']:
                 lag_member_inter.snapshot()
                 self.log_info(f"creating lag relation for peer device between peer device: '{lag_member_inter.device.name}' interface: '{lag_member_inter.name}' and lag: '{peer_interfaces['bundle'].name}'") if self.with_logs else None
                 lag_member_inter.lag = peer_interfaces['bundle']
-                lag_member_inter.full_clean()
-                lag_member_inter.save()
+                self.save_if_changed(lag_member_inter)
         self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Started getting lldp neibhors for device: '{device.name}' from NSO.") if self.with_logs else None
-        device_lldp_neighbors, resp = self.nso.get_device_live_status(
+        device_lldp_neighbors, resp = self.get_nso_data(
+            nso_data,
+            "lldp",
+            self.nso.get_device_live_status,
             device=device.name,
             path="tailf-ned-cisco-ios-xr-stats:lldp",
             retry=retry,
@@ -718,7 +878,105 @@ class DeviceManager:
         #     create_peer_lags(peer_interfaces)
         #     self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Finished creating bundles for peer_device: '{peer_device_name}' on Netbox.") if self.with_logs else None
 
+    @staticmethod
+    def get_nso_vids(nso_interface_config):
+        "dot1q vids of the NSO interfaces config: encapsulation > dot1q > vlan-id of any interface"
+        vids = set()
+        if isinstance(nso_interface_config, list):
+            for item in nso_interface_config:
+                vids |= DeviceManager.get_nso_vids(item)
+        elif isinstance(nso_interface_config, dict):
+            encapsulation = nso_interface_config.get("encapsulation")
+            vlan_ids = encapsulation.get("dot1q", {}).get("vlan-id") if isinstance(encapsulation, dict) else None
+            if vlan_ids:
+                vids.add(int(vlan_ids[0]))
+            for value in nso_interface_config.values():
+                if isinstance(value, (dict, list)):
+                    vids |= DeviceManager.get_nso_vids(value)
+        return vids
+
+    def get_or_create_vlans(self, vids):
+        """
+            returns: {vid: nb_vlan} of the global vlans named after their vid, the missing ones are created.
+
+            global vlans (no group nor site) have no unique constraint: devices persisted concurrently
+            and sharing a vid would each create their own copy. the lookup and creation are serialized by
+            VLANS_LOCK (and a PostgreSQL advisory lock) within their own transaction, committed before the
+            lock is released when called outside of the device transaction (see onboard_device).
+        """
+        vids = {int(vid) for vid in vids}
+        nb_vlans = {}
+        if not vids:
+            return nb_vlans
+        with VLANS_LOCK, transaction.atomic():
+            if connection.vendor == "postgresql":
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT pg_advisory_xact_lock(%s)", [VLANS_ADVISORY_LOCK_ID])
+            for nb_vlan in VLAN.objects.filter(vid__in=vids, name__in=[str(vid) for vid in vids]):
+                # the filter matches any (vid, name) combination, only vlans named after their own vid are kept
+                if nb_vlan.name == str(nb_vlan.vid):
+                    nb_vlans.setdefault(nb_vlan.vid, nb_vlan)
+
+            missing_vlans = [VLAN(vid=vid, name=str(vid)) for vid in vids if vid not in nb_vlans]
+            if missing_vlans:
+                for nb_vlan in VLAN.objects.bulk_create(missing_vlans):
+                    self.log_info(f"created vlan vid: '{nb_vlan.vid}' name: '{nb_vlan.name}'") if self.with_logs else None
+                    nb_vlans[nb_vlan.vid] = nb_vlan
+        return nb_vlans
+
+    def update_device_vlans(self, device, interfaces_vids):
+        """
+            Batched dot1q stage, replaces per interface VLAN.get_or_create + tagged_vlans.set:
+                > resolves the distinct vids of the device in one query (see get_or_create_vlans),
+                  they were already created by onboard_device before the device transaction
+                > writes the tagged_vlans through-table rows with a single bulk insert,
+                  interfaces whose tagged set is already correct are skipped.
+
+            interfaces_vids: {nb_interface: vid}
+        """
+        if not interfaces_vids:
+            return
+        #####################################################################################
+        vids = {int(vid) for vid in interfaces_vids.values()}
+        nb_vlans = self.get_or_create_vlans(vids)
+        #####################################################################################
+        TaggedVlans = Interface.tagged_vlans.through
+        current_tagged = {}
+        for interface_id, vlan_id in TaggedVlans.objects.filter(
+            interface_id__in=[nb_interface.id for nb_interface in interfaces_vids]
+        ).values_list('interface_id', 'vlan_id'):
+            current_tagged.setdefault(interface_id, set()).add(vlan_id)
+
+        stale_interfaces = []
+        new_rows = []
+        for nb_interface, vid in interfaces_vids.items():
+            vlan_id = nb_vlans[int(vid)].id
+            if current_tagged.get(nb_interface.id) == {vlan_id}:
+                continue
+            if nb_interface.id in current_tagged:
+                stale_interfaces.append(nb_interface.id)
+            new_rows.append(TaggedVlans(interface_id=nb_interface.id, vlan_id=vlan_id))
+
+        if stale_interfaces:
+            TaggedVlans.objects.filter(interface_id__in=stale_interfaces).delete()
+        if new_rows:
+            TaggedVlans.objects.bulk_create(new_rows)
+        self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - tagged vlans for device: '{device.name}' - vids: '{len(vids)}' updated interfaces: '{len(new_rows)}' unchanged interfaces: '{len(interfaces_vids) - len(new_rows)}'") if self.with_logs else None
+
+    def update_device_addresses(self, device, interfaces_addresses):
+        for afi, nb_interface, matched_interface in interfaces_addresses:
+            self.update_interface_address(afi, device, nb_interface, matched_interface)
+
     def update_device_interfaces(self, device, nb_interfaces, matched_interfaces, retry:int, timeout:int):
+        """
+            returns the collected dot1q vids and L3 addresses, which are applied by their own onboarding phases:
+                > update_device_vlans
+                > update_device_addresses
+        """
+        interfaces_vids = {}
+        interfaces_addresses = []
+        # fetched by the low priority lane, only what is already cached is applied
+        ethernet_oper = self.ethernet_oper.get(device.name) if self.ethernet_oper else {}
         #####################################################################################
         for nb_interface in nb_interfaces:
             nb_interface.snapshot()
@@ -743,18 +1001,14 @@ class DeviceManager:
                 if not matched_interface.get("encapsulation", {}):
                     matched_interface.pop("encapsulation", {})
 
-                dot1q_vid = dot1q_vid[0]
-                nb_vlan, created = VLAN.objects.get_or_create(vid=dot1q_vid, name=str(dot1q_vid))
-                if created:
-                    self.log_info(f"created vlan vid: '{dot1q_vid}' name: '{dot1q_vid}'") if self.with_logs else None
                 nb_interface.mode = InterfaceModeChoices.MODE_TAGGED
-                nb_interface.tagged_vlans.set([nb_vlan.id])
+                interfaces_vids[nb_interface] = dot1q_vid[0]
 
             # if L3:
             for i in [4, 6]:
                 afi = f"ipv{i}"
                 if afi in matched_interface.keys():
-                    self.update_interface_address(afi, device, nb_interface, matched_interface)
+                    interfaces_addresses.append((afi, nb_interface, {afi: matched_interface.pop(afi)}))
             # # if L2
             # nb_interface.enabled =  True if "up" in nso_interface['state'].casefold() else False
             # nb_interface.mtu = nso_interface['mtu']
@@ -764,117 +1018,184 @@ class DeviceManager:
                 interface_context_entry = device.local_context_data.setdefault('interfaces', {}).setdefault(nb_interface.name, {})
                 deep_merge(interface_context_entry, matched_interface)
             #####################################################################################
-            # takes too long due to NSO calls been slow
-            # self.update_interface_macaddress(device, nb_interface, retry=retry, timeout=timeout,)
+            # update_interface_macaddress takes too long due to NSO calls been slow, the ethernet-interface oper lane cache is used instead
+            mac_address = ethernet_oper.get(nb_interface.name, {}).get("mac-address")
+            if mac_address:
+                nb_interface.mac_address = mac_address
             #####################################################################################
-            nb_interface.full_clean()
-            nb_interface.save()
+            self.save_if_changed(nb_interface)
             self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Finished Updating interface: '{nb_interface.name}' for device: '{device.name}' on Netbox.") if self.with_logs else None
             #####################################################################################
-
-    def onboard_device_interfaces(self, device, onboard_interfaces, retry:int, timeout:int):
-        #################################################################################
-        nso_local_device_interf_config, nso_interface_properties = self.get_device_interface_data(device, retry=retry, timeout=timeout)
-        #################################################################################
-        nb_interfaces, matched_interfaces = self.get_or_create_device_interfaces(device=device, nso_interface_properties=nso_interface_properties, nso_interf_config=nso_local_device_interf_config)
+        return interfaces_vids, interfaces_addresses
+
+    def run_onboarding_phase(self, device, phase:str, onboarding_state:dict, method, *args, **kwargs):
+        """
+            runs an optional onboarding phase within its own savepoint:
+            a phase raising one of ONBOARDING_PHASE_ERRORS only rolls back its own writes
+            (and the device local_context_data it updated), the error is recorded in onboarding_state
+            along with the phase in 'failed-phases' if it is one of ONBOARDING_RETRYABLE_ERRORS (see retry_onboarding_phases).
+            the phases only read the results of the previous phases, so that a rolled back phase can run again from them.
+
+            returns: (successful, method result)
+        """
+        local_context_data = deepcopy(device.local_context_data)
+        self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Started phase: '{phase}' for device: '{device.name}' On Netbox") if self.with_logs else None
+        try:
+            with self.tracer.span(device.name, f"netbox:{phase}"), transaction.atomic():
+                result = method(*args, **kwargs)
+        except ONBOARDING_PHASE_ERRORS as e:
+            device.local_context_data = local_context_data
+            error_msg = f"phase: '{phase}' was rolled back for device: '{device.name}' - {e}"
+            self.log_failure(error_msg) if self.with_logs else None
+            onboarding_state['error-messages'].append(error_msg)
+            onboarding_state['successful'] = False
+            if isinstance(e, ONBOARDING_RETRYABLE_ERRORS):
+                onboarding_state.setdefault('failed-phases', {})[phase] = error_msg
+            return False, None
+        self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Finished phase: '{phase}' for device: '{device.name}' On Netbox") if self.with_logs else None
+        return True, result
+
+    def onboard_device_interfaces(self, device, onboard_interfaces, retry:int, timeout:int, nso_data=None, onboarding_state:dict=None, phases:tuple=ONBOARDING_PHASES, phase_results:dict=None):
+        """
+            runs the given onboarding phases (see ONBOARDING_PHASES) of the device interfaces.
+            phase_results: {phase: result}, the interfaces phase result is reused by the phases retried without it
+        """
+        def update_interfaces():
+            nso_local_device_interf_config, nso_interface_properties = self.get_nso_data(nso_data, "interface-data", self.get_device_interface_data, device, retry=retry, timeout=timeout)
+            nb_interfaces, matched_interfaces = self.get_or_create_device_interfaces(device=device, nso_interface_properties=nso_interface_properties, nso_interf_config=nso_local_device_interf_config)
+            self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Updating '{len(nb_interfaces)}' interfaces for device: '{device.name}' On Netbox") if self.with_logs else None
+            return self.update_device_interfaces(
+                device,
+                nb_interfaces,
+                matched_interfaces,
+                retry=retry,
+                timeout=timeout,
+            )
+        if onboarding_state is None:
+            onboarding_state = {"device-name": device.name, "successful": True, "error-messages": []}
+        if phase_results is None:
+            phase_results = {}
         #################################################################################
-        self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Started updating '{len(nb_interfaces)}' interfaces for device: '{device.name}' On Netbox") if self.with_logs else None
-        self.update_device_interfaces(
-            device,
-            nb_interfaces,
-            matched_interfaces,
-            retry=retry,
-            timeout=timeout,
-        )
-        self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Finished updating '{len(nb_interfaces)}' interfaces for device: '{device.name}' On Netbox") if self.with_logs else None
+        if "interfaces" in phases:
+            successful, phase_results["interfaces"] = self.run_onboarding_phase(device, "interfaces", onboarding_state, update_interfaces)
+            if not successful:
+                # addresses, vlans and cables all depend on the device interfaces
+                return onboarding_state
+        interfaces_vids, interfaces_addresses = phase_results["interfaces"]
         #################################################################################
-        self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Started creating/updating interface connections for device: '{device.name}' On Netbox") if self.with_logs else None
-        self.create_device_connections(device, retry=retry, timeout=timeout)
-        self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Finished creating/updating interface connections for device: '{device.name}' On Netbox") if self.with_logs else None
+        if "addresses" in phases:
+            self.run_onboarding_phase(device, "addresses", onboarding_state, self.update_device_addresses, device, interfaces_addresses)
+        if "vlans" in phases:
+            self.run_onboarding_phase(device, "vlans", onboarding_state, self.update_device_vlans, device, interfaces_vids)
+        if "cables" in phases:
+            self.run_onboarding_phase(device, "cables", onboarding_state, self.create_device_connections, device, retry=retry, timeout=timeout, nso_data=nso_data)
+        return onboarding_state
 
-    def onboard_device(self, device, onboard_interfaces:bool, retry:int, timeout:int):
+    def retry_onboarding_phases(self, device, onboard_interfaces:bool, retry:int, timeout:int, nso_data, onboarding_state:dict, phase_results:dict):
+        """
+            retries the phases rolled back by run_onboarding_phase once the device is committed, without redoing the whole device:
+                > the NSO items which failed to be fetched are fetched again first, outside of any transaction
+                > the retried phases then run within their own transaction
+        """
+        failed_phases = onboarding_state.pop('failed-phases')
+        # the phases depending on the device interfaces were skipped along with it
+        phases = ONBOARDING_PHASES if "interfaces" in failed_phases else tuple(phase for phase in ONBOARDING_PHASES if phase in failed_phases)
+        self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Retrying phases: {list(phases)} for device: '{device.name}'") if self.with_logs else None
+        onboarding_state['error-messages'] = [error_msg for error_msg in onboarding_state['error-messages'] if error_msg not in failed_phases.values()]
+        onboarding_state['successful'] = not onboarding_state['error-messages']
+        refetched_keys = nso_data.refetch_failed()
+        if refetched_keys:
+            self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - fetched again: {refetched_keys} NSO items for device: '{device.name}'") if self.with_logs else None
+        with transaction.atomic():
+            self.onboard_device_interfaces(device, onboard_interfaces, retry=retry, timeout=timeout, nso_data=nso_data, onboarding_state=onboarding_state, phases=phases, phase_results=phase_results)
+            self.save_if_changed(device)
+
+    def onboard_device(self, device, onboard_interfaces:bool, retry:int, timeout:int, nso_data=None):
+        """
+            onboards the device on Netbox from NSO.
+            nso_data: optional NsoDeviceData prefetched by fetch_device_nso_data, fetched here otherwise
+                      so that no NSO call is made while the device transaction is open.
+
+            the vlans of the device are created first, within their own transaction (see get_or_create_vlans),
+            the device is then onboarded within a single atomic block (one commit per device),
+            optional phases run within their own savepoints (see run_onboarding_phase),
+            the phases rolled back are retried after the commit, up to phase_retries times (see retry_onboarding_phases).
+        """
         onboarding_state = {
             "device-name": device.name,
             "successful": True,
             "error-messages": []
         }
+        phase_results = {}
         try:
-            device.snapshot()
+            if nso_data is None:
+                nso_data = self.fetch_device_nso_data(device, onboard_interfaces, retry=retry, timeout=timeout)
+            if onboard_interfaces and "interface-data" in nso_data.items:
+                nso_local_device_interf_config, nso_interface_properties = nso_data.items["interface-data"]
+                self.get_or_create_vlans(self.get_nso_vids(nso_local_device_interf_config))
+            with transaction.atomic():
+                self.onboard_device_atomic(device, onboard_interfaces, retry, timeout, nso_data, onboarding_state, phase_results)
+            for _ in range(self.phase_retries):
+                if not onboarding_state.get('failed-phases'):
+                    break
+                self.retry_onboarding_phases(device, onboard_interfaces, retry, timeout, nso_data, onboarding_state, phase_results)
+        except Exception as e_1:
 
+            error_msg = f"caught unhandled exception on device: '{device.name}'"
 
-            self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Started onboarding device: '{device.name}'") if self.with_logs else None
-            self.update_device_tags(device=device, tag_name="nso-onboarded")
+            error_msg = str(exc_info()[0](format_exc())).split(',')
+            error_msg = f"```{error_msg}\n" + ''.join(error_msg) + "\n```"
+            self.log_failure(error_msg)
+            onboarding_state['error-messages'].append(error_msg)
+            onboarding_state['successful'] = False
+        return onboarding_state
 
-            try:
-                self.update_device_site(device=device)
-            except (BannerNotCompliantError, UnsupportedNedError) as e:
-                error_msg = f"{e}"
-                self.log_failure(error_msg) if self.with_logs else None
-                onboarding_state['error-messages'].append(error_msg)
-                onboarding_state['successful'] = False
-                return onboarding_state
-            try:
-                nso_device_platform = self.update_device_manufacturer(device=device)
-            except UnsupportedDeviceTypeOnboardingError as e:
-                self.log_failure(error_msg) if self.with_logs else None
-                onboarding_state['error-messages'].append(error_msg)
-                onboarding_state['successful'] = False
-                return onboarding_state
-            try:
-                self.update_device_platform(device, nso_device_platform)
-            except ValidationError as e:
-                error_msg = f"{e}"
-                self.log_failure(error_msg) if self.with_logs else None
+    @traced("persist")
+    def onboard_device_atomic(self, device, onboard_interfaces:bool, retry:int, timeout:int, nso_data, onboarding_state:dict, phase_results:dict=None):
+        device.snapshot()
 
-                onboarding_state['error-messages'].append(error_msg)
-                onboarding_state['successful'] = False
-                return onboarding_state
+        self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Started onboarding device: '{device.name}'") if self.with_logs else None
+        self.update_device_tags(device=device, tag_name="nso-onboarded")
 
-            self.update_device_os_version(device, nso_device_platform)
-            self.update_device_serial_number(device, nso_device_platform)
+        try:
+            self.update_device_site(device=device, nso_data=nso_data)
+        except (BannerNotCompliantError, UnsupportedNedError) as e:
+            error_msg = f"{e}"
+            self.log_failure(error_msg) if self.with_logs else None
+            onboarding_state['error-messages'].append(error_msg)
+            onboarding_state['successful'] = False
+            return onboarding_state
+        try:
+            nso_device_platform = self.update_device_manufacturer(device=device, nso_data=nso_data)
+        except UnsupportedDeviceTypeOnboardingError as e:
+            error_msg = f"{e}"
+            self.log_failure(error_msg) if self.with_logs else None
+            onboarding_state['error-messages'].append(error_msg)
+            onboarding_state['successful'] = False
+            return onboarding_state
+        try:
+            self.update_device_platform(device, nso_device_platform)
+        except ValidationError as e:
+            error_msg = f"{e}"
+            self.log_failure(error_msg) if self.with_logs else None
 
-            self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Started saving device: '{device.name}'") if self.with_logs else None
-            device.full_clean()
-            self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Finished saving of device: '{device.name}'") if self.with_logs else None
+            onboarding_state['error-messages'].append(error_msg)
+            onboarding_state['successful'] = False
+            return onboarding_state
 
-            self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Started full_clean of device: '{device.name}'") if self.with_logs else None
-            device.save()
-            self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Finished full_clean device: '{device.name}'") if self.with_logs else None
+        self.update_device_os_version(device, nso_device_platform)
+        self.update_device_serial_number(device, nso_device_platform)
 
-            if onboard_interfaces:
-                try:
-                    self.onboard_device_interfaces(device, onboard_interfaces, retry=retry, timeout=timeout)
-                except (LLDPNeighborsListEmpty, InterfaceNotFoundOnNSOError, UnsupportedNedError, TimeoutException) as e:
-                    error_msg = f"{e}"
-                    self.log_failure(error_msg) if self.with_logs else None
-
-                    onboarding_state['error-messages'].append(error_msg)
-                    onboarding_state['successful'] = False
-                    self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Started full_clean of device: '{device.name}'") if self.with_logs else None
-                    device.full_clean()
-                    self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Finished full_clean of device: '{device.name}'") if self.with_logs else None
-
-                    self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Started saving of device: '{device.name}'") if self.with_logs else None
-                    device.save()
-                    self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Finished saving of device: '{device.name}'") if self.with_logs else None
-                    return onboarding_state
-            self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Started full_clean of device: '{device.name}'") if self.with_logs else None
-            device.full_clean()
-            self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Finished full_clean of device: '{device.name}'") if self.with_logs else None
-
-            self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Started saving of device: '{device.name}'") if self.with_logs else None
-            device.save()
-            self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Finished saving of device: '{device.name}'") if self.with_logs else None
-
-            self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Finished onboarding device: '{device.name}'") if self.with_logs else None
+        self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Started saving device: '{device.name}'") if self.with_logs else None
+        self.save_if_changed(device)
+        self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Finished saving of device: '{device.name}'") if self.with_logs else None
 
-        except Exception as e_1:
+        if onboard_interfaces:
+            self.onboard_device_interfaces(device, onboard_interfaces, retry=retry, timeout=timeout, nso_data=nso_data, onboarding_state=onboarding_state, phase_results=phase_results)
 
-            error_msg = f"caught unhandled exception on device: '{device.name}'"
+        self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Started saving of device: '{device.name}'") if self.with_logs else None
+        self.save_if_changed(device)
+        self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Finished saving of device: '{device.name}'") if self.with_logs else None
 
-            error_msg = str(exc_info()[0](format_exc())).split(',')
-            error_msg = f"```{error_msg}\n" + ''.join(error_msg) + "\n```"
-            self.log_failure(error_msg)
-            onboarding_state['error-messages'].append(error_msg)
-            onboarding_state['successful'] = False
+        self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Finished onboarding device: '{device.name}'") if self.with_logs else None
         return onboarding_state
@@ -0,0 +1,134 @@
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from datetime import datetime
+from fcntl import LOCK_EX, flock
+from json import dump as json_dump
+from json import load as json_load
+from os import makedirs, replace
+from os import path as os_path
+from threading import Lock
+from time import time
+
+from common.utils.deadline import deadline_scope
+from common.utils.parsing import reduce_ethernet_interfaces
+
+
+ETHERNET_OPER_PATH = "Cisco-IOS-XR-drivers-media-eth-oper:ethernet-interface/interfaces"
+# RESTCONF projection: only the fields used by the report and the onboarding are returned by the device
+ETHERNET_OPER_FIELDS = "interface(interface-name;phy-info/phy-details/optics-wavelength;mac-info/operational-mac-address)"
+
+
+class EthernetOperLane:
+    """
+        low priority fetch lane of the ethernet-interface oper data (optics wavelength, operational mac address),
+        a path too slow (minutes per device) to be fetched inline by the report or the onboarding:
+            > one projected request per device (see ETHERNET_OPER_FIELDS), at most max_in_flight across the job
+            > requests are made on a copy of the Nso client without its latency observers,
+              so that the slow lane never shrinks the main adaptive concurrency
+            > results are written through to a json cache on local disk, reused by later runs until max_age,
+              the cache file may be shared by several lanes (eg: one per RQ shard, see common.utils.sharding)
+
+        the main run only reads what is already cached (see get), it never waits on the lane.
+        cache: {"<device name>": {"fetched": timestamp, "interfaces": {"<interface>": {"optics-wavelength": str, "mac-address": str}}}}
+    """
+    def __init__(self, nso, cache_file:str, max_in_flight:int=2, max_age:int=86400, timeout:int=600, retry:int=1, log=[], with_logs:bool=True, deadline=None):
+        self.nso = copy(nso)
+        self.nso.latency_observers = []
+        self.cache_file = cache_file
+        self.max_age = max_age
+        self.timeout = timeout
+        self.retry = retry
+        # requests in flight are bounded by the job deadline only
+        self.deadline = deadline
+        self.log_info = log[0]
+        self.log_warning = log[1]
+        self.log_failure = log[2]
+        self.with_logs = with_logs
+        self.lock = Lock()
+        self.cache = {}
+        self.pending = {}
+        self.counters = {"cached": 0, "fetched": 0, "failed": 0, "cancelled": 0}
+        if os_path.exists(cache_file):
+            with open(cache_file) as f:
+                self.cache = json_load(f)
+        # unbounded queue: queuing every device of the job up front must never block the main run
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_in_flight), thread_name_prefix="ethernet-oper")
+
+    def is_fresh(self, device_name:str):
+        entry = self.cache.get(device_name)
+        return bool(entry) and time() - entry["fetched"] < self.max_age
+
+    def request(self, device_name:str):
+        "queues the device unless its cached data is still fresh or it is already queued"
+        with self.lock:
+            if device_name in self.pending:
+                return
+            if self.is_fresh(device_name):
+                self.counters["cached"] += 1
+                return
+            self.pending[device_name] = self.executor.submit(self.fetch, device_name)
+
+    def fetch(self, device_name:str):
+        start_time = datetime.now()
+        self.log_info(f"{start_time.strftime('%H:%M:%S')} - Started getting ethernet-interface oper data for device: '{device_name}' from NSO") if self.with_logs else None
+        try:
+            with deadline_scope(self.deadline):
+                interfaces, resp = self.nso.get_device_live_status(
+                    device=device_name,
+                    path=f"{ETHERNET_OPER_PATH}?fields={ETHERNET_OPER_FIELDS}",
+                    timeout=self.timeout,
+                    retry=self.retry,
+                    reducer=reduce_ethernet_interfaces,
+                )
+        except Exception as e:
+            self.log_warning(f"couldn't retrieve ethernet-interface oper data of device: '{device_name}' - {e}") if self.with_logs else None
+            with self.lock:
+                self.pending.pop(device_name, None)
+                self.counters["failed"] += 1
+            return
+        end_time = datetime.now()
+        self.log_info(f"{end_time.strftime('%H:%M:%S')} - Finished getting ethernet-interface oper data for device: '{device_name}' from NSO - it took: {end_time - start_time}") if self.with_logs else None
+        with self.lock:
+            self.pending.pop(device_name, None)
+            self.counters["fetched"] += 1
+            self.cache[device_name] = {"fetched": time(), "interfaces": interfaces or {}}
+            self.save()
+
+    def save(self):
+        """
+            write-through, called with the lock held: the cache file is replaced atomically.
+            the entries written meanwhile by the other lanes sharing the cache file are merged first (most recent fetch wins),
+            under an exclusive lock of '{cache_file}.lock' across processes.
+        """
+        directory = os_path.dirname(self.cache_file)
+        if not os_path.exists(directory):
+            makedirs(directory)
+        with open(f"{self.cache_file}.lock", mode='w') as lock_file:
+            flock(lock_file, LOCK_EX)
+            if os_path.exists(self.cache_file):
+                with open(self.cache_file) as f:
+                    for device_name, entry in json_load(f).items():
+                        if entry["fetched"] > self.cache.get(device_name, {}).get("fetched", 0):
+                            self.cache[device_name] = entry
+            tmp_file = f"{self.cache_file}.tmp"
+            with open(tmp_file, mode='w') as f:
+                json_dump(self.cache, f)
+            replace(tmp_file, self.cache_file)
+
+    def get(self, device_name:str):
+        "returns: {interface: {optics-wavelength, mac-address}} cached for the device, {} if not fetched (yet)"
+        with self.lock:
+            return dict(self.cache.get(device_name, {}).get("interfaces", {}))
+
+    def shutdown(self):
+        "drops the queued devices and waits for the requests in flight, which are still cached"
+        with self.lock:
+            self.counters["cancelled"] += sum(not future.running() and not future.done() for future in self.pending.values())
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def get_summary(self):
+        return "\n".join([
+            "|  cached (fresh)  |  fetched  |  failed  |  cancelled  |",
+            "| :--------------: | :-------: | :------: | :---------: |",
+            f"| {self.counters['cached']} | {self.counters['fetched']} | {self.counters['failed']} | {self.counters['cancelled']} |",
+        ])
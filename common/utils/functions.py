@@ -3,28 +3,185 @@ from yaml import full_load as yaml_full_load
 from yaml import load as yaml_load
 from yaml import Loader as yaml_loader
 
-from concurrent.futures import ThreadPoolExecutor
-from sys import exc_info
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from itertools import islice
+from math import ceil
+from threading import BoundedSemaphore, Lock
+from time import monotonic
 from traceback import format_exc
 
 
-class ThreadPoolExecutorStackTraced(ThreadPoolExecutor):
-    def submit(self, method_to_execute, *args, **kwargs):
-        """Submits the wrapped function instead of `method_to_execute`"""
-        return super(ThreadPoolExecutorStackTraced, self).submit(
-            self._function_wrapper,
-            method_to_execute,
-            *args, **kwargs
-        )
+def percentile(values:list, percent:float):
+    "nearest-rank percentile of the given values"
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, ceil(percent / 100 * len(values)) - 1))]
 
-    def _function_wrapper(self, method_to_execute, *args, **kwargs):
-        """Wraps `method_to_execute` in order to preserve raised exceptions
+
+class BoundedThreadPoolExecutor(ThreadPoolExecutor):
+    """
+        ThreadPoolExecutor with:
+            > bounded submission: submit() blocks once `max_pending` tasks are queued or running (backpressure)
+            > per-task metrics: queue-wait and run time
+            > structured exception capture: the original exception object is raised by future.result(),
+              it is kept in `errors` along with its type, message and traceback
+            > optional fail-fast: the first failure cancels every pending task, later submits return cancelled futures
+            > live progress callback: called with get_progress() at most every `progress_interval` seconds
+    """
+    def __init__(self, max_workers:int, max_pending:int=None, fail_fast:bool=False, progress_callback=None, progress_interval:int=60, total:int=None, **kwargs):
+        super().__init__(max_workers=max_workers, **kwargs)
+        self.max_pending = max_pending or max_workers * 2
+        self.slots = BoundedSemaphore(self.max_pending)
+        self.fail_fast = fail_fast
+        self.progress_callback = progress_callback
+        self.progress_interval = progress_interval
+        self.total = total
+        self.lock = Lock()
+        self.pending = set()
+        self.metrics = []
+        self.errors = []
+        self.failed = False
+        self.submitted = 0
+        self.started_at = monotonic()
+        self.last_progress = self.started_at
+
+    def submit(self, fn, *args, **kwargs):
+        return self.submit_named(getattr(fn, "__name__", str(fn)), fn, *args, **kwargs)
+
+    def submit_named(self, task_name:str, fn, *args, **kwargs):
+        "submits a task under the given name, used in metrics and errors"
+        self.slots.acquire()
+        if self.failed and self.fail_fast:
+            self.slots.release()
+            future = Future()
+            future.cancel()
+            return future
+        future = super().submit(self._run_task, task_name, monotonic(), fn, *args, **kwargs)
+        with self.lock:
+            self.submitted += 1
+            self.pending.add(future)
+        future.add_done_callback(self._task_done)
+        return future
+
+    def iter_completed(self, fn, items, get_name=str, window:int=None, **kwargs):
         """
+            submits fn(item, **kwargs) for each item while consuming the completed ones:
+            at most `window` (default max_pending) futures are held at once, so that results are handed over
+            as tasks complete instead of piling up in their futures until every item is submitted.
+            get_name: method(item) returning the task name
+            yields: (item, future) as each task completes
+        """
+        window = max(1, window or self.max_pending)
+        items = iter(items)
+        futures = {}
+        while True:
+            for item in islice(items, window - len(futures)):
+                futures[self.submit_named(get_name(item), fn, item, **kwargs)] = item
+            if not futures:
+                return
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield futures.pop(future), future
+
+    def _run_task(self, task_name:str, submitted_at:float, fn, *args, **kwargs):
+        started_at = monotonic()
+        error = None
         try:
-            return method_to_execute(*args, **kwargs)
-        except Exception:
-            # raise Exception.with_traceback(format_exc())
-            raise exc_info()[0](format_exc())
+            return fn(*args, **kwargs)
+        except Exception as e:
+            error = e
+            with self.lock:
+                self.errors.append({
+                    "task": task_name,
+                    "exception": e,
+                    "type": type(e).__name__,
+                    "message": str(e),
+                    "traceback": format_exc(),
+                })
+                self.failed = True
+            raise
+        finally:
+            with self.lock:
+                self.metrics.append({
+                    "task": task_name,
+                    "queue_wait": started_at - submitted_at,
+                    "run_time": monotonic() - started_at,
+                    "failed": error is not None,
+                })
+            if error is not None and self.fail_fast:
+                self.cancel_pending()
+
+    def _task_done(self, future):
+        with self.lock:
+            self.pending.discard(future)
+        self.slots.release()
+        if self.progress_callback:
+            now = monotonic()
+            with self.lock:
+                report = now - self.last_progress >= self.progress_interval or (self.total and len(self.metrics) >= self.total)
+                if report:
+                    self.last_progress = now
+            if report:
+                self.progress_callback(self.get_progress())
+
+    def cancel_pending(self):
+        with self.lock:
+            pending = list(self.pending)
+        for future in pending:
+            future.cancel()
+
+    def get_progress(self):
+        with self.lock:
+            done = len(self.metrics)
+            failed = sum(1 for metric in self.metrics if metric["failed"])
+            running = len(self.pending)
+        elapsed = monotonic() - self.started_at
+        progress = {
+            "done": done,
+            "failed": failed,
+            "submitted": self.submitted,
+            "running": running,
+            "total": self.total,
+            "elapsed": elapsed,
+            "eta": None,
+        }
+        if self.total and done:
+            progress["eta"] = elapsed / done * (self.total - done)
+        return progress
+
+    def get_metrics_summary(self, slowest:int=5):
+        with self.lock:
+            metrics = list(self.metrics)
+        queue_waits = [metric["queue_wait"] for metric in metrics]
+        run_times = [metric["run_time"] for metric in metrics]
+        summary = [
+            "|  tasks  |  failed  |  queue-wait p50/max (s)  |  run time p50/p95/max (s)  |",
+            "| :-----: | :------: | :----------------------: | :------------------------: |",
+            f"| {len(metrics)} | {sum(1 for metric in metrics if metric['failed'])} "
+            f"| {percentile(queue_waits, 50):.1f} / {max(queue_waits, default=0):.1f} "
+            f"| {percentile(run_times, 50):.1f} / {percentile(run_times, 95):.1f} / {max(run_times, default=0):.1f} |",
+        ]
+        if metrics:
+            summary.append("")
+            summary.append("|  slowest tasks  |  run time (s)  |")
+            summary.append("| :-------------: | :------------: |")
+            for metric in sorted(metrics, key=lambda metric: metric["run_time"], reverse=True)[:slowest]:
+                summary.append(f"| {metric['task']} | {metric['run_time']:.1f} |")
+        return "\n".join(summary)
+
+
+def log_progress(log, label:str, details=None):
+    """
+        returns a BoundedThreadPoolExecutor progress_callback logging with the given log method.
+        details: optional callable returning extra text appended to each progress line (eg: rows written)
+    """
+    def progress_callback(progress):
+        total = progress["total"] or progress["submitted"]
+        eta = f"{progress['eta']:.0f}s" if progress["eta"] is not None else "N/A"
+        extra = f" - {details()}" if details else ""
+        log(f"{label} progress: '{progress['done']}/{total}' done - '{progress['failed']}' failed - '{progress['running']}' queued/running - elapsed: '{progress['elapsed']:.0f}s' - ETA: '{eta}'{extra}")
+    return progress_callback
 
 
 def update_file(data, filename: str, overwrite=True, debug=False, chmod_=0o0660):
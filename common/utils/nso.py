@@ -3,7 +3,9 @@ from requests.exceptions import Timeout as TimeoutException
 import xmltodict
 import argparse
 from json import loads as json_loads
-from time import sleep
+from time import sleep, monotonic
+from common.utils.deadline import DeadlineExceeded, get_current_deadline
+from common.utils.parsing import run_parser, parse_xml, parse_json_content
 
 
 
@@ -81,6 +83,17 @@ class Nso(object):
         self.log_warning = kwargs.get("log")[1]
         self.log_failure = kwargs.get("log")[2]
         self.log_debug = kwargs.get("log")[3]
+        # callables(latency: float, error: bool) notified after every request attempt
+        self.latency_observers = []
+        # optional process pool decoding the payloads, see common.utils.parsing.create_parser_pool
+        self.parser_pool = kwargs.get("parser_pool")
+
+    def add_latency_observer(self, observer):
+        self.latency_observers.append(observer)
+
+    def notify_latency_observers(self, latency:float, error:bool):
+        for observer in self.latency_observers:
+            observer(latency, error)
 
     def request(self, method:str, url:str, headers:dict, ssl_verify:bool=False, timeout:int=5, retry:int=3, data:dict={}):
         kwargs = {
@@ -94,16 +107,29 @@ class Nso(object):
 
         if data:
             kwargs.update({"json": data})
+        # time budget of the current device task, each call/retry only gets what is left of it
+        deadline = get_current_deadline()
         delay = 5  # start retry after 3 seconds
         for i in range(retry):
+            if deadline:
+                kwargs["timeout"] = deadline.get_timeout(timeout, f"{method} {url}")
+            started = monotonic()
             try:
                 resp = request(**kwargs)
+                self.notify_latency_observers(monotonic() - started, resp.status_code >= 500)
                 break
-            except TimeoutException:
+            except TimeoutException as e:
+                self.notify_latency_observers(monotonic() - started, True)
+                if deadline and deadline.expired():
+                    raise DeadlineExceeded(f"time budget exceeded while waiting for: '{method} {url}'") from e
                 if i == retry - 1:  # if it is the last retry
                     raise  # re-raise the last exception
                 else:
-                    self.log_warning(f"Timeout exception caught, timedout after: '{timeout}' waiting for {delay} seconds before retrying for: {i+2}/{retry} times...")
+                    remaining = deadline.remaining() if deadline else None
+                    if remaining is not None:
+                        # the next attempt raises DeadlineExceeded if nothing is left
+                        delay = min(delay, remaining)
+                    self.log_warning(f"Timeout exception caught, timedout after: '{kwargs['timeout']}' waiting for {delay} seconds before retrying for: {i+2}/{retry} times...")
                     sleep(delay)
                     delay *= 2  # double the delay
         return resp
@@ -147,7 +173,7 @@ class Nso(object):
         resp = self.request("GET", url, headers)
 
         if resp.status_code == 200:
-            parsed_resp = xmltodict.parse(resp.text)
+            parsed_resp = run_parser(self.parser_pool, parse_xml, resp.text)
         else:
             parsed_resp = {}
         if attribute:
@@ -188,16 +214,17 @@ class Nso(object):
 
         parsed_resp = {}
         if resp.status_code == 200:
-            parsed_resp = resp.json()
-            parsed_resp = parsed_resp.get(list(parsed_resp.keys())[0])
+            parsed_resp = run_parser(self.parser_pool, parse_json_content, resp.text)
 
         if attribute:
             parsed_resp = parsed_resp.get(f"{ned_id}:{attribute}", parsed_resp)
 
         return parsed_resp, resp
 
-    def get_device_live_status(self, device:str, path:str="", timeout:int=30, retry:int=3):
+    def get_device_live_status(self, device:str, path:str="", timeout:int=30, retry:int=3, reducer=None):
         """
+            reducer: optional picklable method(content) applied to the parsed payload (within the parser pool if any)
+
             eg: get lldp:
                     path="tailf-ned-cisco-ios-xr-stats:lldp"
                     > live-status/tailf-ned-cisco-ios-xr-stats:lldp"
@@ -217,8 +244,7 @@ class Nso(object):
 
         parsed_response = {}
         if resp.status_code == 200:
-            parsed_response = resp.json()
-            parsed_response = parsed_response.get(list(parsed_response.keys())[0])
+            parsed_response = run_parser(self.parser_pool, parse_json_content, resp.text, reducer)
         return parsed_response, resp
 
     # utility method to match netbox type with nso type
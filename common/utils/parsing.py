@@ -0,0 +1,120 @@
+"""
+    CPU-bound parsing of the NSO payloads and report rows, runnable in worker processes.
+    everything in this module must stay free of Django/ORM imports and operate on plain picklable data:
+    the parent process owns the database, the workers only decode payloads and return compact records.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from json import loads as json_loads
+from multiprocessing import get_context
+
+import xmltodict
+
+from common.utils.columns import NSO_SOURCES, ETHERNET_OPER_SOURCE, REPORT_COLUMNS_BY_HEADER
+
+
+def create_parser_pool(processes:int):
+    """
+        returns: a process pool for the parsing functions below, None if processes is 0 (parsing stays inline).
+        the workers are spawned, not forked: the parent runs worker threads and holds DB connections.
+    """
+    if not processes:
+        return None
+    return ProcessPoolExecutor(max_workers=processes, mp_context=get_context("spawn"))
+
+
+def run_parser(pool, method, *args):
+    "runs the parsing method in the pool if any (the calling thread waits without holding the GIL), inline otherwise"
+    if pool is None:
+        return method(*args)
+    return pool.submit(method, *args).result()
+
+
+def parse_xml(text:str):
+    return xmltodict.parse(text)
+
+
+def parse_json_content(text:str, reducer=None):
+    """
+        decodes a RESTCONF json payload and returns the content of its top level key,
+        reduced by reducer(content) if given (reducers must be module level functions to be picklable).
+    """
+    parsed = json_loads(text)
+    content = parsed.get(list(parsed.keys())[0])
+    if reducer and content:
+        return reducer(content)
+    return content
+
+
+############################################################################
+# report reducers: keep only the fields used by build_report_rows, keyed by interface
+def reduce_interfaces_state(content:dict):
+    "ietf-interfaces:interfaces-state"
+    return {
+        entry['name']: {
+            "admin-status": entry.get("admin-status"),
+            "oper-status": entry.get("oper-status", "N/A"),
+            "phys-address": entry.get("phys-address"),
+            "speed": entry.get("speed"),
+        }
+        for entry in content.get('interface', [])
+    }
+
+
+def reduce_interface_properties(content:dict):
+    "Cisco-IOS-XR-ifmgr-oper:interface-properties/data-nodes"
+    interfaces = content.get('data-node', [{}])[0].get("system-view", {}).get('interfaces', {}).get('interface', {})
+    return {
+        entry['interface-name']: {
+            "line-state": entry.get("line-state"),
+            "bandwidth": entry.get("bandwidth"),
+            "mtu-ip": entry.get("ietf-ip:ipv4", {"mtu": "N/A"}).get("mtu", "N/A"),
+        }
+        for entry in interfaces
+    }
+
+
+def reduce_optics(content:list):
+    "tailf-ned-cisco-ios-xr-stats:controllers/Optics"
+    optics = {}
+    for entry in content:
+        vendor_details = entry.get("instance", {}).get("transceiver-vendor-details", {})
+        optics[entry['id']] = {
+            "optics-type": vendor_details.get("optics-type", "N/A"),
+            "part-number": vendor_details.get("part-number", "N/A"),
+        }
+    return optics
+
+
+def reduce_ethernet_interfaces(content:dict):
+    "Cisco-IOS-XR-drivers-media-eth-oper:ethernet-interface/interfaces"
+    return {
+        entry['interface-name']: {
+            # phy-details is nested under phy-info in the model, kept at the top level for older payloads
+            "optics-wavelength": entry.get("phy-info", entry).get("phy-details", {}).get("optics-wavelength", "N/A"),
+            "mac-address": entry.get("mac-info", {}).get("operational-mac-address"),
+        }
+        for entry in content.get("interface", [])
+    }
+
+
+def build_report_rows(headers:list, device_record:dict, interface_records:list, sources:dict):
+    """
+        builds the report rows of a device for the given columns (see common.utils.columns.REPORT_COLUMNS) from:
+            > device_record/interface_records: plain dicts snapshotted from Netbox by the parent
+            > sources: {source name: reduced NSO payload}, see reduce_*, missing sources are read as empty
+    """
+    extractors = [REPORT_COLUMNS_BY_HEADER[header].extractor for header in headers]
+    service_policies = device_record["service-policies"]
+    data_rows = []
+    for interface in interface_records:
+        row = {
+            "device": device_record,
+            "interface": interface,
+            "service-policy": service_policies.get(interface["name"], {}),
+            "optics": sources.get("optics", {}).get(interface.get("optics-id"), {}),
+        }
+        for source in (*NSO_SOURCES, ETHERNET_OPER_SOURCE):
+            if source != "optics":
+                row[source] = sources.get(source, {}).get(interface["name"], {})
+        data_rows.append([extractor(row) for extractor in extractors])
+    return data_rows
@@ -0,0 +1,240 @@
+from datetime import datetime
+from queue import Queue
+from threading import Lock
+from time import monotonic
+from traceback import format_exc
+from common.utils.deadline import Deadline, DeadlineExceeded, deadline_scope
+from common.utils.functions import log_progress
+from common.utils.db import DatabaseThreadPoolExecutor, ensure_usable_connection
+
+
+def record_onboarding_cost(cost_history, device, nso_data, fetch_time:float, persist_time:float):
+    "records the fetch and persist runtimes of the device, along with its interfaces and lldp neighbors counts if fetched"
+    interfaces = lldp_neighbors = None
+    if nso_data is not None:
+        interface_data = nso_data.items.get("interface-data")
+        if interface_data:
+            interfaces = len(interface_data[1])
+        lldp_data = nso_data.items.get("lldp")
+        if lldp_data and lldp_data[0]:
+            lldp_neighbors = len(lldp_data[0].get('neighbors', []))
+    cost_history.record(
+        device.name,
+        phases={"fetch": fetch_time, "persist": persist_time},
+        interfaces=interfaces,
+        lldp_neighbors=lldp_neighbors,
+    )
+
+
+class OnboardingPipeline:
+    """
+        Two-stage onboarding:
+            > fetch stage: high concurrency, pulls the NSO payloads of each device (DeviceManager.fetch_device_nso_data)
+            > persist stage: low concurrency, applies them to Netbox (DeviceManager.onboard_device)
+
+        both stages are connected by a bounded queue, fetch workers block on a full queue (backpressure)
+        so that NSO data never piles up faster than the database can absorb it.
+
+        each device fetch gets a total time budget (device_timeout, bounded by job_deadline) seen by every
+        Nso request it makes, its persist gets a budget of its own for the fallback Nso requests made from the
+        persist stage (time spent waiting in the queue is not charged to the device).
+        devices running out of budget in either stage are set aside and retried once (fetch and persist)
+        after the rest of the job, bounded by the job deadline only.
+
+        both stages run on DatabaseThreadPoolExecutor workers: one DB connection per thread, closed at the end of the run.
+    """
+    def __init__(self, dm, fetch_workers:int=10, persist_workers:int=2, queue_size:int=10, log=[], checkpoint=None, cost_history=None, device_timeout:int=0, job_deadline=None, limiter=None):
+        self.dm = dm
+        # optional AdaptiveConcurrencyLimiter, fetch_workers is then its upper bound
+        self.limiter = limiter
+        self.checkpoint = checkpoint
+        self.cost_history = cost_history
+        self.device_timeout = device_timeout
+        self.job_deadline = job_deadline
+        self.retry_devices = []
+        self.fetch_workers = max(1, fetch_workers)
+        self.persist_workers = max(1, persist_workers)
+        self.queue = Queue(maxsize=max(1, queue_size))
+        self.log_info = log[0]
+        self.log_warning = log[1]
+        self.log_failure = log[2]
+        self.log_debug = log[3]
+
+        self.lock = Lock()
+        self.results = []
+        self.metrics = {
+            "fetch": {"devices": 0, "busy_time": 0.0, "start": None, "end": None},
+            "persist": {"devices": 0, "busy_time": 0.0, "start": None, "end": None},
+            "queue": {"samples": 0, "depth_sum": 0, "max_depth": 0, "blocked_time": 0.0},
+        }
+
+    def _update_stage_metrics(self, stage:str, started:float, ended:float):
+        with self.lock:
+            metrics = self.metrics[stage]
+            metrics["devices"] += 1
+            metrics["busy_time"] += ended - started
+            metrics["start"] = started if metrics["start"] is None else min(metrics["start"], started)
+            metrics["end"] = ended if metrics["end"] is None else max(metrics["end"], ended)
+
+    def _sample_queue_depth(self):
+        depth = self.queue.qsize()
+        with self.lock:
+            metrics = self.metrics["queue"]
+            metrics["samples"] += 1
+            metrics["depth_sum"] += depth
+            metrics["max_depth"] = max(metrics["max_depth"], depth)
+
+    def _fetch(self, device, onboard_interfaces:bool, retry:int, timeout:int, retry_pass:bool=False):
+        if self.limiter:
+            with self.limiter:
+                return self._fetch_device(device, onboard_interfaces, retry, timeout, retry_pass)
+        return self._fetch_device(device, onboard_interfaces, retry, timeout, retry_pass)
+
+    def _fetch_device(self, device, onboard_interfaces:bool, retry:int, timeout:int, retry_pass:bool=False):
+        started = monotonic()
+        # the retry pass is only bounded by the job deadline
+        deadline = Deadline(None if retry_pass else self.device_timeout, parent=self.job_deadline)
+        try:
+            with deadline_scope(deadline):
+                nso_data = self.dm.fetch_device_nso_data(device, onboard_interfaces, retry=retry, timeout=timeout)
+        except Exception:
+            # NsoDeviceData keeps per-item errors, anything reaching here is unexpected
+            self.log_failure(f"```\nfetch stage failed for device: '{device.name}'\n{format_exc()}\n```")
+            nso_data = None
+        fetch_time = monotonic() - started
+        self._update_stage_metrics("fetch", started, started + fetch_time)
+
+        if not retry_pass and nso_data is not None and any(isinstance(e, DeadlineExceeded) for e in nso_data.errors.values()):
+            self.log_warning(f"{datetime.now().strftime('%H:%M:%S')} - device: '{device.name}' exceeded its time budget of: '{self.device_timeout}' seconds, it will be retried after the other devices.")
+            with self.lock:
+                self.retry_devices.append(device)
+            return
+
+        put_started = monotonic()
+        self.queue.put((device, nso_data, fetch_time, retry_pass))
+        with self.lock:
+            self.metrics["queue"]["blocked_time"] += monotonic() - put_started
+        self._sample_queue_depth()
+
+    def _persist(self, onboard_interfaces:bool, retry:int, timeout:int):
+        """
+            persist worker loop, until its None sentinel.
+            every item is marked done and a failing device never stops the worker: queue.join() and the fetch workers
+            blocked on the bounded queue would otherwise wait forever.
+        """
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self._persist_device(*item, onboard_interfaces, retry, timeout)
+            except Exception:
+                device = item[0]
+                self.log_failure(f"```\npersist stage failed for device: '{device.name}'\n{format_exc()}\n```")
+                with self.lock:
+                    self.results.append({
+                        "device-name": device.name,
+                        "successful": False,
+                        "error-messages": [f"persist stage failed for device: '{device.name}'"],
+                    })
+            finally:
+                self.queue.task_done()
+
+    def _persist_device(self, device, nso_data, fetch_time:float, retry_pass:bool, onboard_interfaces:bool, retry:int, timeout:int):
+        self._sample_queue_depth()
+        # a persist worker lives for the whole run, check its connection between devices
+        ensure_usable_connection()
+        started = monotonic()
+        deadline = Deadline(None if retry_pass else self.device_timeout, parent=self.job_deadline)
+        if nso_data is None:
+            result = {
+                "device-name": device.name,
+                "successful": False,
+                "error-messages": [f"failed to fetch NSO data for device: '{device.name}'"],
+            }
+        else:
+            with deadline_scope(deadline):
+                result = self.dm.onboard_device(
+                    device=device,
+                    onboard_interfaces=onboard_interfaces,
+                    retry=retry,
+                    timeout=timeout,
+                    nso_data=nso_data,
+                )
+        ended = monotonic()
+        self._update_stage_metrics("persist", started, ended)
+        if not retry_pass and not result["successful"] and deadline.expired():
+            self.log_warning(f"{datetime.now().strftime('%H:%M:%S')} - device: '{device.name}' exceeded its persist time budget of: '{self.device_timeout}' seconds, it will be retried after the other devices.")
+            with self.lock:
+                self.retry_devices.append(device)
+            return
+        if self.cost_history:
+            record_onboarding_cost(self.cost_history, device, nso_data, fetch_time, ended - started)
+        if self.checkpoint:
+            # failed devices are processed again by a resumed job
+            self.checkpoint.record(device.name, result, successful=result["successful"])
+        with self.lock:
+            self.results.append(result)
+
+    def run(self, devices:list, onboard_interfaces:bool, retry:int, timeout:int):
+        "devices are submitted in the given order, see CostHistory.order"
+        self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Started onboarding pipeline for: '{len(devices)}' devices - fetch workers: '{self.fetch_workers}' persist workers: '{self.persist_workers}' queue size: '{self.queue.maxsize}'")
+        persist_executor = DatabaseThreadPoolExecutor(max_workers=self.persist_workers, query_profiler=self.dm.query_profiler)
+        persist_futures = [
+            persist_executor.submit_named(f"persist-{i}", self._persist, onboard_interfaces, retry, timeout)
+            for i in range(self.persist_workers)
+        ]
+
+        try:
+            executor = DatabaseThreadPoolExecutor(
+                max_workers=self.fetch_workers,
+                query_profiler=self.dm.query_profiler,
+                total=len(devices),
+                progress_callback=log_progress(self.log_info, "fetch stage"),
+            )
+            with executor:
+                # devices are submitted as others complete, see BoundedThreadPoolExecutor.iter_completed
+                for device, future in executor.iter_completed(self._fetch, devices, get_name=lambda device: device.name, onboard_interfaces=onboard_interfaces, retry=retry, timeout=timeout):
+                    future.result()
+                # stragglers of the persist stage are only known once every fetched device is persisted
+                self.queue.join()
+
+                if self.retry_devices:
+                    self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - retrying: '{len(self.retry_devices)}' devices which exceeded their time budget: {[device.name for device in self.retry_devices]}")
+                    executor.total += len(self.retry_devices)
+                    for device, future in executor.iter_completed(self._fetch, self.retry_devices, get_name=lambda device: device.name, onboard_interfaces=onboard_interfaces, retry=retry, timeout=timeout, retry_pass=True):
+                        future.result()
+            self.log_info(f"fetch stage tasks:\n{executor.get_metrics_summary()}")
+            self.log_info(f"fetch stage DB connections:\n{executor.get_db_summary()}")
+            if self.limiter:
+                self.log_info(f"fetch stage concurrency adjustments:\n{self.limiter.get_adjustments_summary()}")
+        finally:
+            # the persist workers drain the queue and exit on their sentinel, even if the fetch stage failed
+            with persist_executor:
+                for _ in persist_futures:
+                    self.queue.put(None)
+                for future in persist_futures:
+                    future.result()
+        self.log_info(f"persist stage DB connections:\n{persist_executor.get_db_summary()}")
+
+        self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Finished onboarding pipeline:\n{self.get_metrics_summary()}")
+        return self.results
+
+    def get_metrics_summary(self):
+        summary = [
+            "|  stage  |  workers  |  devices  |  wall time (s)  |  busy time (s)  |  throughput (devices/min)  |",
+            "| :-----: | :-------: | :-------: | :-------------: | :-------------: | :------------------------: |",
+        ]
+        for stage, workers in (("fetch", self.fetch_workers), ("persist", self.persist_workers)):
+            metrics = self.metrics[stage]
+            wall_time = (metrics["end"] - metrics["start"]) if metrics["start"] is not None else 0.0
+            throughput = metrics["devices"] / wall_time * 60 if wall_time else 0.0
+            summary.append(f"| {stage} | {workers} | {metrics['devices']} | {wall_time:.1f} | {metrics['busy_time']:.1f} | {throughput:.2f} |")
+
+        queue_metrics = self.metrics["queue"]
+        avg_depth = queue_metrics["depth_sum"] / queue_metrics["samples"] if queue_metrics["samples"] else 0.0
+        summary.append("")
+        summary.append("|  queue size  |  max depth  |  avg depth  |  fetch blocked on full queue (s)  |")
+        summary.append("| :----------: | :---------: | :---------: | :-------------------------------: |")
+        summary.append(f"| {self.queue.maxsize} | {queue_metrics['max_depth']} | {avg_depth:.1f} | {queue_metrics['blocked_time']:.1f} |")
+        return "\n".join(summary)
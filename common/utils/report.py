@@ -0,0 +1,441 @@
+from concurrent.futures import FIRST_COMPLETED, wait
+from contextlib import closing
+from datetime import datetime
+from functools import partial
+from dcim.models import Device, Interface
+from dcim.utils import decompile_path_node
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils import timezone
+from requests.exceptions import Timeout as TimeoutException
+from requests.exceptions import ConnectionError
+from common.utils.deadline import DeadlineExceeded, deadline_scope, get_current_deadline
+from common.utils.parsing import (
+    run_parser,
+    build_report_rows,
+    reduce_interfaces_state,
+    reduce_interface_properties,
+    reduce_optics,
+    reduce_ethernet_interfaces,
+)
+from common.utils.columns import NSO_SOURCES, ETHERNET_OPER_SOURCE, REPORT_PRESETS, get_dependencies
+from common.utils.row_cache import get_fingerprint
+
+# live-status paths of the report and the reducers compacting their payloads
+REPORT_PATHS_REDUCERS = {
+    "ietf-interfaces:interfaces-state": reduce_interfaces_state,
+    "Cisco-IOS-XR-ifmgr-oper:interface-properties/data-nodes": reduce_interface_properties,
+    "tailf-ned-cisco-ios-xr-stats:controllers/Optics": reduce_optics,
+    "Cisco-IOS-XR-drivers-media-eth-oper:ethernet-interface/interfaces": reduce_ethernet_interfaces,
+}
+PATH_SOURCES = {path: source for source, path in NSO_SOURCES.items()}
+
+# partitioned report outputs: {partition_by: (method(device) returning its partition, device relations it reads)}
+REPORT_PARTITIONS = {
+    "site": (lambda device: device.site.name if device.site else "N/A", ("site",)),
+    "model": (lambda device: device.device_type.model, ("device_type",)),
+    "os-version": (lambda device: (device.local_context_data or {}).get("os_version", "N/A"), ()),
+}
+
+
+# interface relations a report column may depend on (see common.utils.columns.ReportColumn.relations)
+SELECT_RELATIONS = ('lag', 'vrf', 'untagged_vlan', '_path')
+PREFETCH_RELATIONS = ('ip_addresses', 'tagged_vlans', 'member_interfaces')
+
+
+def get_report_interfaces(device, relations:set=None):
+    """
+        interfaces of the device with the relations read by get_interface_record loaded upfront (all of them if None):
+        the row building then runs from memory with a fixed number of queries per device
+        (interfaces + 1 per prefetched relation + the peers, see get_connected_interfaces).
+    """
+    if relations is None:
+        relations = set(SELECT_RELATIONS + PREFETCH_RELATIONS)
+    interfaces = Interface.objects.filter(device=device).prefetch_related(*[relation for relation in PREFETCH_RELATIONS if relation in relations])
+    select_relations = [relation for relation in SELECT_RELATIONS if relation in relations]
+    # select_related() without arguments would follow every foreign key
+    if select_relations:
+        interfaces = interfaces.select_related(*select_relations)
+    return list(interfaces)
+
+
+def get_peers_fingerprint_inputs(devices:list):
+    """
+        peer values read by the peer columns, resolved from the cable paths like get_connected_interfaces, in 2 queries for all the devices:
+        {device id: [(interface id, (peer device name, peer interface name, peer lag name))]}
+        peers which are not interfaces (eg: circuit terminations) are not covered.
+    """
+    interface_content_type = ContentType.objects.get_for_model(Interface)
+    destinations = {}
+    for device_id, interface_id, path in Interface.objects.filter(device__in=devices, _path__is_complete=True).values_list('device_id', 'id', '_path__path'):
+        if path:
+            content_type_id, object_id = decompile_path_node(path[-1][0])
+            if content_type_id == interface_content_type.id:
+                destinations[(device_id, interface_id)] = object_id
+    peers = {
+        peer_id: (peer_device_name, peer_name, peer_lag_name)
+        for peer_id, peer_device_name, peer_name, peer_lag_name in Interface.objects.filter(id__in=set(destinations.values())).values_list('id', 'device__name', 'name', 'lag__name')
+    }
+    inputs = {}
+    for (device_id, interface_id), peer_id in sorted(destinations.items()):
+        inputs.setdefault(device_id, []).append((interface_id, peers.get(peer_id)))
+    return inputs
+
+
+def get_netbox_fingerprints(devices:list):
+    """
+        fingerprint of the Netbox inputs of the report rows of each device, see common.utils.row_cache.ReportRowCache:
+            > the device, its interfaces and their ip addresses, vlans, vrfs and cables last_updated and counts (the counts catch deletions),
+              aggregated in 4 queries for all the devices
+            > the device site and device type names and last_updated (device-location and device-model columns), in 1 query
+            > the names of the peers the interfaces are connected to, see get_peers_fingerprint_inputs
+        the interfaces state synced from NSO bumps their last_updated, fetch_device_data takes the fingerprint again after a sync.
+        returns: {device name: fingerprint}
+    """
+    # order_by(): the default ordering would otherwise be added to the GROUP BY
+    interfaces = Interface.objects.filter(device__in=devices).order_by().values('device_id')
+    aggregates = {
+        "interfaces": interfaces.annotate(count=Count('id'), updated=Max('last_updated'), vrf_updated=Max('vrf__last_updated')),
+        "ip-addresses": interfaces.annotate(count=Count('ip_addresses'), updated=Max('ip_addresses__last_updated')),
+        "vlans": interfaces.annotate(count=Count('tagged_vlans'), updated=Max('tagged_vlans__last_updated'), untagged_updated=Max('untagged_vlan__last_updated')),
+        "cables": interfaces.annotate(count=Count('cable'), updated=Max('cable__last_updated')),
+    }
+    inputs = {device.id: {"device": device.last_updated} for device in devices}
+    for device_id, *device_relations in Device.objects.filter(id__in=inputs).values_list('id', 'site__name', 'site__last_updated', 'device_type__model', 'device_type__last_updated'):
+        inputs[device_id]["device-relations"] = device_relations
+    for name, aggregate in aggregates.items():
+        for entry in aggregate:
+            device_id = entry.pop('device_id')
+            inputs[device_id][name] = entry
+    for device_id, peers in get_peers_fingerprint_inputs(devices).items():
+        inputs[device_id]["peers"] = peers
+    return {device.name: get_fingerprint(inputs[device.id]) for device in devices}
+
+
+def get_connected_interfaces(interfaces:list):
+    """
+        resolves the first connected endpoint of each interface from its (select_related) cable path in one query,
+        instead of interface.connected_endpoints which queries every path hop.
+        returns: {interface id: peer interface}, interfaces connected to other endpoint types are left out.
+    """
+    interface_content_type = ContentType.objects.get_for_model(Interface)
+    destinations = {}
+    for interface in interfaces:
+        cable_path = interface._path
+        if cable_path and cable_path.is_complete and cable_path.path:
+            content_type_id, object_id = decompile_path_node(cable_path.path[-1][0])
+            if content_type_id == interface_content_type.id:
+                destinations[interface.id] = object_id
+    peers = Interface.objects.select_related('device', 'lag').in_bulk(set(destinations.values()))
+    return {
+        interface_id: peers[peer_id]
+        for interface_id, peer_id in destinations.items()
+        if peer_id in peers
+    }
+
+
+def get_connected_endpoint(interface, context:dict):
+    "first connected endpoint of the interface, None if not connected"
+    peers = context["peers"]
+    if interface.id not in peers:
+        if interface.id in context["connected-interfaces"]:
+            peers[interface.id] = context["connected-interfaces"][interface.id]
+        elif interface._path_id:
+            # connected to another endpoint type (eg: circuit termination)
+            connected_endpoints = interface.connected_endpoints
+            peers[interface.id] = connected_endpoints[0] if connected_endpoints else None
+        else:
+            peers[interface.id] = None
+    return peers[interface.id]
+
+
+def get_peer_value(interface, context:dict, getter):
+    peer = get_connected_endpoint(interface, context)
+    return getter(peer) if peer else "N/A"
+
+
+def get_ip_addresses(interface, family:int):
+    return ", ".join(str(ip) for ip in interface.ip_addresses.all() if ip.family == family) or "N/A"
+
+
+# interface record fields: method(interface, context) reading the relations declared by the columns using them
+INTERFACE_FIELDS = {
+    "name": lambda interface, context: interface.name,
+    "optics-id": lambda interface, context: context["split-interface-name"](interface.name)[1],
+    "type": lambda interface, context: interface.type,
+    "description": lambda interface, context: interface.description or "N/A",
+    "enabled": lambda interface, context: interface.enabled,
+    "speed": lambda interface, context: interface.speed,
+    "mtu": lambda interface, context: interface.mtu,
+    "ipv4-addresses": lambda interface, context: get_ip_addresses(interface, 4),
+    "ipv6-addresses": lambda interface, context: get_ip_addresses(interface, 6),
+    "mac-address": lambda interface, context: str(interface.mac_address) or "N/A",
+    "members-count": lambda interface, context: len(interface.member_interfaces.all()) if interface.type == "lag" else "N/A",
+    "parent-interface": lambda interface, context: interface.lag.name if interface.lag and interface.type != "lag" else "N/A",
+    "mode": lambda interface, context: interface.mode or "N/A",
+    "untagged-vlan": lambda interface, context: str(interface.untagged_vlan) if interface.untagged_vlan else "N/A",
+    "tagged-vlans": lambda interface, context: ", ".join(str(vlan.id) for vlan in list(interface.tagged_vlans.all())) or "N/A",
+    "vrf": lambda interface, context: interface.vrf.name if interface.vrf else "default",
+    "peer-name": lambda interface, context: get_peer_value(interface, context, lambda peer: peer.device.name),
+    "peer-interface": lambda interface, context: get_peer_value(interface, context, lambda peer: peer.name),
+    "peer-interface-parent": lambda interface, context: get_peer_value(interface, context, lambda peer: peer.lag.name if peer.lag else "N/A"),
+}
+PEER_FIELDS = ("peer-name", "peer-interface", "peer-interface-parent")
+
+
+def get_interface_record(interface, fields:list, context:dict):
+    "snapshot of the given Netbox fields of an interface (see INTERFACE_FIELDS), as plain picklable values"
+    return {field: INTERFACE_FIELDS[field](interface, context) for field in fields}
+
+
+# interface fields updated from the NSO interfaces state, see apply_interfaces_state
+STATE_FIELDS = ("enabled", "mac_address", "speed")
+
+
+def apply_interfaces_state(cls, device, device_interfaces, state_dict):
+    """
+        applies the NSO interfaces state (admin status, mac address, speed) to the interfaces in memory,
+        only the state fields are validated (no DB access).
+        returns: the interfaces whose state changed, see sync_interfaces_state
+    """
+    exclude = [field.name for field in Interface._meta.fields if field.name not in STATE_FIELDS]
+    changed_interfaces = []
+    for interface in device_interfaces:
+        current_interface_state = state_dict.get(interface.name, {})
+        if not current_interface_state:
+            continue
+        previous_state = (interface.enabled, str(interface.mac_address), interface.speed)
+        interface.enabled = True if current_interface_state["admin-status"] == "up" else False
+        interface.mac_address = current_interface_state.get("phys-address") or None
+        interface.speed = int(current_interface_state["speed"]) // 1000000 or None
+        try:
+            interface.clean_fields(exclude=exclude)
+        except ValidationError as e:
+            errors = e.message_dict
+            if 'speed' in errors:
+                cls.log_failure(f"interface: '{interface.name}' current_interface_state speed: '{current_interface_state['speed']}' must be less or equal to: '2147483647'")
+                interface.speed = None
+            else:
+                cls.log_failure(f"Hit unhandled exception: {e} {type(e)}")
+                raise e
+        if (interface.enabled, str(interface.mac_address), interface.speed) != previous_state:
+            changed_interfaces.append(interface)
+    return changed_interfaces
+
+
+def sync_interfaces_state(cls, device, changed_interfaces:list):
+    """
+        writes the interfaces changed by apply_interfaces_state back to Netbox in one bulk_update,
+        last_updated is bumped explicitly (see get_netbox_fingerprints), no changelog entry is recorded.
+    """
+    if not changed_interfaces:
+        return 0
+    now = timezone.now()
+    for interface in changed_interfaces:
+        interface.last_updated = now
+    Interface.objects.bulk_update(changed_interfaces, [*STATE_FIELDS, "last_updated"])
+    cls.log_info(f"{datetime.now().strftime('%H:%M:%S')} - synced the NSO state of: '{len(changed_interfaces)}' interfaces of device: '{device.name}' to Netbox") if cls.with_logs else None
+    return len(changed_interfaces)
+
+
+def get_interface_records(cls, device, device_interfaces, split_interface_name, fields:set=None):
+    """
+        returns the interface records, see get_interface_record.
+        fields: record fields to snapshot, all of INTERFACE_FIELDS if None
+    """
+    # NSO data is looked up by interface name
+    fields = ["name"] + [field for field in INTERFACE_FIELDS if field != "name" and (fields is None or field in fields)]
+    interface_records = []
+    context = {
+        "split-interface-name": split_interface_name,
+        "connected-interfaces": get_connected_interfaces(device_interfaces) if any(field in fields for field in PEER_FIELDS) else {},
+        "peers": {},
+    }
+    for interface in device_interfaces:
+        try:
+            interface_records.append(get_interface_record(interface, fields, context))
+        except Exception as e:
+            end_time = datetime.now()
+            cls.log_failure(f"{end_time.strftime('%H:%M:%S')} - interface.name: '{interface.name}' device: '{device.name}' - {e} ")
+            raise
+    return interface_records
+
+
+def fetch_paths(cls, device_paths:list, method):
+    """
+        yields (path, result getter) as the device paths are fetched:
+            > one after the other without cls.path_executor
+            > concurrently on cls.path_executor otherwise (bound shared by all the devices),
+              at most cls.paths_per_device at a time for the current device
+        the getter raises the path's own exception so that errors stay isolated per path.
+        the device time budget and tracer spans of the calling thread are carried over to the path fetches.
+        once the generator is closed (eg: the device ran out of time budget), the paths not started yet are cancelled
+        and the running ones waited for: no NSO call of an abandoned device overlaps its retry.
+    """
+    if cls.path_executor is None:
+        for path in device_paths:
+            yield path, partial(method, path)
+        return
+
+    deadline = get_current_deadline()
+    spans = cls.tracer.get_stack()
+
+    def fetch_path(path):
+        with deadline_scope(deadline), cls.tracer.inherit(spans):
+            return method(path)
+
+    paths = list(device_paths)
+    pending = {}
+    try:
+        while paths or pending:
+            while paths and len(pending) < max(1, cls.paths_per_device):
+                path = paths.pop(0)
+                pending[cls.path_executor.submit_named(path, fetch_path, path)] = path
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result
+    finally:
+        for future in pending:
+            future.cancel()
+        # the running paths share the expired time budget, they return shortly
+        wait(pending)
+
+
+def fetch_device_data(cls, device, split_interface_name, with_nso:bool, timeout:int, retry:int, headers:list=None, sync_state:bool=True):
+    """
+        builds the report rows of a device for the given columns (see common.utils.columns, all of them if None):
+        only the NSO paths and Netbox relations these columns depend on are fetched.
+        the rows reflect the NSO interfaces state, it is written back to Netbox only with sync_state (read-only otherwise).
+        payload decoding and row building run in the parser pool of cls.nso if any (see common.utils.parsing),
+        the Netbox reads/writes stay in the calling thread.
+    """
+    def get_nso_data(path):
+        start_time = datetime.now()
+        cls.log_info(f"{start_time.strftime('%H:%M:%S')} - Started getting '{path}' for device: '{device.name}' from NSO")
+        item_data = {}
+        with cls.tracer.span(device.name, f"nso:{path}"):
+            item_data, resp = cls.nso.get_device_live_status(device=device.name, path=path, timeout=timeout, retry=retry, reducer=REPORT_PATHS_REDUCERS[path])
+        end_time = datetime.now()
+        time_diff = end_time - start_time
+        cls.log_info(f"{end_time.strftime('%H:%M:%S')} - Finished getting '{path}' for device: '{device.name}' from NSO - it took: {time_diff}")
+        if not item_data:
+            cls.log_warning(f"{path} is empty for device: '{device.name}' url: '{resp.url}'") if cls.with_logs else None
+        return item_data, resp
+    ############################################################################
+    headers = headers or REPORT_PRESETS["all"]
+    dependencies = get_dependencies(headers)
+    start_time = datetime.now()
+    cls.log_warning(f"{start_time.strftime('%H:%M:%S')} - started reporting for device: '{device.name}'")
+    ############################################################################
+    # "Cisco-IOS-XR-drivers-media-eth-oper:ethernet-interface/interfaces" takes on average 5 mins, fetched by cls.ethernet_oper instead (see common.utils.ethernet_oper)
+    device_paths = [path for source, path in NSO_SOURCES.items() if source in dependencies["sources"]]
+    if not with_nso:
+        device_paths = []
+    parser_pool = cls.nso.parser_pool if cls.nso else None
+
+    # {source name: {interface: fields}}, see common.utils.columns.NSO_SOURCES
+    sources = {}
+
+    # closed right away when the device runs out of time budget, see fetch_paths
+    with closing(fetch_paths(cls, device_paths, get_nso_data)) as fetched_paths:
+        for path, get_result in fetched_paths:
+            try:
+                item_data, resp = get_result()
+            except DeadlineExceeded:
+                # the device ran out of time budget, the caller retries it after the other devices
+                raise
+            except TimeoutException as e:
+                cls.log_failure(f"couldn't retrieve '{path}' due to timeout exception on device: '{device.name}' - {e}")
+                continue
+            except ConnectionError as e:
+                cls.log_failure(f"couldn't retrieve '{path}' due to ConnectionError exception on device: '{device.name}' - {e}")
+                continue
+            except Exception as e:
+                cls.log_failure(f"couldn't retrieve '{path}' due to unhandled exception on device: '{device.name}' - {e}")
+                continue
+            # item_data is already reduced to {interface: fields}
+            if item_data:
+                sources[PATH_SOURCES[path]] = item_data
+    if with_nso and cls.ethernet_oper and ETHERNET_OPER_SOURCE in dependencies["sources"]:
+        # low priority lane, never waited on: only what is already cached is reported
+        sources[ETHERNET_OPER_SOURCE] = cls.ethernet_oper.get(device.name)
+    fingerprint = None
+    if cls.row_cache:
+        fingerprint = cls.row_cache.get_fingerprint(device.name, headers, sources)
+        data_rows = cls.row_cache.get(device.name, fingerprint)
+        if data_rows is not None:
+            cls.log_info(f"{datetime.now().strftime('%H:%M:%S')} - reusing the stored rows of device: '{device.name}', its Netbox data and NSO payloads did not change") if cls.with_logs else None
+            return data_rows
+    ############################################################################
+    # the parent owns the ORM: apply the NSO state to the interfaces and snapshot them as plain records
+    with cls.tracer.span(device.name, "netbox:interfaces"):
+        device_interfaces = get_report_interfaces(device, dependencies["relations"])
+        changed_interfaces = apply_interfaces_state(cls, device, device_interfaces, sources.get("state", {}))
+        interface_records = get_interface_records(cls, device, device_interfaces, split_interface_name, dependencies["fields"])
+    if sync_state and changed_interfaces:
+        with cls.tracer.span(device.name, "netbox:sync"):
+            sync_interfaces_state(cls, device, changed_interfaces)
+            if cls.row_cache:
+                # the rows are stored along with the Netbox fingerprint after the sync, which the next run compares against
+                cls.row_cache.netbox_fingerprints.update(get_netbox_fingerprints([device]))
+                fingerprint = cls.row_cache.get_fingerprint(device.name, headers, sources)
+
+    local_context = device.local_context_data or {}
+    device_record = {
+        "name": device.name,
+        # relations only read by the columns depending on them
+        "model": device.device_type.model if "device_type" in dependencies["device_relations"] else "N/A",
+        "os-version": local_context.get("os_version", "N/A"),
+        "site": device.site.name if "site" in dependencies["device_relations"] and device.site else "N/A",
+        "service-policies": {
+            interface_name: interface_context.get("service-policy", {})
+            for interface_name, interface_context in local_context.get("interfaces", {}).items()
+        },
+    }
+    with cls.tracer.span(device.name, "build-rows"):
+        data_rows = run_parser(parser_pool, build_report_rows, headers, device_record, interface_records, sources)
+    # rows of a read-only run with unsynced state changes are not stored, a later synced run must rebuild them
+    if cls.row_cache and (sync_state or not changed_interfaces):
+        cls.row_cache.store(device.name, fingerprint, data_rows)
+    end_time = datetime.now()
+    cls.log_warning(f"{end_time.strftime('%H:%M:%S')} - Finished reporting for device: '{device.name}'")
+    return data_rows
+
+
+def render_markdown_table(headers:list, rows:list):
+    lines = [
+        f"|  {'  |  '.join(headers)}  |",
+        f"| {' | '.join(':---:' for _ in headers)} |",
+    ]
+    for row in rows:
+        cells = [str(value).replace("|", "\\|") for value in row]
+        lines.append(f"| {' | '.join(cells)} |")
+    return "\n".join(lines)
+
+
+def get_report_summaries(devices:list):
+    """
+        counts of the reported devices/interfaces per site, model, OS version and interface type,
+        aggregated by the database (one query per table) rather than from the report rows.
+        returns: {title: markdown table}
+    """
+    device_ids = [device.id for device in devices]
+    # order_by(): the default ordering would otherwise be added to the GROUP BY
+    nb_devices = Device.objects.filter(id__in=device_ids).order_by()
+    summaries = {}
+    for title, field in (("site", "site__name"), ("model", "device_type__model"), ("OS version", "local_context_data__os_version")):
+        counts = nb_devices.values_list(field).annotate(devices=Count('id', distinct=True), interfaces=Count('interfaces')).order_by('-devices')
+        summaries[title] = render_markdown_table(
+            [title, "devices", "interfaces"],
+            [[value or "N/A", devices_count, interfaces_count] for value, devices_count, interfaces_count in counts],
+        )
+    counts = (
+        Interface.objects.filter(device_id__in=device_ids).order_by()
+        .values_list('type').annotate(interfaces=Count('id'), devices=Count('device', distinct=True)).order_by('-interfaces')
+    )
+    summaries["interface type"] = render_markdown_table(
+        ["interface type", "interfaces", "devices"],
+        [[interface_type or "N/A", interfaces_count, devices_count] for interface_type, interfaces_count, devices_count in counts],
+    )
+    return summaries
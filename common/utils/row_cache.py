@@ -0,0 +1,77 @@
+from hashlib import sha256
+from json import dump as json_dump
+from json import dumps as json_dumps_
+from json import load as json_load
+from os import makedirs, replace
+from os import path as os_path
+from threading import Lock
+
+
+def get_fingerprint(*inputs):
+    "sha256 of the json serialized inputs, dict keys sorted so that equal inputs always give the same fingerprint"
+    return sha256(json_dumps_(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ReportRowCache:
+    """
+        per-device report rows persisted on local disk between runs along with the fingerprint of their inputs,
+        one file per device: '{cache_dir}/{device name}.json'
+            {"fingerprint": str, "rows": [[...]]}
+
+        a device whose fingerprint did not change since the last report reuses its stored rows as is.
+        the fingerprint of a device starts from its Netbox fingerprint, computed in bulk before the run
+        (see common.utils.report.get_netbox_fingerprints), and is completed with the NSO payloads it was built from.
+        a device whose interfaces state was synced to Netbox stores its rows with its Netbox fingerprint taken after the sync.
+    """
+    def __init__(self, cache_dir:str, netbox_fingerprints:dict):
+        if not os_path.exists(cache_dir):
+            makedirs(cache_dir)
+        self.cache_dir = cache_dir
+        # {device name: Netbox fingerprint}
+        self.netbox_fingerprints = netbox_fingerprints
+        self.lock = Lock()
+        self.counters = {"reused": 0, "rebuilt": 0}
+        # devices served from their stored rows by this run, see is_reused
+        self.reused_devices = set()
+
+    def get_file_path(self, device_name:str):
+        return f"{self.cache_dir}/{device_name.replace('/', '%2F')}.json"
+
+    def get_fingerprint(self, device_name:str, headers:list, sources:dict):
+        "sources: {source name: reduced NSO payload} the rows are built from"
+        return get_fingerprint(self.netbox_fingerprints.get(device_name), headers, sources)
+
+    def get(self, device_name:str, fingerprint:str):
+        "returns: the stored rows of the device if they were built from the same inputs, None otherwise"
+        file_path = self.get_file_path(device_name)
+        entry = None
+        if os_path.exists(file_path):
+            try:
+                with open(file_path) as f:
+                    entry = json_load(f)
+            except ValueError:
+                entry = None
+        reused = bool(entry) and entry["fingerprint"] == fingerprint
+        with self.lock:
+            self.counters["reused" if reused else "rebuilt"] += 1
+            if reused:
+                self.reused_devices.add(device_name)
+        return entry["rows"] if reused else None
+
+    def is_reused(self, device_name:str):
+        "True if the device rows were reused by this run, eg: its runtime is not representative of a rebuild"
+        return device_name in self.reused_devices
+
+    def store(self, device_name:str, fingerprint:str, rows:list):
+        file_path = self.get_file_path(device_name)
+        tmp_file = f"{file_path}.tmp"
+        with open(tmp_file, mode='w') as f:
+            json_dump({"fingerprint": fingerprint, "rows": rows}, f, default=str)
+        replace(tmp_file, file_path)
+
+    def get_summary(self):
+        return "\n".join([
+            "|  reused devices  |  rebuilt devices  |",
+            "| :--------------: | :---------------: |",
+            f"| {self.counters['reused']} | {self.counters['rebuilt']} |",
+        ])
@@ -0,0 +1,133 @@
+from heapq import heapify, heapreplace
+from json import dump as json_dump
+from json import load as json_load
+from os import makedirs, replace
+from os import path as os_path
+from statistics import median
+from threading import Lock
+
+from dcim.models import Interface
+from django.db.models import Count
+
+
+class CostHistory:
+    """
+        Per-device cost history persisted on local disk between runs:
+            {"<device name>": {"interfaces": int, "lldp-neighbors": int, "phases": {"<phase>": seconds}, "runtime": seconds}}
+
+        used to schedule the most expensive devices first (longest-processing-time first),
+        so that a few slow devices do not start last and stretch the job's total runtime.
+
+        file_path: None for a history only collecting the runtimes of a run, eg: a shard job
+                   returning its recorded runtimes to the coordinator (see merge)
+    """
+    DEFAULT_RUNTIME = 60.0  # seconds, used when nothing is known yet
+
+    def __init__(self, file_path:str=None):
+        self.file_path = file_path
+        self.lock = Lock()
+        self.history = {}
+        self.predictions = {}
+        self.actuals = {}
+        # {device name: record() kwargs} of this run
+        self.recorded = {}
+        if file_path and os_path.exists(file_path):
+            with open(file_path) as f:
+                self.history = json_load(f)
+
+    def get_runtime_per_interface(self):
+        ratios = [
+            entry["runtime"] / entry["interfaces"]
+            for entry in self.history.values()
+            if entry.get("interfaces") and entry.get("runtime")
+        ]
+        return median(ratios) if ratios else None
+
+    def predict(self, device_name:str, interfaces_count:int=0, runtime_per_interface:float=None):
+        entry = self.history.get(device_name)
+        if entry and entry.get("runtime"):
+            return entry["runtime"]
+        if interfaces_count and runtime_per_interface:
+            return interfaces_count * runtime_per_interface
+        known_runtimes = [entry["runtime"] for entry in self.history.values() if entry.get("runtime")]
+        return median(known_runtimes) if known_runtimes else self.DEFAULT_RUNTIME
+
+    def order(self, devices:list):
+        """
+            returns the devices sorted by predicted runtime, most expensive first.
+            devices without history are estimated from their Netbox interface count.
+        """
+        interfaces_count = dict(
+            Interface.objects.filter(device__in=devices).values('device_id').annotate(count=Count('id')).values_list('device_id', 'count')
+        )
+        runtime_per_interface = self.get_runtime_per_interface()
+        for device in devices:
+            self.predictions[device.name] = self.predict(device.name, interfaces_count.get(device.id, 0), runtime_per_interface)
+        return sorted(devices, key=lambda device: self.predictions[device.name], reverse=True)
+
+    def record(self, device_name:str, phases:dict, interfaces:int=None, lldp_neighbors:int=None):
+        with self.lock:
+            entry = self.history.setdefault(device_name, {"phases": {}})
+            entry["phases"].update(phases)
+            entry["runtime"] = sum(entry["phases"].values())
+            if interfaces is not None:
+                entry["interfaces"] = interfaces
+            if lldp_neighbors is not None:
+                entry["lldp-neighbors"] = lldp_neighbors
+            self.actuals[device_name] = sum(phases.values())
+            self.recorded[device_name] = {"phases": phases, "interfaces": interfaces, "lldp_neighbors": lldp_neighbors}
+
+    def merge(self, recorded:dict):
+        "records the runtimes recorded by another history (eg: returned by a shard job)"
+        for device_name, kwargs in recorded.items():
+            self.record(device_name, **kwargs)
+
+    def save(self):
+        directory = os_path.dirname(self.file_path)
+        if not os_path.exists(directory):
+            makedirs(directory)
+        with self.lock:
+            with open(f"{self.file_path}.tmp", mode='w') as f:
+                json_dump(self.history, f, indent=4)
+            replace(f"{self.file_path}.tmp", self.file_path)
+
+    @staticmethod
+    def simulate_makespan(runtimes:list, workers:int):
+        "LPT makespan of the given runtimes on N workers"
+        if not runtimes:
+            return 0.0
+        loads = [0.0] * max(1, workers)
+        heapify(loads)
+        for runtime in sorted(runtimes, reverse=True):
+            heapreplace(loads, loads[0] + runtime)
+        return max(loads)
+
+    def export(self, file_path:str, workers_counts:list=[1, 2, 5, 10, 20, 50]):
+        """
+            dumps predicted vs actual runtime per device and the predicted/actual LPT makespan per worker count.
+            returns: markdown summary for the job log
+        """
+        devices = [
+            {"device": device_name, "predicted": predicted, "actual": self.actuals.get(device_name)}
+            for device_name, predicted in self.predictions.items()
+        ]
+        predicted_runtimes = [entry["predicted"] for entry in devices]
+        actual_runtimes = [entry["actual"] for entry in devices if entry["actual"] is not None]
+        makespans = [
+            {
+                "workers": workers,
+                "predicted": self.simulate_makespan(predicted_runtimes, workers),
+                "actual": self.simulate_makespan(actual_runtimes, workers),
+            }
+            for workers in workers_counts
+        ]
+        with open(file_path, mode='w') as f:
+            json_dump({"devices": devices, "makespans": makespans}, f, indent=4)
+
+        summary = [
+            "|  workers  |  predicted makespan (s)  |  makespan from actual runtimes (s)  |",
+            "| :-------: | :----------------------: | :---------------------------------: |",
+        ]
+        for makespan in makespans:
+            summary.append(f"| {makespan['workers']} | {makespan['predicted']:.0f} | {makespan['actual']:.0f} |")
+        return "\n".join(summary)
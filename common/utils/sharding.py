@@ -0,0 +1,264 @@
+from datetime import datetime
+from logging import getLogger
+from os import environ
+from time import monotonic, sleep
+
+from django_rq import get_queue
+from rq.job import JobStatus
+from dcim.models import Device
+
+from common.utils.nso import Nso
+from common.utils.device import DeviceManager, split_interface_name
+from common.utils.pipeline import OnboardingPipeline
+from common.utils.report import fetch_device_data
+from common.utils.deadline import Deadline, DeadlineExceeded, deadline_scope
+from common.utils.db import DatabaseThreadPoolExecutor, QueryProfiler
+from common.utils.concurrency import AdaptiveConcurrencyLimiter
+from common.utils.parsing import create_parser_pool
+from common.utils.tracing import Tracer
+from common.utils.functions import BoundedThreadPoolExecutor
+from common.utils.columns import ETHERNET_OPER_SOURCE, REPORT_PRESETS, get_dependencies
+from common.utils.checkpoint import CheckpointStore
+from common.utils.scheduling import CostHistory
+from common.utils.ethernet_oper import EthernetOperLane
+
+
+# the NSO password is never passed in the shard job kwargs (stored in plain text in Redis),
+# the shard workers read it from a secret file or from their environment
+NSO_PASSWORD_FILE_ENV = "NSO_PASSWORD_FILE"
+NSO_PASSWORD_ENV = "NSO_PASSWORD"
+
+
+class ShardConfigurationError(Exception):
+    pass
+
+
+def get_nso_password():
+    "NSO password of the shard workers: content of the file at $NSO_PASSWORD_FILE, $NSO_PASSWORD otherwise"
+    password_file = environ.get(NSO_PASSWORD_FILE_ENV)
+    if password_file:
+        with open(password_file) as f:
+            return f.read().strip()
+    if not environ.get(NSO_PASSWORD_ENV):
+        raise ShardConfigurationError(f"the NSO password of the shard workers must be set with either: '{NSO_PASSWORD_FILE_ENV}' or '{NSO_PASSWORD_ENV}'")
+    return environ[NSO_PASSWORD_ENV]
+
+
+def get_shard_checkpoint(checkpoints_dir:str, checkpoint_id:str, shard_id:int):
+    "checkpoint of the report rows of one shard, read back by the coordinator (checkpoints_dir being on the shared generated-configs volume)"
+    return CheckpointStore(checkpoints_dir, job_id=f"{checkpoint_id}-shard-{shard_id}", keep_results=False)
+
+
+class ShardContext:
+    """
+        stands in for the Script instance within a shard background job:
+        provides the log_* methods (to the worker logger) and the nso/with_logs/tracer/query_profiler/path_executor/ethernet_oper/row_cache attributes
+        expected by DeviceManager and fetch_device_data.
+        nso_kwargs: Nso base_url and username, the password is read by get_nso_password.
+    """
+    def __init__(self, name:str, with_logs:bool=True, nso_kwargs:dict=None):
+        self.logger = getLogger(f"netbox.scripts.{name}")
+        self.log_info = self.logger.info
+        self.log_success = self.logger.info
+        self.log_warning = self.logger.warning
+        self.log_failure = self.logger.error
+        self.log_debug = self.logger.debug
+        self.log = [
+            self.log_info,
+            self.log_warning,
+            self.log_failure,
+            self.log_debug
+        ]
+        self.with_logs = with_logs
+        self.tracer = Tracer()
+        self.query_profiler = QueryProfiler(self.tracer)
+        self.nso = Nso(**nso_kwargs, password=get_nso_password(), log=self.log) if nso_kwargs else None
+        # device paths fetched one after the other unless a report shard sets an executor
+        self.path_executor = None
+        self.paths_per_device = 1
+        # set by the report shards, see start_ethernet_oper_lane. the incremental report rows are run by the coordinator only
+        self.ethernet_oper = None
+        self.row_cache = None
+
+
+def start_ethernet_oper_lane(context, device_names:list, ethernet_oper_kwargs:dict, deadline):
+    """
+        ethernet-interface oper lane of a shard, requesting the devices of the shard only.
+        ethernet_oper_kwargs: EthernetOperLane cache_file, max_in_flight and max_age,
+                              the cache file is shared with the coordinator and the other shards (see EthernetOperLane.save)
+    """
+    ethernet_oper = EthernetOperLane(context.nso, log=context.log, with_logs=context.with_logs, deadline=deadline, **ethernet_oper_kwargs)
+    for device_name in device_names:
+        ethernet_oper.request(device_name)
+    return ethernet_oper
+
+
+def stop_ethernet_oper_lane(context, ethernet_oper):
+    if ethernet_oper:
+        # queued devices are dropped, the requests in flight are cached
+        ethernet_oper.shutdown()
+        context.log_info(f"ethernet-interface oper data lane:\n{ethernet_oper.get_summary()}")
+
+
+def split_into_shards(devices:list, shards:int):
+    "round-robin split of the device names into at most N shards"
+    device_names = [device.name for device in devices]
+    shards = max(1, min(shards, len(device_names)))
+    return [device_names[i::shards] for i in range(shards)]
+
+
+def enqueue_shards(method, shards:list, queue_name:str="default", job_timeout:int=None, **kwargs):
+    """
+        enqueues one background job per shard on the given NetBox RQ queue.
+        returns: [rq jobs] in shard order
+    """
+    queue = get_queue(queue_name)
+    return [
+        queue.enqueue(method, args=(shard_id, device_names), kwargs=kwargs, job_timeout=job_timeout)
+        for shard_id, device_names in enumerate(shards)
+    ]
+
+
+def wait_for_shards(jobs:list, log_info, poll_interval:int=10):
+    """
+        polls the shard jobs until all of them are done.
+        yields: (shard_id, result, error) as each shard finishes, error is None on success.
+    """
+    pending = dict(enumerate(jobs))
+    while pending:
+        for shard_id, job in list(pending.items()):
+            status = job.get_status(refresh=True)
+            if status == JobStatus.FINISHED:
+                pending.pop(shard_id)
+                yield shard_id, job.result, None
+            elif status in (JobStatus.FAILED, JobStatus.STOPPED, JobStatus.CANCELED):
+                pending.pop(shard_id)
+                yield shard_id, None, job.exc_info or f"shard job ended with status: '{status}'"
+        if pending:
+            log_info(f"{datetime.now().strftime('%H:%M:%S')} - waiting for: '{len(pending)}/{len(jobs)}' shards to finish")
+            sleep(poll_interval)
+
+
+def onboard_shard(shard_id:int, device_names:list, nso_kwargs:dict, with_logs:bool, onboard_interfaces:bool, retry:int, timeout:int, fetch_workers:int, persist_workers:int, queue_size:int, device_timeout:int=0, job_budget:float=None, min_fetch_workers:int=0, parser_processes:int=0, ethernet_oper_kwargs:dict=None):
+    """
+        background job onboarding one shard of devices, see OnboardFromNso coordinator mode.
+        min_fetch_workers: enables the adaptive fetch concurrency between min_fetch_workers and fetch_workers.
+        parser_processes: decodes the NSO payloads in N worker processes.
+        ethernet_oper_kwargs: interfaces mac addresses fetched by the shard's own lane, see start_ethernet_oper_lane
+        the per-device runtimes are returned to the coordinator, which records them in its cost history (see CostHistory.merge).
+    """
+    job_deadline = Deadline(job_budget)
+    context = ShardContext(f"onboard_from_nso.shard-{shard_id}", with_logs=with_logs, nso_kwargs=nso_kwargs)
+    limiter = None
+    if min_fetch_workers:
+        limiter = AdaptiveConcurrencyLimiter(min_fetch_workers, fetch_workers, context.log_info)
+        context.nso.add_latency_observer(limiter.observe)
+    context.nso.parser_pool = create_parser_pool(parser_processes)
+    dm = DeviceManager(context.nso, with_logs, context.log)
+    devices = list(Device.objects.filter(name__in=device_names))
+    if onboard_interfaces and ethernet_oper_kwargs:
+        dm.ethernet_oper = start_ethernet_oper_lane(context, [device.name for device in devices], ethernet_oper_kwargs, job_deadline)
+    cost_history = CostHistory()
+    pipeline = OnboardingPipeline(
+        dm,
+        fetch_workers=fetch_workers,
+        persist_workers=persist_workers,
+        queue_size=queue_size,
+        log=context.log,
+        cost_history=cost_history,
+        device_timeout=device_timeout,
+        job_deadline=job_deadline,
+        limiter=limiter,
+    )
+    try:
+        results = pipeline.run(devices, onboard_interfaces=onboard_interfaces, retry=retry, timeout=timeout)
+    finally:
+        stop_ethernet_oper_lane(context, dm.ethernet_oper)
+        if context.nso.parser_pool:
+            context.nso.parser_pool.shutdown()
+    return {
+        "results": results,
+        "peers_not_onboarded_on_nso": dm.peers_not_onboarded_on_nso,
+        "changes": dm.changes,
+        "costs": cost_history.recorded,
+        "spans": dm.tracer.spans,
+        "queries": dm.query_profiler.get_data(),
+    }
+
+
+def report_shard(shard_id:int, device_names:list, nso_kwargs:dict, with_logs:bool, with_nso:bool, retry:int, timeout:int, checkpoints_dir:str, checkpoint_id:str, headers:list=None, sync_state:bool=True, device_timeout:int=0, job_budget:float=None, min_workers:int=0, max_workers:int=5, parser_processes:int=0, path_workers:int=0, paths_per_device:int=3, ethernet_oper_kwargs:dict=None):
+    """
+        background job building the report rows of one shard of devices, see GenerateReport coordinator mode.
+        the rows are not returned through Redis: each device is recorded as it completes in the shard checkpoint
+        (see get_shard_checkpoint), the job result only holds the failed devices, runtimes, spans and queries.
+        devices failing are returned as errors: {device name: [error type, error message]},
+        devices exceeding their time budget are left out of both, the coordinator reports them itself.
+        min_workers: enables the adaptive concurrency between min_workers and max_workers.
+        parser_processes: decodes the NSO payloads and builds the rows in N worker processes.
+        path_workers: fetches the NSO paths of the devices concurrently on N threads, at most paths_per_device per device.
+        headers: selected report columns, see common.utils.columns
+        sync_state: writes the NSO interfaces state back to Netbox, the shard is read-only otherwise
+        ethernet_oper_kwargs: optics wavelength fetched by the shard's own lane, see start_ethernet_oper_lane
+    """
+    def fetch_device_rows(device):
+        if limiter:
+            with limiter:
+                return fetch_device_rows_within_budget(device)
+        return fetch_device_rows_within_budget(device)
+
+    def fetch_device_rows_within_budget(device):
+        started = monotonic()
+        try:
+            with deadline_scope(Deadline(device_timeout, parent=job_deadline)):
+                data_rows = fetch_device_data(context, device, split_interface_name, with_nso=with_nso, timeout=timeout, retry=retry, headers=headers, sync_state=sync_state)
+        except DeadlineExceeded as e:
+            context.log_warning(f"device: '{device.name}' exceeded its time budget, left to the coordinator - {e}")
+            return
+        except Exception as e:
+            # one failing device never fails the whole shard
+            context.log_failure(f"device: '{device.name}' is missing from the report - {type(e).__name__}: {e}")
+            errors[device.name] = [type(e).__name__, str(e)]
+            return
+        cost_history.record(device.name, phases={"report": monotonic() - started}, interfaces=len(data_rows))
+        shard_checkpoint.record(device.name, data_rows)
+
+    context = ShardContext(f"generate_report.shard-{shard_id}", with_logs=with_logs, nso_kwargs=nso_kwargs if with_nso else None)
+    job_deadline = Deadline(job_budget)
+    limiter = None
+    if min_workers and context.nso:
+        limiter = AdaptiveConcurrencyLimiter(min_workers, max_workers, context.log_info)
+        context.nso.add_latency_observer(limiter.observe)
+    if context.nso:
+        context.nso.parser_pool = create_parser_pool(parser_processes)
+        if path_workers:
+            context.path_executor = BoundedThreadPoolExecutor(max_workers=path_workers)
+            context.paths_per_device = paths_per_device
+    dependencies = get_dependencies(headers or REPORT_PRESETS["all"])
+    devices = Device.objects.filter(name__in=device_names)
+    if dependencies["device_relations"]:
+        devices = devices.select_related(*dependencies["device_relations"])
+    devices = list(devices)
+    shard_checkpoint = get_shard_checkpoint(checkpoints_dir, checkpoint_id, shard_id)
+    remaining_devices = shard_checkpoint.remaining(devices)
+    cost_history = CostHistory()
+    if context.nso and ethernet_oper_kwargs and ETHERNET_OPER_SOURCE in dependencies["sources"]:
+        context.ethernet_oper = start_ethernet_oper_lane(context, [device.name for device in remaining_devices], ethernet_oper_kwargs, job_deadline)
+    errors = {}
+    try:
+        with DatabaseThreadPoolExecutor(max_workers=max_workers, query_profiler=context.query_profiler) as executor:
+            # rows are recorded by the tasks as devices complete, devices are submitted as others complete
+            for device, future in executor.iter_completed(fetch_device_rows, remaining_devices, get_name=lambda device: device.name):
+                future.result()
+    finally:
+        stop_ethernet_oper_lane(context, context.ethernet_oper)
+        if context.path_executor:
+            context.path_executor.shutdown()
+        if context.nso and context.nso.parser_pool:
+            context.nso.parser_pool.shutdown()
+    return {
+        "devices": len(shard_checkpoint.completed),
+        "errors": errors,
+        "costs": cost_history.recorded,
+        "spans": context.tracer.spans,
+        "queries": context.query_profiler.get_data(),
+    }
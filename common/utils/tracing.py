@@ -0,0 +1,147 @@
+from contextlib import contextmanager
+from functools import wraps
+from json import dump as json_dump
+from os import makedirs
+from os import path as os_path
+from threading import Lock, local
+from time import monotonic
+
+from common.utils.functions import percentile
+
+
+class Tracer:
+    """
+        records named spans per device and phase with monotonic timings, eg:
+            with tracer.span(device.name, "nso:lldp"):
+                ...
+        spans opened within another span of the same thread are recorded as its children,
+        a device total only sums its top level spans.
+
+        spans: [{"device": str, "phase": str, "duration": seconds, "failed": bool, "nested": bool}]
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.spans = []
+        self.local = local()
+
+    def current(self):
+        "(device name, phase) of the innermost span open on the current thread, None outside of any span"
+        stack = getattr(self.local, "stack", None)
+        return stack[-1] if stack else None
+
+    def get_stack(self):
+        "spans open on the current thread, see inherit"
+        return list(getattr(self.local, "stack", []))
+
+    @contextmanager
+    def inherit(self, stack:list):
+        "runs with the spans opened by another thread as parents (eg: work handed over to a pool by a traced task)"
+        previous = getattr(self.local, "stack", [])
+        self.local.stack = list(stack)
+        try:
+            yield
+        finally:
+            self.local.stack = previous
+
+    @contextmanager
+    def span(self, device_name:str, phase:str):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        stack = self.local.stack
+        depth = len(stack)
+        stack.append((device_name, phase))
+        started = monotonic()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            stack.pop()
+            with self.lock:
+                self.spans.append({
+                    "device": device_name,
+                    "phase": phase,
+                    "duration": monotonic() - started,
+                    "failed": failed,
+                    "nested": depth > 0,
+                })
+
+    def merge(self, spans:list):
+        "adds spans recorded by another tracer (eg: returned by a shard job)"
+        with self.lock:
+            self.spans.extend(spans)
+
+    def get_phases(self):
+        phases = {}
+        with self.lock:
+            spans = list(self.spans)
+        for span in spans:
+            phases.setdefault(span["phase"], []).append(span["duration"])
+        return {
+            phase: {
+                "count": len(durations),
+                "p50": percentile(durations, 50),
+                "p95": percentile(durations, 95),
+                "max": max(durations),
+                "total": sum(durations),
+            }
+            for phase, durations in phases.items()
+        }
+
+    def get_devices(self):
+        devices = {}
+        with self.lock:
+            spans = list(self.spans)
+        for span in spans:
+            device = devices.setdefault(span["device"], {"total": 0.0, "phases": {}, "nested-phases": {}})
+            device["phases"][span["phase"]] = device["phases"].get(span["phase"], 0.0) + span["duration"]
+            if span["nested"]:
+                device["nested-phases"][span["phase"]] = device["phases"][span["phase"]]
+            else:
+                device["total"] += span["duration"]
+        return devices
+
+    def get_phases_summary(self):
+        summary = [
+            "|  phase  |  spans  |  p50 (s)  |  p95 (s)  |  max (s)  |  total (s)  |",
+            "| :-----: | :-----: | :-------: | :-------: | :-------: | :---------: |",
+        ]
+        for phase, stats in sorted(self.get_phases().items(), key=lambda item: item[1]["total"], reverse=True):
+            summary.append(f"| {phase} | {stats['count']} | {stats['p50']:.2f} | {stats['p95']:.2f} | {stats['max']:.2f} | {stats['total']:.1f} |")
+        return "\n".join(summary)
+
+    def get_devices_summary(self, slowest:int=10):
+        summary = [
+            "|  device  |  total (s)  |  slowest phase  |",
+            "| :------: | :---------: | :-------------: |",
+        ]
+        devices = sorted(self.get_devices().items(), key=lambda item: item[1]["total"], reverse=True)
+        for device_name, device in devices[:slowest]:
+            # the top level spans (eg: fetch/persist) would always be the slowest
+            phase, duration = max((device["nested-phases"] or device["phases"]).items(), key=lambda item: item[1])
+            summary.append(f"| {device_name} | {device['total']:.1f} | {phase}: {duration:.1f}s |")
+        return "\n".join(summary)
+
+    def export(self, file_path:str, **sections):
+        "dumps the phases/devices timings, along with the given extra sections (eg: queries=QueryProfiler.get_data())"
+        directory = os_path.dirname(file_path)
+        if not os_path.exists(directory):
+            makedirs(directory)
+        with open(file_path, mode='w') as f:
+            json_dump({"phases": self.get_phases(), "devices": self.get_devices(), **sections}, f, indent=4)
+
+
+def traced(phase:str):
+    """
+        decorator recording a span around a method of an object with a `tracer` attribute,
+        the first positional argument of the method must be the device.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, device, *args, **kwargs):
+            with self.tracer.span(device.name, phase):
+                return method(self, device, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,360 @@
+from csv import writer as csv_writer
+from gzip import open as gzip_open
+from hashlib import sha256
+from importlib import import_module
+from json import dump as json_dump
+from json import dumps as json_dumps_
+from multiprocessing import get_context
+from queue import Empty, Full
+from re import sub as re_sub
+from traceback import format_exc
+from zlib import crc32
+
+
+ERROR_HEADERS = ["device-name", "error-type", "error-message"]
+
+
+class ReportWriter:
+    """
+        streaming report output: rows are appended as devices complete and written out in chunks,
+        memory only holds the current chunk. subclasses implement write_chunk(rows) and close().
+
+        failed devices are appended with append_errors(), they are written to a separate
+        '{file name}-errors.{extension}' file (an errors sheet for xlsx).
+    """
+    extension = ""
+    # optional modules the writer needs
+    dependencies = []
+
+    def __init__(self, file_path:str, headers:list, chunk_size:int=1000, column_types:dict=None):
+        self.file_path = file_path
+        self.headers = headers
+        self.chunk_size = chunk_size
+        # {header: "int"}, other columns are written as strings
+        self.column_types = column_types or {}
+        self.rows_count = 0
+        self.chunk = []
+        self.errors = []
+
+    def append_rows(self, rows:list):
+        for row in rows:
+            self.chunk.append(row)
+            if len(self.chunk) >= self.chunk_size:
+                self.flush()
+        self.rows_count += len(rows)
+
+    def append_errors(self, rows:list):
+        "rows: [[device name, error type, error message]]"
+        self.errors.extend(rows)
+
+    def flush(self):
+        if self.chunk:
+            self.write_chunk(self.chunk)
+            self.chunk = []
+
+    def save(self):
+        self.flush()
+        self.close()
+        if self.errors:
+            errors_writer = type(self)(self.file_path.replace(f".{self.extension}", f"-errors.{self.extension}"), ERROR_HEADERS)
+            errors_writer.append_rows(self.errors)
+            errors_writer.save()
+
+    def write_chunk(self, rows:list):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+
+class ExcelReportWriter(ReportWriter):
+    "xlsx in openpyxl write-only mode: appended rows are serialized to a temporary file right away"
+    extension = "xlsx"
+    dependencies = ["openpyxl"]
+
+    def __init__(self, file_path:str, headers:list, sheet_title:str="report", **kwargs):
+        from openpyxl import Workbook
+        super().__init__(file_path, headers, **kwargs)
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet(title=sheet_title)
+        self.sheet.append(headers)
+        self.errors_sheet = None
+
+    def append_errors(self, rows:list):
+        # errors go to a second sheet of the same workbook
+        if self.errors_sheet is None:
+            self.errors_sheet = self.workbook.create_sheet(title="errors")
+            self.errors_sheet.append(ERROR_HEADERS)
+        for row in rows:
+            self.errors_sheet.append(row)
+
+    def write_chunk(self, rows:list):
+        for row in rows:
+            self.sheet.append(row)
+
+    def close(self):
+        self.workbook.save(self.file_path)
+
+
+class CsvReportWriter(ReportWriter):
+    extension = "csv"
+
+    def __init__(self, file_path:str, headers:list, **kwargs):
+        super().__init__(file_path, headers, **kwargs)
+        self.file = open(file_path, mode='w', newline='')
+        self.writer = csv_writer(self.file)
+        self.writer.writerow(headers)
+
+    def write_chunk(self, rows:list):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class JsonlReportWriter(ReportWriter):
+    "gzip compressed json lines, one {header: value} object per row"
+    extension = "jsonl.gz"
+
+    def __init__(self, file_path:str, headers:list, **kwargs):
+        super().__init__(file_path, headers, **kwargs)
+        self.file = gzip_open(file_path, mode='wt')
+
+    def write_chunk(self, rows:list):
+        self.file.write("".join(f"{json_dumps_(dict(zip(self.headers, row)), default=str)}\n" for row in rows))
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetReportWriter(ReportWriter):
+    """
+        parquet (pyarrow), each chunk is written as a row group from typed column buffers:
+        "int" columns are int64 with "N/A" as null, the others are strings.
+    """
+    extension = "parquet"
+    dependencies = ["pyarrow"]
+
+    def __init__(self, file_path:str, headers:list, **kwargs):
+        import pyarrow
+        import pyarrow.parquet
+        super().__init__(file_path, headers, **kwargs)
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema([
+            (header, pyarrow.int64() if self.column_types.get(header) == "int" else pyarrow.string())
+            for header in headers
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(file_path, self.schema)
+
+    @staticmethod
+    def to_int(value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    def write_chunk(self, rows:list):
+        columns = {}
+        for idx, header in enumerate(self.headers):
+            if self.column_types.get(header) == "int":
+                columns[header] = [self.to_int(row[idx]) for row in rows]
+            else:
+                columns[header] = [None if row[idx] is None else str(row[idx]) for row in rows]
+        self.writer.write_table(self.pyarrow.Table.from_pydict(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+REPORT_WRITERS = {
+    writer_class.extension.split(".")[0]: writer_class
+    for writer_class in (ExcelReportWriter, CsvReportWriter, JsonlReportWriter, ParquetReportWriter)
+}
+
+
+class MultiReportWriter:
+    "fans the rows out to several ReportWriter, producing every output format in a single pass"
+    def __init__(self, writers:list):
+        self.writers = writers
+
+    @staticmethod
+    def check_output_formats(output_formats:list):
+        """
+            raises ValueError on unknown formats, ModuleNotFoundError if a writer dependency is missing.
+            output_formats: any of REPORT_WRITERS keys (xlsx, csv, jsonl, parquet)
+        """
+        unknown_formats = [output_format for output_format in output_formats if output_format not in REPORT_WRITERS]
+        if unknown_formats or not output_formats:
+            raise ValueError(f"unsupported report output format(s): {unknown_formats}, supported: {list(REPORT_WRITERS)}")
+        for output_format in output_formats:
+            for dependency in REPORT_WRITERS[output_format].dependencies:
+                import_module(dependency)
+
+    @classmethod
+    def create(cls, output_formats:list, file_path_prefix:str, headers:list, **kwargs):
+        "files are written to: '{file_path_prefix}.{extension}'"
+        cls.check_output_formats(output_formats)
+        return cls([
+            REPORT_WRITERS[output_format](f"{file_path_prefix}.{REPORT_WRITERS[output_format].extension}", headers, **kwargs)
+            for output_format in dict.fromkeys(output_formats)
+        ])
+
+    @property
+    def rows_count(self):
+        return self.writers[0].rows_count if self.writers else 0
+
+    @property
+    def file_paths(self):
+        return [writer.file_path for writer in self.writers]
+
+    def append_rows(self, rows:list):
+        for writer in self.writers:
+            writer.append_rows(rows)
+
+    def append_errors(self, rows:list):
+        for writer in self.writers:
+            writer.append_errors(rows)
+
+    def save(self):
+        for writer in self.writers:
+            writer.save()
+
+
+def _write_partitions(worker_id:int, queue, results, output_formats:list, file_path_prefix:str, headers:list, kwargs:dict):
+    """
+        PartitionedReportWriter worker process: writes every partition routed to it, one MultiReportWriter each.
+        queue items: (partition, "rows" | "errors", rows), None to save and exit.
+    """
+    writers = {}
+    errors_count = {}
+    try:
+        for item in iter(queue.get, None):
+            partition, kind, rows = item
+            if partition not in writers:
+                writers[partition] = MultiReportWriter.create(output_formats, f"{file_path_prefix}-{partition}", headers, **kwargs)
+                errors_count[partition] = 0
+            if kind == "rows":
+                writers[partition].append_rows(rows)
+            else:
+                writers[partition].append_errors(rows)
+                errors_count[partition] += len(rows)
+        for writer in writers.values():
+            writer.save()
+    except Exception:
+        results.put((worker_id, "failed", format_exc()))
+        return
+    results.put((worker_id, "saved", {
+        partition: {"rows": writer.rows_count, "errors": errors_count[partition], "files": writer.file_paths}
+        for partition, writer in writers.items()
+    }))
+
+
+class PartitionedReportWriter:
+    """
+        routes the rows to one set of output files per partition (eg: per site): '{file_path_prefix}-{partition}.{extension}',
+        partitions are spread over N spawned worker processes, each one writing and saving its own partitions:
+        peak memory and the slowest save depend on the partition size instead of the whole report.
+        rows are handed over through bounded queues (backpressure), an index of the partitions is written on save:
+        '{file_path_prefix}-index.json'
+    """
+    def __init__(self, output_formats:list, file_path_prefix:str, headers:list, processes:int=2, queue_size:int=100, **kwargs):
+        MultiReportWriter.check_output_formats(output_formats)
+        self.file_path_prefix = file_path_prefix
+        self.index_file_path = f"{file_path_prefix}-index.json"
+        self.rows_count = 0
+        self.index = {}
+        context = get_context("spawn")
+        self.results = context.Queue()
+        self.workers = []
+        for worker_id in range(max(1, processes)):
+            queue = context.Queue(maxsize=queue_size)
+            process = context.Process(target=_write_partitions, args=(worker_id, queue, self.results, output_formats, file_path_prefix, headers, kwargs), daemon=True)
+            process.start()
+            self.workers.append((queue, process))
+
+    @staticmethod
+    def get_partition_name(partition:str):
+        """
+            file name safe partition, a short hash of the partition is appended when characters had to be replaced
+            so that distinct partitions (eg: "a b" and "a_b") never share the same files
+        """
+        partition = str(partition)
+        name = re_sub(r"[^A-Za-z0-9_.-]+", "_", partition)
+        if name != partition or not name:
+            name = f"{name or 'N_A'}-{sha256(partition.encode()).hexdigest()[:8]}"
+        return name
+
+    @staticmethod
+    def put_item(queue, process, item):
+        "blocks while the worker queue is full, raises RuntimeError if the worker process exited meanwhile"
+        while True:
+            try:
+                queue.put(item, timeout=1)
+                return
+            except Full:
+                if not process.is_alive():
+                    raise RuntimeError(f"partition writer process exited with code: '{process.exitcode}'")
+
+    def put(self, partition:str, kind:str, rows:list):
+        partition = self.get_partition_name(partition)
+        queue, process = self.workers[crc32(partition.encode()) % len(self.workers)]
+        self.put_item(queue, process, (partition, kind, rows))
+
+    def append_rows(self, rows:list, partition:str):
+        self.put(partition, "rows", rows)
+        self.rows_count += len(rows)
+
+    def append_errors(self, rows:list, partition:str):
+        self.put(partition, "errors", rows)
+
+    @property
+    def file_paths(self):
+        return [self.index_file_path] + [file_path for entry in self.index.values() for file_path in entry["files"]]
+
+    def save(self):
+        "saves every partition and writes the index, raises RuntimeError if a worker failed"
+        failures = []
+        pending = set(range(len(self.workers)))
+        for worker_id, (queue, process) in enumerate(self.workers):
+            try:
+                self.put_item(queue, process, None)
+            except RuntimeError as e:
+                # a crashed worker never reports
+                pending.discard(worker_id)
+                failures.append(str(e))
+        while pending:
+            try:
+                worker_id, status, result = self.results.get(timeout=1)
+            except Empty:
+                # a worker exiting normally always reports, a crashed one never does
+                for worker_id in list(pending):
+                    process = self.workers[worker_id][1]
+                    if not process.is_alive() and process.exitcode != 0:
+                        pending.discard(worker_id)
+                        failures.append(f"partition writer process exited with code: '{process.exitcode}'")
+                continue
+            pending.discard(worker_id)
+            if status == "failed":
+                failures.append(result)
+            else:
+                self.index.update(result)
+        for queue, process in self.workers:
+            process.join()
+        if failures:
+            raise RuntimeError("partition writer failed:\n" + "\n".join(failures))
+        with open(self.index_file_path, mode='w') as f:
+            json_dump(dict(sorted(self.index.items())), f, indent=4)
+
+    def get_index_summary(self):
+        summary = [
+            "|  partition  |  rows  |  failed devices  |  files  |",
+            "| :---------: | :----: | :--------------: | :-----: |",
+        ]
+        for partition, entry in sorted(self.index.items()):
+            summary.append(f"| {partition} | {entry['rows']} | {entry['errors']} | {', '.join(entry['files'])} |")
+        return "\n".join(summary)
+
+    def abort(self):
+        "stops the worker processes without saving, eg: when the report job fails"
+        for queue, process in self.workers:
+            process.terminate()
@@ -12,15 +12,18 @@ setup()
 
 from extras.scripts import Script, StringVar, TextVar, IntegerVar, BooleanVar
 from django.forms import PasswordInput
+from django.db.models import prefetch_related_objects
 from datetime import datetime
 from utilities.exceptions import AbortScript
-from dcim.models import Interface
-from django.core.exceptions import ValidationError
-from concurrent.futures import ThreadPoolExecutor
 from threading import BoundedSemaphore
 from traceback import format_exc
-from requests.exceptions import Timeout as TimeoutException
-from requests.exceptions import ConnectionError
+from time import monotonic
+from collections import Counter
+from common.utils.report import fetch_device_data, get_netbox_fingerprints, get_report_summaries, render_markdown_table, REPORT_PARTITIONS
+from common.utils.writers import MultiReportWriter, PartitionedReportWriter
+from common.utils.functions import log_progress, BoundedThreadPoolExecutor
+from common.utils.db import DatabaseThreadPoolExecutor
+from common.utils.deadline import Deadline, DeadlineExceeded, deadline_scope
 
 
 
@@ -47,213 +50,148 @@ pip install -i http://jfrog.local/artifactory/api/pypi/pypi/simple --trusted-hos
 
 
 def split_headers(headers, max_cols):
-    split_h = []
-
-    preferred_cols = ["device-name", "interface-name"]
-    col_st = len(preferred_cols)  # start splitting after the preferred columns
-    cols = max_cols - col_st
-
-    for col_end in range(col_st + cols - 1, len(headers), cols):
-        chunk = preferred_cols + headers[col_st:col_end+1]
-        split_h.append(chunk)
-        col_st = col_end + 1
-    return split_h
-
-def generate_markdown_report(headers, devices):
-    all_reports = []
-    # generating reports
-    for hdrs in headers:
-        # adding headers to markdown report
-        md_report = []
-        md_report.append(" | ".join(hdrs))
-        md_report.append(" | ".join("---" for _ in hdrs))
-
-        for device in devices:
-            device_interfaces = list(Interface.objects.filter(device=device))
-
-            for interface in device_interfaces:
-                new_row = [device.name, interface.name, device.device_type.model, device.local_context_data.get("os_version", None), device.site.name]
-                md_report.append(" | ".join(new_row))
-
-        all_reports.append(md_report)
+    "chunks of at most max_cols headers, each one starting with the preferred columns"
+    preferred_cols = [header for header in ["device-name", "interface-name"] if header in headers]
+    other_cols = [header for header in headers if header not in preferred_cols]
+    cols = max(1, max_cols - len(preferred_cols))
+    return [preferred_cols + other_cols[col_st:col_st + cols] for col_st in range(0, len(other_cols), cols)] or [preferred_cols]
+
+def generate_markdown_report(headers, header_chunks, rows):
+    """
+        renders the report rows as one markdown table per header chunk (see split_headers),
+        pivoted in memory within a single pass over the rows.
+        rows: iterable of report rows following headers (eg: read back from the checkpoint)
+    """
+    chunks_idx = [[headers.index(header) for header in chunk] for chunk in header_chunks]
+    all_reports = [[" | ".join(chunk), " | ".join("---" for _ in chunk)] for chunk in header_chunks]
+    for row in rows:
+        for md_report, idx in zip(all_reports, chunks_idx):
+            md_report.append(" | ".join(str(row[i]).replace("|", "\\|") for i in idx))
     return all_reports
 
 
-def fetch_device_data(cls, device, split_interface_name, with_nso:bool, timeout:int, retry:int):
-    def get_nso_data(path):
-        start_time = datetime.now()
-        cls.log_info(f"{start_time.strftime('%H:%M:%S')} - Started getting '{path}' for device: '{device.name}' from NSO")
-        item_data = {}
-        item_data, resp = cls.nso.get_device_live_status(device=device.name, path=path, timeout=timeout, retry=retry)
-        end_time = datetime.now()
-        time_diff = end_time - start_time
-        cls.log_info(f"{end_time.strftime('%H:%M:%S')} - Finished getting '{path}' for device: '{device.name}' from NSO - it took: {time_diff}")
-        if not item_data:
-            cls.log_warning(f"{path} is empty for device: '{device.name}' url: '{resp.url}'") if cls.with_logs else None
-        return item_data, resp
-    ############################################################################
-    device_interfaces = list(Interface.objects.filter(device=device))
-    start_time = datetime.now()
-    cls.log_warning(f"{start_time.strftime('%H:%M:%S')} - started reporting for device: '{device.name}'")
-    ############################################################################
-    device_paths = [
-        "ietf-interfaces:interfaces-state",
-        "Cisco-IOS-XR-ifmgr-oper:interface-properties/data-nodes",
-        "tailf-ned-cisco-ios-xr-stats:controllers/Optics",
-        # "Cisco-IOS-XR-drivers-media-eth-oper:ethernet-interface/interfaces"  # disabled as it takes on average 5 mins and is not thread safe...
-    ]
-    if not with_nso:
-        device_paths = []
-
-    state_dict = {}
-    property_dict = {}
-    optics_dict = {}
-    oper_dict = {}
-
-    for path in device_paths:
-        try:
-            item_data, resp = get_nso_data(path)
-        except TimeoutException as e:
-            cls.log_failure(f"couldn't retrieve '{path}' due to timeout exception on device: '{device.name}' - {e}")
-            continue
-        except ConnectionError as e:
-            cls.log_failure(f"couldn't retrieve '{path}' due to ConnectionError exception on device: '{device.name}' - {e}")
-            continue
-        except Exception as e:
-            cls.log_failure(f"couldn't retrieve '{path}' due to unhandled exception on device: '{device.name}' - {e}")
-            continue
-        if path == "ietf-interfaces:interfaces-state":
-            if item_data:
-                state_dict = {entry['name']: entry for entry in item_data.get('interface', [])}
-        elif path == "Cisco-IOS-XR-ifmgr-oper:interface-properties/data-nodes":
-            if item_data:
-                property_dict = item_data.get('data-node', [{}])[0].get("system-view", {}).get('interfaces', {}).get('interface', {})
-                property_dict = {entry['interface-name']: entry for entry in property_dict}
-
-            ######################################################
-            # if item_data:
-            #     cls.log_warning("item_data not empty")
-            # else:
-            #     cls.log_warning("item_data empty")
-            #     cls.log_warning(f"resp.text:\n{resp.text}")
-            # cls.log_failure(resp.status_code)
-            # if optics_dict:
-            #     cls.log_warning("optics_dict not empty")
-            # else:
-            #     cls.log_warning("optics_dict empty")
-            # raise Exception("end of test")
-            ######################################################
-        elif path == "tailf-ned-cisco-ios-xr-stats:controllers/Optics":
-            if item_data:
-                optics_dict = {entry['id']: entry for entry in item_data}
-        elif path == "Cisco-IOS-XR-drivers-media-eth-oper:ethernet-interface/interfaces":
-            if item_data:
-                oper_dict = {entry['interface-name']: entry for entry in item_data.get("interface", [])}
-    ############################################################################
-    data_rows = []
-    # iterate over each interface of the current device
-    for interface in device_interfaces:
-        current_interface_state = state_dict.get(interface.name, {})
-        current_interface_property = property_dict.get(interface.name, {})
-        current_interface_oper = oper_dict.get(interface.name, {})
-
-        _, interface_id = split_interface_name(interface.name)
-        current_interface_optics = optics_dict.get(interface_id, {})
-
-        # if do_once and interface.name == "Bundle-Ether5":
-        #     do_once = False
-        #     cls.log_debug(json_dumps_(current_interface_state, indent=4))
-        #     cls.log_debug(json_dumps_(current_interface_property, indent=4))
-        #     cls.log_debug(json_dumps_(current_interface_oper, indent=4))
-        #     cls.log_debug(json_dumps_(current_interface_optics, indent=4))
-
-        if current_interface_state:
-            interface.enabled = True if current_interface_state["admin-status"] == "up" else False
-            interface.mac_address = current_interface_state.get("phys-address") or None
-            interface.speed = int(current_interface_state["speed"]) // 1000000 or None
-            try:
-                interface.full_clean()
-            except ValidationError as e:
-                errors = e.message_dict
-                if 'speed' in errors:
-                    cls.log_failure(f"interface: '{interface.name}' current_interface_state speed: '{current_interface_state['speed']}' must be less or equal to: '2147483647'")
-                    interface.speed = None
-                else:
-                    cls.log_failure(f"Hit unhandled exception: {e} {type(e)}")
-                    raise e
-            interface.save()
-
-        local_context = device.local_context_data or {}
+def generate_excel_report(cls, headers, devices, reports_dir, split_interface_name, timeout:int, retry:int, with_nso:bool, report_name="report", output_formats:list=["xlsx"], column_types:dict=None, checkpoint=None, cost_history=None, device_timeout:int=0, job_deadline=None, max_workers:int=5, limiter=None, sync_state:bool=True, partition_by:str="", partition_processes:int=2, shard_errors:dict=None):
+    """
+        shard_errors: {device name: [error type, error message]} of the devices which failed in a shard (coordinator mode),
+                      they are written to the errors output and not fetched again.
+    """
+    def fetch_device_rows(device, retry_pass=False):
+        if limiter:
+            with limiter:
+                return fetch_device_rows_within_budget(device, retry_pass)
+        return fetch_device_rows_within_budget(device, retry_pass)
+
+    def fetch_device_rows_within_budget(device, retry_pass=False):
+        started = monotonic()
+        # the retry pass is only bounded by the job deadline
         try:
-            data_rows.append([
-                device.name,
-                interface.name,
-                device.device_type.model,
-                local_context.get("os_version", "N/A"),
-                device.site.name if device.site else "N/A",
-                interface.type,
-                interface.description or "N/A",
-                "up" if interface.enabled else "down",
-                current_interface_state.get("oper-status", "N/A"),
-                "up" if current_interface_property.get("line-state") == "im-state-up" else ("down" if current_interface_property.get("line-state") else "N/A"),
-                int(current_interface_property.get("bandwidth")) // 1000000 if current_interface_property.get("bandwidth") else "N/A",
-                interface.speed or "N/A",
-                current_interface_optics.get("instance", {"transceiver-vendor-details": {"optics-type": "N/A"}}).get("transceiver-vendor-details", {"optics-type": "N/A"}).get("optics-type", "N/A"),
-                current_interface_optics.get("instance", {"transceiver-vendor-details": {"part-number": "N/A"}}).get("transceiver-vendor-details", {"part-number": "N/A"}).get("part-number", "N/A"),
-                current_interface_oper.get("phy-details", {"optics-wavelength": "N/A"}).get("optics-wavelength", "N/A"),
-                interface.mtu or "N/A",
-                current_interface_property.get("ietf-ip:ipv4", {"mtu": "N/A"}).get("mtu", "N/A"),
-                ", ".join(str(ip) for ip in interface.ip_addresses.all() if ip.family == 4) if hasattr(interface, 'ip_addresses') and any(ip.family == 4 for ip in interface.ip_addresses.all()) else "N/A",
-                ", ".join(str(ip) for ip in interface.ip_addresses.all() if ip.family == 6) if hasattr(interface, 'ip_addresses') and any(ip.family == 6 for ip in interface.ip_addresses.all()) else "N/A",
-                str(interface.mac_address) or "N/A",
-                len(interface.member_interfaces.all()) if hasattr(interface, 'member_interfaces') and interface.type == "lag" else "N/A",
-                interface.lag.name if interface.lag and interface.type != "lag" else "N/A",
-                interface.mode or "N/A",
-                interface.untagged_vlan or "N/A",
-                ", ".join(str(vlan.id) for vlan in list(interface.tagged_vlans.all())) or "N/A",
-                interface.vrf.name if interface.vrf else "default",
-                interface.connected_endpoints[0].device.name if interface.connected_endpoints else "N/A",
-                interface.connected_endpoints[0].name if interface.connected_endpoints else "N/A",
-                interface.connected_endpoints[0].lag.name if interface.connected_endpoints and interface.connected_endpoints[0].lag else "N/A",
-                (local_context.get("interfaces", {}).get(interface.name, {}).get("service-policy", {}).get("input-list", []) or [{"name": "N/A"}])[0].get("name"),
-                (local_context.get("interfaces", {}).get(interface.name, {}).get("service-policy", {}).get("output-list", []) + [{"name": "N/A"}, {"name": "N/A"}])[0:2][0].get('name'),
-                (local_context.get("interfaces", {}).get(interface.name, {}).get("service-policy", {}).get("output-list", []) + [{"name": "N/A"}, {"name": "N/A"}])[0:2][1].get('name'),
-            ])
-        except Exception as e:
-            end_time = datetime.now()
-            time_diff = end_time - start_time
-            cls.log_failure(f"{end_time.strftime('%H:%M:%S')} - interface.name: '{interface.name}' device: '{device.name}' - {e} ")
-            raise
-    end_time = datetime.now()
-    time_diff = end_time - start_time
-    cls.log_warning(f"{end_time.strftime('%H:%M:%S')} - Finished reporting for device: '{device.name}'")
-    return data_rows
-
-
-def generate_excel_report(cls, wb, headers, devices, reports_dir, split_interface_name, timeout:int, retry:int, with_nso:bool, report_name="report.xlsx"):
-    # creating a new workbook and selecting the active sheet
-    ws = wb.active
-
-    # write the headers in the first row
-    for idx, header in enumerate(headers, start=1):
-        ws.cell(row=1, column=idx, value=header)
-
-    # initialize row index for data
-    row_idx = 2
-
-    # Use a ThreadPoolExecutor to parallelize the operation
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        # Map devices to the fetch_device_data function
-        results = list(executor.map(lambda device: fetch_device_data(cls, device, split_interface_name, with_nso=with_nso, timeout=timeout, retry=retry), devices))
+            with cls.tracer.span(device.name, "report"), deadline_scope(Deadline(None if retry_pass else device_timeout, parent=job_deadline)):
+                data_rows = fetch_device_data(cls, device, split_interface_name, with_nso=with_nso, timeout=timeout, retry=retry, headers=headers, sync_state=sync_state)
+        except DeadlineExceeded:
+            if retry_pass:
+                # reported in the errors output
+                raise
+            cls.log_warning(f"{datetime.now().strftime('%H:%M:%S')} - device: '{device.name}' exceeded its time budget of: '{device_timeout}' seconds, it will be retried after the other devices.")
+            retry_devices.append(device)
+            return None
+        # the near-zero runtime of reused rows would skew the longest-processing-time ordering
+        if cost_history and not (cls.row_cache and cls.row_cache.is_reused(device.name)):
+            cost_history.record(device.name, phases={"report": monotonic() - started}, interfaces=len(data_rows))
+        if checkpoint:
+            checkpoint.record(device.name, data_rows)
+        return data_rows
+    # rows are streamed to every output format as devices complete, in completion order
+    if partition_by:
+        # one set of files per partition, written by worker processes
+        writer = PartitionedReportWriter(output_formats, f"{reports_dir}/{report_name}", headers, processes=partition_processes, column_types=column_types)
+    else:
+        writer = MultiReportWriter.create(output_formats, f"{reports_dir}/{report_name}", headers, column_types=column_types)
+    # optics types only exist in the NSO payloads, they are counted as the rows are written
+    optics_types = Counter()
+    optics_idx = headers.index("optics-type") if "optics-type" in headers else None
+
+    def get_partition_kwargs(device):
+        return {"partition": REPORT_PARTITIONS[partition_by][0](device)} if partition_by else {}
+
+    def append_rows(device, data_rows):
+        writer.append_rows(data_rows, **get_partition_kwargs(device))
+        if optics_idx is not None:
+            optics_types.update(row[optics_idx] for row in data_rows)
+
+    retry_devices = []
+    failed_devices = []
+    shard_errors = shard_errors or {}
+    for device in devices:
+        if device.name in shard_errors:
+            failed_devices.append(device.name)
+            writer.append_errors([[device.name, *shard_errors[device.name]]], **get_partition_kwargs(device))
+    # devices already reported by a previous run of the same checkpoint are reused as is
+    remaining_devices = checkpoint.remaining(devices) if checkpoint else devices
+    remaining_devices = [device for device in remaining_devices if device.name not in shard_errors]
+    if checkpoint:
+        cls.log_info(f"checkpoint: '{checkpoint.job_id}' - reusing rows of: '{len(devices) - len(remaining_devices)}' devices, '{len(remaining_devices)}' remaining. Resume with checkpoint_id: '{checkpoint.job_id}'")
+        for device in devices:
+            if checkpoint.is_completed(device.name):
+                append_rows(device, checkpoint.get_result(device.name))
+    if cost_history:
+        # longest-processing-time first
+        remaining_devices = cost_history.order(remaining_devices)
 
-    # After all threads have completed, results is a list of all data_rows
-    for data_rows in results:
-        for data_row in data_rows:
-            for col_idx, item in enumerate(data_row, start=1):
-                ws.cell(row=row_idx, column=col_idx, value=item)
-            row_idx += 1
-    # save the workbook to a file
-    wb.save(f"{reports_dir}/{report_name}")
+    def write_completed(completed):
+        """
+            writes the rows of each device as soon as it completes, failed devices are written to the errors output.
+            completed: (device, future) of the completed devices, see BoundedThreadPoolExecutor.iter_completed
+        """
+        for device, future in completed:
+            try:
+                data_rows = future.result()
+            except Exception as e:
+                cls.log_failure(f"device: '{device.name}' is missing from the report - {type(e).__name__}: {e}")
+                failed_devices.append(device.name)
+                writer.append_errors([[device.name, type(e).__name__, str(e)]], **get_partition_kwargs(device))
+                continue
+            # None: straggler, written after the retry pass
+            if data_rows is not None:
+                append_rows(device, data_rows)
+
+    executor = DatabaseThreadPoolExecutor(
+        max_workers=max_workers,
+        query_profiler=cls.query_profiler,
+        total=len(remaining_devices),
+        progress_callback=log_progress(cls.log_info, "report", details=lambda: f"rows written: '{writer.rows_count}'"),
+    )
+    try:
+        with executor:
+            # devices are submitted as others complete: only the rows of the devices in flight are held in memory
+            write_completed(executor.iter_completed(fetch_device_rows, remaining_devices, get_name=lambda device: device.name))
+            if retry_devices:
+                cls.log_info(f"{datetime.now().strftime('%H:%M:%S')} - retrying: '{len(retry_devices)}' devices which exceeded their time budget: {[device.name for device in retry_devices]}")
+                executor.total += len(retry_devices)
+                write_completed(executor.iter_completed(fetch_device_rows, retry_devices, get_name=lambda device: device.name, retry_pass=True))
+    except BaseException:
+        if partition_by:
+            writer.abort()
+        raise
+    cls.log_info(f"report tasks:\n{executor.get_metrics_summary()}")
+    cls.log_info(f"report DB connections:\n{executor.get_db_summary()}")
+    if limiter:
+        cls.log_info(f"report concurrency adjustments:\n{limiter.get_adjustments_summary()}")
+    if failed_devices:
+        cls.log_failure(f"'{len(failed_devices)}' devices failed and are listed in the report errors output: {failed_devices}")
+    writer.save()
+    cls.log_info(f"{datetime.now().strftime('%H:%M:%S')} - wrote: '{writer.rows_count}' rows to: {writer.file_paths}")
+    if partition_by:
+        cls.log_info(f"report partitions by {partition_by}, index: '{writer.index_file_path}':\n{writer.get_index_summary()}")
+    if cost_history:
+        cost_history.save()
+        runtime_summary = cost_history.export(f"{reports_dir}/{report_name}-runtime.json")
+        cls.log_info(f"predicted vs actual makespan per worker count:\n{runtime_summary}")
+    cls.tracer.export(f"{reports_dir}/{report_name}-trace.json", queries=cls.query_profiler.get_data())
+    cls.log_info(f"report phases timings:\n{cls.tracer.get_phases_summary()}")
+    cls.log_info(f"slowest devices:\n{cls.tracer.get_devices_summary()}")
+    cls.log_info(f"SQL queries per phase:\n{cls.query_profiler.get_phases_summary()}")
+    cls.log_info(f"SQL query shapes:\n{cls.query_profiler.get_shapes_summary()}")
+    return optics_types
 
 
 
@@ -319,28 +257,160 @@ class GenerateReport(Script):
         default=True,
     )
 
+    min_workers = IntegerVar(
+        required=True,
+        default=2,
+        description="Lower bound of the concurrent devices when adaptive concurrency is enabled"
+    )
+
+    max_workers = IntegerVar(
+        required=True,
+        default=5,
+        description="Number of concurrent devices (upper bound when adaptive concurrency is enabled)"
+    )
+
+    adaptive_concurrency = BooleanVar(
+        default=True,
+        description="Grow/shrink the number of concurrent devices from the observed NSO latency and error rate"
+    )
+
+    device_timeout = IntegerVar(
+        required=True,
+        default=3600,
+        description="Total time budget (seconds) of the NSO calls of a device, stragglers are retried at the end (0 disables)"
+    )
+
+    checkpoint_id = StringVar(
+        required=False,
+        description="Resume from this checkpoint id, a new checkpoint is created if empty"
+    )
+
+    shards = IntegerVar(
+        required=True,
+        default=0,
+        description="Coordinator mode: split devices into N background jobs (0 to report within this job), the workers read the NSO password from NSO_PASSWORD_FILE or NSO_PASSWORD"
+    )
+
+    shard_queue = StringVar(
+        required=True,
+        default="default",
+        description="RQ queue the shard jobs are enqueued on"
+    )
+
+    sync_interfaces = BooleanVar(
+        default=True,
+        description="Write the NSO interfaces state (enabled, mac address, speed) back to Netbox, one bulk update per device. The report is read-only otherwise"
+    )
+
+    markdown_report = BooleanVar(
+        default=False,
+        description="Also log the report rows as markdown tables"
+    )
+
+    markdown_columns = IntegerVar(
+        required=True,
+        default=8,
+        description="Maximum columns per markdown table, device-name and interface-name being repeated in each of them"
+    )
+
+    partition_by = StringVar(
+        required=False,
+        description="Partitioned output: one set of report files per site, model or os-version, plus an index file (empty for a single report)"
+    )
+
+    partition_processes = IntegerVar(
+        required=True,
+        default=2,
+        description="Worker processes writing the report partitions"
+    )
+
+    incremental = BooleanVar(
+        default=True,
+        description="Reuse the stored rows of devices whose Netbox data and NSO payloads did not change since the last report"
+    )
+
+    columns = TextVar(
+        required=False,
+        description="Comma separated report columns and/or presets: all, inventory (Netbox only, no NSO call). All the columns if empty"
+    )
+
+    output_formats = StringVar(
+        required=True,
+        default="xlsx",
+        description="Space separated report output formats, written in a single pass: xlsx csv jsonl parquet"
+    )
+
+
+    parser_processes = IntegerVar(
+        required=True,
+        default=0,
+        description="Decode NSO payloads and build the report rows in N worker processes (0 to parse within the job's threads)"
+    )
+
+    path_workers = IntegerVar(
+        required=True,
+        default=10,
+        description="Fetch the NSO paths of the devices concurrently on N threads shared by all devices (0 to fetch them one after the other)"
+    )
+
+    paths_per_device = IntegerVar(
+        required=True,
+        default=3,
+        description="Maximum NSO paths fetched at the same time for one device"
+    )
+
+    ethernet_oper_workers = IntegerVar(
+        required=True,
+        default=1,
+        description="Fetch the slow ethernet-interface oper data (optics wavelength, mac address) with at most N low priority requests in flight (per shard in coordinator mode), cached across runs (0 disables)"
+    )
+
+    ethernet_oper_max_age = IntegerVar(
+        required=True,
+        default=86400,
+        description="Seconds the cached ethernet-interface oper data of a device is reused before being fetched again"
+    )
 
     def run(self, data, commit):
+        parser_pool = None
+        self.path_executor = None
+        self.paths_per_device = 1
+        self.ethernet_oper = None
+        self.row_cache = None
         try:
             start_time = datetime.now()
+            # keep a margin before the job timeout to save what was done
+            job_deadline = Deadline(self.Meta.job_timeout * 0.9)
             self.log_info(f"{start_time.strftime('%H:%M:%S')} - Started reporting script")
-            headers = [
-                "device-name", "interface-name", "device-model", "device-version", "device-location",
-                "interface-type", "interface-description", "interface-admin-state", "interface-oper-state",
-                "interface-link-state", "bandwidth", "speed (mbps)", "optics-type", "optics-part_number",
-                "optics-WaveLength", "MTU", "MTU-IP", "ipv4-address", "ipv6-address", "interface-mac_address",
-                "members-count", "parent-interface", "802.1Q-mode", "untagged-vlan", "tagged-vlan(s)", "VRF", "peer-name",
-                "peer-interface", "peer-interface-parent", "Service-Policy Input",
-                "Service-Policy Output_1", "Service-Policy Output_2",
-            ]
             ##########################################################################################
             from common.utils.device import split_interface_name
             from common.utils.device import DeviceManager
             from common.utils.nso import Nso
-            from openpyxl import Workbook
-            from common.utils.functions import ThreadPoolExecutorStackTraced
+            from common.utils.checkpoint import CheckpointStore
+            from common.utils.scheduling import CostHistory
+            from common.utils.concurrency import AdaptiveConcurrencyLimiter
+            from common.utils.parsing import create_parser_pool
+            from common.utils.tracing import Tracer
+            from common.utils.db import QueryProfiler
+            from common.utils.ethernet_oper import EthernetOperLane
+            from common.utils.row_cache import ReportRowCache
+            from common.utils.columns import ETHERNET_OPER_SOURCE, select_columns, get_dependencies, get_column_types
             ##########################################################################################
+            try:
+                headers = select_columns(data.get("columns") or "")
+            except ValueError as e:
+                raise AbortScript(f"{e}")
+            # only the data the selected columns depend on is fetched
+            dependencies = get_dependencies(headers)
+            # typed columns of the columnar formats, "N/A" being written as null
+            column_types = get_column_types(headers)
             with_nso = data.get("with_nso")
+            if with_nso and not dependencies["sources"]:
+                self.log_info("none of the selected columns depend on NSO, no NSO call will be made")
+                with_nso = False
+            # abort early on unknown output formats or missing writers dependencies (openpyxl, pyarrow)
+            MultiReportWriter.check_output_formats(data["output_formats"].split())
+            adaptive_concurrency = with_nso and data["adaptive_concurrency"]
 
 
             ##########################################################################################
@@ -356,8 +426,14 @@ class GenerateReport(Script):
                 ]
             )
             ###########################################################################################
+            self.tracer = Tracer()
+            self.query_profiler = QueryProfiler(self.tracer)
             self.nso = None
             if with_nso:
+                parser_pool = create_parser_pool(data["parser_processes"])
+                if data["path_workers"]:
+                    self.path_executor = BoundedThreadPoolExecutor(max_workers=data["path_workers"])
+                    self.paths_per_device = data["paths_per_device"]
                 self.nso = Nso(
                     base_url=data.get('base_url'),
                     username=data.get('username'),
@@ -368,6 +444,7 @@ class GenerateReport(Script):
                         self.log_failure,
                         self.log_debug
                     ],
+                    parser_pool=parser_pool,
                 )
                 result = self.nso.test_credentials()
                 if not result:
@@ -386,6 +463,15 @@ class GenerateReport(Script):
             if not nb_devices:
                 raise AbortScript(f"failed to retrieve devices from netbox with entered parameteres: limit_devices='{limit_devices}' - limit={data.get('limit')} - offset={data.get('offset')}")
             self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Retrieved: '{len(nb_devices)}' devices from Netbox.")
+            # device-type and site of every row, loaded in one query each for the whole report
+            partition_by = data.get("partition_by") or ""
+            if partition_by and partition_by not in REPORT_PARTITIONS:
+                raise AbortScript(f"unsupported partition_by: '{partition_by}', supported: {list(REPORT_PARTITIONS)}")
+            partition_relations = REPORT_PARTITIONS[partition_by][1] if partition_by else ()
+            prefetch_related_objects(nb_devices, *set(dependencies["device_relations"]).union(partition_relations))
+            if data["incremental"]:
+                # devices whose Netbox data and NSO payloads did not change since the last report reuse their rows
+                self.row_cache = ReportRowCache(f"{getcwd()}/generated-configs/cache/report-rows", get_netbox_fingerprints(nb_devices))
             ###########################################################################################
             # TODO: change generated-configs volume to generated/configs
             reports_dir = f"{getcwd()}/generated-configs/reports"
@@ -393,28 +479,132 @@ class GenerateReport(Script):
                 makedirs(reports_dir)
 
             self.log_info(f"Excel reports will be dumped at: '{reports_dir}'")
-            wb = Workbook()
-            generate_excel_report(
-                wb=wb,
+            # rows are read back from the checkpoint file when written, not kept in memory
+            checkpoint = CheckpointStore(f"{getcwd()}/generated-configs/checkpoints/reports", job_id=data.get("checkpoint_id"), keep_results=False)
+            ethernet_oper_kwargs = None
+            if with_nso and data["ethernet_oper_workers"] and ETHERNET_OPER_SOURCE in dependencies["sources"]:
+                ethernet_oper_kwargs = {
+                    "cache_file": f"{getcwd()}/generated-configs/cache/ethernet-oper.json",
+                    "max_in_flight": data["ethernet_oper_workers"],
+                    "max_age": data["ethernet_oper_max_age"],
+                }
+            cost_history = CostHistory(f"{getcwd()}/generated-configs/cost-history/reports.json")
+            shard_errors = {}
+            if data["shards"]:
+                from common.utils.sharding import split_into_shards, enqueue_shards, wait_for_shards, report_shard, get_shard_checkpoint
+                checkpoints_dir = f"{getcwd()}/generated-configs/checkpoints/reports"
+                # most expensive devices first (longest-processing-time), the shards are then balanced by the round-robin split
+                remaining_devices = cost_history.order(checkpoint.remaining(nb_devices))
+                shards = split_into_shards(remaining_devices, data["shards"]) if remaining_devices else []
+                jobs = enqueue_shards(
+                    report_shard,
+                    shards,
+                    queue_name=data["shard_queue"],
+                    job_timeout=self.Meta.job_timeout,
+                    nso_kwargs={
+                        "base_url": data.get('base_url'),
+                        "username": data.get('username'),
+                    },
+                    checkpoints_dir=checkpoints_dir,
+                    checkpoint_id=checkpoint.job_id,
+                    with_logs=data["with_logs"],
+                    with_nso=with_nso,
+                    headers=headers,
+                    sync_state=data["sync_interfaces"],
+                    retry=data.get("nso_retry"),
+                    timeout=data.get("nso_timeout"),
+                    device_timeout=data["device_timeout"],
+                    job_budget=self.Meta.job_timeout * 0.9,
+                    min_workers=data["min_workers"] if adaptive_concurrency else 0,
+                    max_workers=data["max_workers"],
+                    parser_processes=data["parser_processes"],
+                    path_workers=data["path_workers"],
+                    paths_per_device=data["paths_per_device"],
+                    ethernet_oper_kwargs=ethernet_oper_kwargs,
+                )
+                self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Enqueued: '{len(jobs)}' shards on queue: '{data['shard_queue']}'")
+                for shard_id, shard_result, error in wait_for_shards(jobs, self.log_info):
+                    # rows recorded by the shard, including those recorded before a shard failure, are read back one device at a time
+                    for device_name, data_rows in get_shard_checkpoint(checkpoints_dir, checkpoint.job_id, shard_id).iter_results():
+                        checkpoint.record(device_name, data_rows)
+                    if error:
+                        # the other devices of failed shards are left out of the checkpoint and reported locally below
+                        self.log_failure(f"shard: '{shard_id}' failed:\n```\n{error}\n```")
+                        continue
+                    self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - shard: '{shard_id}' finished reporting: '{shard_result['devices']}' devices, failed devices: '{len(shard_result['errors'])}'")
+                    shard_errors.update(shard_result["errors"])
+                    # saved along with the runtimes of the devices reported locally, see generate_excel_report
+                    cost_history.merge(shard_result["costs"])
+                    self.tracer.merge(shard_result["spans"])
+                    self.query_profiler.merge(shard_result["queries"])
+            if ethernet_oper_kwargs:
+                # optics wavelength: queued up front, rows are built from what is cached when the device is reported.
+                # in coordinator mode each shard runs its own lane (see common.utils.sharding.start_ethernet_oper_lane),
+                # this one only serves the devices reported locally, reading what the shards cached
+                self.ethernet_oper = EthernetOperLane(
+                    self.nso,
+                    **ethernet_oper_kwargs,
+                    log=[
+                        self.log_info,
+                        self.log_warning,
+                        self.log_failure,
+                        self.log_debug
+                    ],
+                    with_logs=data["with_logs"],
+                    deadline=job_deadline,
+                )
+                for device in checkpoint.remaining(nb_devices):
+                    if device.name not in shard_errors:
+                        self.ethernet_oper.request(device.name)
+            limiter = None
+            if adaptive_concurrency:
+                limiter = AdaptiveConcurrencyLimiter(data["min_workers"], data["max_workers"], self.log_info)
+                self.nso.add_latency_observer(limiter.observe)
+            optics_types = generate_excel_report(
                 cls=self,
                 headers=headers,
                 devices=nb_devices,
                 reports_dir=reports_dir,
-                report_name="generated_report.xlsx",
+                report_name="generated_report",
+                output_formats=data["output_formats"].split(),
+                column_types=column_types,
                 timeout=data.get("nso_timeout"),
                 retry=data.get("nso_retry"),
                 with_nso=with_nso,
-                split_interface_name=split_interface_name
+                split_interface_name=split_interface_name,
+                checkpoint=checkpoint,
+                cost_history=cost_history,
+                device_timeout=data["device_timeout"],
+                job_deadline=job_deadline,
+                max_workers=data["max_workers"],
+                limiter=limiter,
+                sync_state=data["sync_interfaces"],
+                partition_by=partition_by,
+                partition_processes=data["partition_processes"],
+                shard_errors=shard_errors,
             )
-            # headers = split_headers(headers, 5)
-            # reports = generate_markdown_report(
-            #     headers=headers,
-            #     devices=nb_devices
-            # )
+            # compact overview, aggregated by the database
+            for title, summary in get_report_summaries(nb_devices).items():
+                self.log_info(f"devices and interfaces per {title}:\n{summary}")
+            if optics_types:
+                self.log_info(f"interfaces per optics type:\n{render_markdown_table(['optics type', 'interfaces'], optics_types.most_common())}")
+            if data["markdown_report"]:
+                # rows are read back once from the checkpoint, no query is made
+                reports = generate_markdown_report(
+                    headers=headers,
+                    header_chunks=split_headers(headers, data["markdown_columns"]),
+                    rows=(
+                        row
+                        for device in nb_devices if checkpoint.is_completed(device.name)
+                        for row in checkpoint.get_result(device.name)
+                    ),
+                )
+                self.log_info(f"Generated markdown report:")
+                for report in reports:
+                    self.log_info('\n'.join(report))
 
-            # self.log_info(f"Generated markdown report:")
-            # for report in reports:
-            #     self.log_info('\n'.join(report))
+            if self.row_cache:
+                self.log_info(f"incremental report rows:\n{self.row_cache.get_summary()}")
 
             end_time = datetime.now()
             time_diff = end_time - start_time
@@ -429,3 +619,12 @@ class GenerateReport(Script):
             error_msg = "```\n" + ''.join(error_msg) + "\n```"
             self.log_failure(error_msg)
             raise AbortScript(f"failed due to caughting unhandled exception")
+        finally:
+            if self.ethernet_oper:
+                # queued devices are dropped, the requests in flight are cached
+                self.ethernet_oper.shutdown()
+                self.log_info(f"ethernet-interface oper data lane:\n{self.ethernet_oper.get_summary()}")
+            if self.path_executor:
+                self.path_executor.shutdown()
+            if parser_pool:
+                parser_pool.shutdown()
@@ -1,5 +1,5 @@
 #!/opt/netbox/venv/bin/python
-from os import environ
+from os import environ, getcwd
 from django import setup
 from sys import exc_info, path
 path.append('/opt/netbox/netbox')
@@ -11,8 +11,8 @@ setup()
 
 from extras.scripts import Script, StringVar, TextVar, IntegerVar, BooleanVar
 from django.forms import PasswordInput
-from common.utils.functions import ThreadPoolExecutorStackTraced
 from datetime import datetime
+from time import monotonic
 from utilities.exceptions import AbortScript
 from traceback import format_exc
 """
@@ -82,11 +82,92 @@ class OnboardFromNso(Script):
         default=True,
     )
 
+    fetch_workers = IntegerVar(
+        required=True,
+        default=10,
+        description="Number of concurrent NSO fetch workers"
+    )
+
+    min_fetch_workers = IntegerVar(
+        required=True,
+        default=2,
+        description="Lower bound of the fetch workers when adaptive concurrency is enabled (fetch workers is the upper bound)"
+    )
+
+    adaptive_concurrency = BooleanVar(
+        default=True,
+        description="Grow/shrink the number of fetch workers from the observed NSO latency and error rate"
+    )
+
+    persist_workers = IntegerVar(
+        required=True,
+        default=2,
+        description="Number of concurrent Netbox persist workers"
+    )
+
+    queue_size = IntegerVar(
+        required=True,
+        default=10,
+        description="Max number of fetched devices waiting to be persisted"
+    )
+
+    device_timeout = IntegerVar(
+        required=True,
+        default=3600,
+        description="Total time budget (seconds) of the NSO calls of a device, stragglers are retried at the end (0 disables)"
+    )
+
+    checkpoint_id = StringVar(
+        required=False,
+        description="Resume from this checkpoint id, a new checkpoint is created if empty"
+    )
+
+    shards = IntegerVar(
+        required=True,
+        default=0,
+        description="Coordinator mode: split devices into N background jobs (0 to onboard within this job), the workers read the NSO password from NSO_PASSWORD_FILE or NSO_PASSWORD"
+    )
+
+    shard_queue = StringVar(
+        required=True,
+        default="default",
+        description="RQ queue the shard jobs are enqueued on"
+    )
+
+    parser_processes = IntegerVar(
+        required=True,
+        default=0,
+        description="Decode NSO payloads in N worker processes (0 to parse within the job's threads)"
+    )
+
+    ethernet_oper_workers = IntegerVar(
+        required=True,
+        default=1,
+        description="Fetch the slow ethernet-interface oper data (optics wavelength, mac address) with at most N low priority requests in flight (per shard in coordinator mode), cached across runs (0 disables)"
+    )
+
+    ethernet_oper_max_age = IntegerVar(
+        required=True,
+        default=86400,
+        description="Seconds the cached ethernet-interface oper data of a device is reused before being fetched again"
+    )
+
     def run(self, data, commit):
+        parser_pool = None
+        ethernet_oper = None
         try:
             ##########################################################################################
             from common.utils.nso import Nso
             from common.utils.device import DeviceManager, NSODevicesRetrievalError
+            from common.utils.pipeline import OnboardingPipeline, record_onboarding_cost
+            from common.utils.checkpoint import CheckpointStore
+            from common.utils.scheduling import CostHistory
+            from common.utils.deadline import Deadline, deadline_scope
+            from common.utils.concurrency import AdaptiveConcurrencyLimiter
+            from common.utils.parsing import create_parser_pool
+            from common.utils.ethernet_oper import EthernetOperLane
+            # keep a margin before the job timeout to report what was done
+            job_deadline = Deadline(self.Meta.job_timeout * 0.9)
             ##########################################################################################
             # instantiate NSO
             nso = Nso(
@@ -101,6 +182,8 @@ class OnboardFromNso(Script):
 
                 ],
             )
+            parser_pool = create_parser_pool(data["parser_processes"])
+            nso.parser_pool = parser_pool
             # instantiate DeviceManager for data parsing and onboarding
             dm = DeviceManager(
                 nso,
@@ -132,6 +215,39 @@ class OnboardFromNso(Script):
                 raise AbortScript(f"failed to retrieve devices with entered parameteres: limit_devices='{limit_devices}' - limit={data.get('limit')} - offset={data.get('offset')}")
             self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Finished retrieving: '{len(nb_devices)}' devices from Netbox.")
             ###########################################################################################
+            checkpoint = CheckpointStore(f"{getcwd()}/generated-configs/checkpoints/onboarding", job_id=data.get("checkpoint_id"))
+            all_nb_devices = nb_devices
+            nb_devices = checkpoint.remaining(all_nb_devices)
+            self.log_info(f"checkpoint: '{checkpoint.job_id}' - '{len(all_nb_devices) - len(nb_devices)}' devices already onboarded, '{len(nb_devices)}' remaining. Resume with checkpoint_id: '{checkpoint.job_id}'")
+            cost_history = CostHistory(f"{getcwd()}/generated-configs/cost-history/onboarding.json")
+            # most expensive devices first (longest-processing-time), for every mode: shards are then balanced by the round-robin split
+            nb_devices = cost_history.order(nb_devices)
+            ethernet_oper_kwargs = None
+            if data["onboard_interfaces"] and data["ethernet_oper_workers"]:
+                ethernet_oper_kwargs = {
+                    "cache_file": f"{getcwd()}/generated-configs/cache/ethernet-oper.json",
+                    "max_in_flight": data["ethernet_oper_workers"],
+                    "max_age": data["ethernet_oper_max_age"],
+                }
+            if ethernet_oper_kwargs and not data["shards"]:
+                # interfaces mac addresses: queued up front, filled from the cache when a device is persisted.
+                # each shard runs its own lane for its devices (see common.utils.sharding.start_ethernet_oper_lane)
+                ethernet_oper = EthernetOperLane(
+                    nso,
+                    **ethernet_oper_kwargs,
+                    log=[
+                        self.log_info,
+                        self.log_warning,
+                        self.log_failure,
+                        self.log_debug
+                    ],
+                    with_logs=data["with_logs"],
+                    deadline=job_deadline,
+                )
+                dm.ethernet_oper = ethernet_oper
+                for device in nb_devices:
+                    ethernet_oper.request(device.name)
+            ###########################################################################################
             # reduce nb_devices scope to current nso onboarded devices
             self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Started Onboarding device items for: '{len(nb_devices)}' devices on Netbox.")
 
@@ -141,32 +257,139 @@ class OnboardFromNso(Script):
             ]
 
 
-            if data["with_multithreading"]:
-                with ThreadPoolExecutorStackTraced(max_workers=5) as executor:
-                    threads = [
-                        executor.submit(
-                            dm.onboard_device,
+            shard_failures = []
+            if data["shards"]:
+                from common.utils.sharding import split_into_shards, enqueue_shards, wait_for_shards, onboard_shard
+                shards = split_into_shards(nb_devices, data["shards"]) if nb_devices else []
+                jobs = enqueue_shards(
+                    onboard_shard,
+                    shards,
+                    queue_name=data["shard_queue"],
+                    job_timeout=self.Meta.job_timeout,
+                    nso_kwargs={
+                        "base_url": data.get('base_url'),
+                        "username": data.get('username'),
+                    },
+                    with_logs=data["with_logs"],
+                    onboard_interfaces=data["onboard_interfaces"],
+                    retry=data["nso_retry"],
+                    timeout=data["nso_timeout"],
+                    fetch_workers=data["fetch_workers"],
+                    persist_workers=data["persist_workers"],
+                    queue_size=data["queue_size"],
+                    device_timeout=data["device_timeout"],
+                    job_budget=self.Meta.job_timeout * 0.9,
+                    min_fetch_workers=data["min_fetch_workers"] if data["adaptive_concurrency"] else 0,
+                    parser_processes=data["parser_processes"],
+                    ethernet_oper_kwargs=ethernet_oper_kwargs,
+                )
+                self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - Enqueued: '{len(jobs)}' shards on queue: '{data['shard_queue']}'")
+                for shard_id, shard_result, error in wait_for_shards(jobs, self.log_info):
+                    if error:
+                        self.log_failure(f"shard: '{shard_id}' failed:\n```\n{error}\n```")
+                        # not checkpointed, so that a resumed job retries them
+                        shard_failures += [
+                            {"device-name": device_name, "successful": False, "error-messages": [f"shard: '{shard_id}' failed"]}
+                            for device_name in shards[shard_id]
+                        ]
+                        continue
+                    self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - shard: '{shard_id}' finished onboarding: '{len(shard_result['results'])}' devices")
+                    for result in shard_result["results"]:
+                        checkpoint.record(result["device-name"], result, successful=result["successful"])
+                    for peer_device_name in shard_result["peers_not_onboarded_on_nso"]:
+                        if peer_device_name not in dm.peers_not_onboarded_on_nso:
+                            dm.peers_not_onboarded_on_nso.append(peer_device_name)
+                    cost_history.merge(shard_result["costs"])
+                    for model_name, counters in shard_result["changes"].items():
+                        for counter, value in counters.items():
+                            dm.changes.setdefault(model_name, {"saved": 0, "skipped": 0})[counter] += value
+                    dm.tracer.merge(shard_result["spans"])
+                    dm.query_profiler.merge(shard_result["queries"])
+            elif data["with_multithreading"]:
+                limiter = None
+                if data["adaptive_concurrency"]:
+                    limiter = AdaptiveConcurrencyLimiter(data["min_fetch_workers"], data["fetch_workers"], self.log_info)
+                    nso.add_latency_observer(limiter.observe)
+                pipeline = OnboardingPipeline(
+                    dm,
+                    fetch_workers=data["fetch_workers"],
+                    persist_workers=data["persist_workers"],
+                    queue_size=data["queue_size"],
+                    log=[
+                        self.log_info,
+                        self.log_warning,
+                        self.log_failure,
+                        self.log_debug
+                    ],
+                    checkpoint=checkpoint,
+                    cost_history=cost_history,
+                    device_timeout=data["device_timeout"],
+                    job_deadline=job_deadline,
+                    limiter=limiter,
+                )
+                results = pipeline.run(
+                    nb_devices,
+                    onboard_interfaces=data["onboard_interfaces"],
+                    retry=data["nso_retry"],
+                    timeout=data["nso_timeout"],
+                )
+            else:
+                def onboard_device(device, retry_pass=False):
+                    # the retry pass is only bounded by the job deadline
+                    deadline = Deadline(None if retry_pass else data["device_timeout"], parent=job_deadline)
+                    with dm.query_profiler.install(), deadline_scope(deadline):
+                        started = monotonic()
+                        try:
+                            nso_data = dm.fetch_device_nso_data(device, data["onboard_interfaces"], retry=data["nso_retry"], timeout=data["nso_timeout"])
+                        except Exception:
+                            # fetched again by onboard_device, which reports the error
+                            nso_data = None
+                        fetched = monotonic()
+                        result = dm.onboard_device(
                             device=device,
                             onboard_interfaces=data["onboard_interfaces"],
                             retry=data["nso_retry"],
                             timeout=data["nso_timeout"],
+                            nso_data=nso_data,
                         )
-                        for device in nb_devices
-                    ]
-                    # do something with results (traceback, return status etc.)
-                    results = [future.result() for future in threads]
-
-                    for res in results:
-                        success_msg = "yes" if res['successful'] else "No"
-                        error_logs = '<br>'.join(res['error-messages'])
-                        result_summary.append(
-                            f"| {res['device-name']} | {success_msg} | {error_logs} |"
-                        )
-                    result_summary = "\n".join(result_summary)
-            else:
-                for local_device in nb_devices:
-                    dm.onboard_device(local_device, onboard_interfaces=onboard_interfaces)
+                    if not retry_pass and not result["successful"] and deadline.expired():
+                        self.log_warning(f"{datetime.now().strftime('%H:%M:%S')} - device: '{device.name}' exceeded its time budget of: '{data['device_timeout']}' seconds, it will be retried after the other devices.")
+                        retry_devices.append(device)
+                        return
+                    record_onboarding_cost(cost_history, device, nso_data, fetched - started, monotonic() - fetched)
+                    # failed devices are processed again by a resumed job
+                    checkpoint.record(device.name, result, successful=result["successful"])
+                    results.append(result)
+
+                results = []
+                retry_devices = []
+                for device in nb_devices:
+                    onboard_device(device)
+                if retry_devices:
+                    self.log_info(f"{datetime.now().strftime('%H:%M:%S')} - retrying: '{len(retry_devices)}' devices which exceeded their time budget: {[device.name for device in retry_devices]}")
+                    for device in retry_devices:
+                        onboard_device(device, retry_pass=True)
+            # runtimes recorded by every mode: the pipeline, the sequential loop and the shards
+            cost_history.save()
+            runtime_summary = cost_history.export(f"{getcwd()}/generated-configs/reports/onboarding-runtime-{checkpoint.job_id}.json")
+            self.log_info(f"predicted vs actual makespan per worker count:\n{runtime_summary}")
+            # summary covers the devices onboarded by previous runs of the same checkpoint
+            results = [checkpoint.completed[device.name] for device in all_nb_devices if checkpoint.is_completed(device.name)] + shard_failures
+
+            for res in results:
+                success_msg = "yes" if res['successful'] else "No"
+                error_logs = '<br>'.join(res['error-messages'])
+                result_summary.append(
+                    f"| {res['device-name']} | {success_msg} | {error_logs} |"
+                )
+            result_summary = "\n".join(result_summary)
             ############################################################################
+            self.log_info(f"Netbox objects saved vs skipped (unchanged):\n{dm.get_changes_summary()}")
+            dm.tracer.export(f"{getcwd()}/generated-configs/reports/onboarding-trace-{checkpoint.job_id}.json", queries=dm.query_profiler.get_data())
+            self.log_info(f"onboarding phases timings:\n{dm.tracer.get_phases_summary()}")
+            self.log_info(f"slowest devices:\n{dm.tracer.get_devices_summary()}")
+            self.log_info(f"SQL queries per phase:\n{dm.query_profiler.get_phases_summary()}")
+            self.log_info(f"SQL query shapes:\n{dm.query_profiler.get_shapes_summary()}")
             if dm.peers_not_onboarded_on_nso:
                 self.log_warning(f"The following devices are not onboarded on NSO: {dm.peers_not_onboarded_on_nso}")
             onbarding_state = "success"
@@ -176,7 +399,7 @@ class OnboardFromNso(Script):
                 self,
                 f"log_{onbarding_state}",
             )
-            logger(f"{datetime.now().strftime('%H:%M:%S')} - onboarding of: '{len(nb_devices)}' NSO devices to Netbox was a: {onbarding_state}.")
+            logger(f"{datetime.now().strftime('%H:%M:%S')} - onboarding of: '{len(all_nb_devices)}' NSO devices to Netbox was a: {onbarding_state}.")
             logger(f"\n{result_summary}")
 
         except AbortScript as e:
@@ -188,4 +411,11 @@ class OnboardFromNso(Script):
             error_msg = "```\n" + ''.join(error_msg) + "\n```"
             self.log_failure(error_msg)
             raise AbortScript(f"failed due to caughting unhandled exception")
+        finally:
+            if ethernet_oper:
+                # queued devices are dropped, the requests in flight are cached
+                ethernet_oper.shutdown()
+                self.log_info(f"ethernet-interface oper data lane:\n{ethernet_oper.get_summary()}")
+            if parser_pool:
+                parser_pool.shutdown()
 
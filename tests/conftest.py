@@ -0,0 +1,5 @@
+from os import path as os_path
+from sys import path
+
+# common is imported from the repository root, as from the Netbox scripts directory
+path.insert(0, os_path.dirname(os_path.dirname(os_path.abspath(__file__))))
@@ -0,0 +1,56 @@
+from common.utils.checkpoint import CheckpointStore
+
+
+class Device:
+    def __init__(self, name):
+        self.name = name
+
+
+def test_resume_skips_completed_devices(tmp_path):
+    checkpoint = CheckpointStore(str(tmp_path), job_id="job")
+    checkpoint.record("device-1", {"successful": True})
+
+    resumed = CheckpointStore(str(tmp_path), job_id="job")
+    assert resumed.is_completed("device-1")
+    assert resumed.get_result("device-1") == {"successful": True}
+    assert [device.name for device in resumed.remaining([Device("device-1"), Device("device-2")])] == ["device-2"]
+
+
+def test_results_read_back_from_disk(tmp_path):
+    checkpoint = CheckpointStore(str(tmp_path), job_id="job", keep_results=False)
+    checkpoint.record("device-1", [["device-1", "Gi0/0/0/0"]])
+    checkpoint.record("device-2", [["device-2", "Gi0/0/0/1"]])
+    assert checkpoint.completed == {"device-1": None, "device-2": None}
+
+    resumed = CheckpointStore(str(tmp_path), job_id="job", keep_results=False)
+    assert resumed.get_result("device-2") == [["device-2", "Gi0/0/0/1"]]
+    assert list(resumed.iter_results()) == [
+        ("device-1", [["device-1", "Gi0/0/0/0"]]),
+        ("device-2", [["device-2", "Gi0/0/0/1"]]),
+    ]
+
+
+def test_truncated_last_line_is_dropped(tmp_path):
+    checkpoint = CheckpointStore(str(tmp_path), job_id="job")
+    checkpoint.record("device-1", {"successful": True})
+    with open(checkpoint.file_path, mode='ab') as f:
+        f.write(b'{"device": "device-2", "res')
+
+    resumed = CheckpointStore(str(tmp_path), job_id="job")
+    assert list(resumed.completed) == ["device-1"]
+    resumed.record("device-3", {"successful": False})
+    assert list(CheckpointStore(str(tmp_path), job_id="job").completed) == ["device-1", "device-3"]
+
+
+def test_resume_retries_failed_devices(tmp_path):
+    checkpoint = CheckpointStore(str(tmp_path), job_id="job")
+    checkpoint.record("device-1", {"successful": False}, successful=False)
+    checkpoint.record("device-2", {"successful": True})
+    devices = [Device("device-1"), Device("device-2"), Device("device-3")]
+
+    resumed = CheckpointStore(str(tmp_path), job_id="job")
+    # failed devices are still part of the summary
+    assert resumed.is_completed("device-1")
+    assert [device.name for device in resumed.remaining(devices)] == ["device-1", "device-3"]
+    resumed.record("device-1", {"successful": True})
+    assert [device.name for device in CheckpointStore(str(tmp_path), job_id="job").remaining(devices)] == ["device-3"]
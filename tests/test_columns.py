@@ -0,0 +1,51 @@
+from pytest import importorskip, raises
+
+from common.utils.columns import REPORT_COLUMNS, REPORT_PRESETS, get_column_types, get_dependencies, select_columns
+
+
+def test_empty_selection_is_every_column():
+    assert select_columns("") == [column.header for column in REPORT_COLUMNS]
+
+
+def test_selection_keeps_its_order_without_duplicates():
+    assert select_columns("MTU, device-name,MTU") == ["MTU", "device-name"]
+    assert select_columns("inventory,device-name") == REPORT_PRESETS["inventory"]
+
+
+def test_unknown_column_is_rejected():
+    with raises(ValueError):
+        select_columns("device-name,unknown")
+
+
+def test_inventory_preset_makes_no_nso_call():
+    assert not get_dependencies(REPORT_PRESETS["inventory"])["sources"]
+
+
+def test_state_synced_columns_depend_on_the_nso_state():
+    for header in ("interface-admin-state", "speed (mbps)", "interface-mac_address"):
+        assert get_dependencies([header])["sources"] == {"state"}
+
+
+def test_dependencies_of_the_selected_columns():
+    dependencies = get_dependencies(["device-location", "optics-type", "tagged-vlan(s)"])
+    assert dependencies == {
+        "sources": {"optics"},
+        "fields": {"optics-id", "tagged-vlans"},
+        "relations": {"tagged_vlans"},
+        "device_relations": {"site"},
+    }
+
+
+def test_column_types():
+    assert get_column_types(["device-name", "MTU", "bandwidth"]) == {"MTU": "int", "bandwidth": "int"}
+
+
+def test_rows_follow_the_selected_columns():
+    # parsing decodes xml payloads as well
+    importorskip("xmltodict")
+    from common.utils.parsing import build_report_rows
+    device_record = {"name": "device-1", "model": "N/A", "os-version": "7.5.2", "site": "N/A", "service-policies": {}}
+    interface_records = [{"name": "Gi0/0/0/0", "enabled": True, "optics-id": "0/0/0/0"}]
+    sources = {"state": {"Gi0/0/0/0": {"oper-status": "up"}}, "optics": {"0/0/0/0": {"optics-type": "10G-LR"}}}
+    headers = ["interface-name", "interface-admin-state", "interface-oper-state", "optics-type", "interface-link-state", "Service-Policy Output_2"]
+    assert build_report_rows(headers, device_record, interface_records, sources) == [["Gi0/0/0/0", "up", "up", "10G-LR", "N/A", "N/A"]]
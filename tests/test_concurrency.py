@@ -0,0 +1,50 @@
+from threading import Event, Thread
+
+from common.utils.concurrency import AdaptiveConcurrencyLimiter
+
+
+def create_limiter(**kwargs):
+    logs = []
+    return AdaptiveConcurrencyLimiter(2, 4, logs.append, window=2, **kwargs), logs
+
+
+def test_additive_increase_up_to_max_workers():
+    limiter, logs = create_limiter()
+    for _ in range(4):
+        limiter.observe(1.0, False)
+        limiter.observe(1.0, False)
+    assert limiter.limit == 4
+    assert [(adjustment["from"], adjustment["to"]) for adjustment in limiter.adjustments] == [(2, 3), (3, 4)]
+    assert len(logs) == 2
+
+
+def test_multiplicative_decrease_on_errors_and_latency():
+    limiter, logs = create_limiter()
+    limiter.adjust(1.0, 0.0)
+    limiter.adjust(1.0, 0.0)
+    assert limiter.limit == 4
+    limiter.adjust(1.0, 0.5)
+    assert limiter.limit == 3
+    # latency above 2x the best average seen
+    limiter.adjust(2.5, 0.0)
+    assert limiter.limit == 2
+    # never below min_workers
+    limiter.adjust(2.5, 0.0)
+    assert limiter.limit == 2
+
+
+def test_tasks_wait_for_a_free_slot():
+    limiter, logs = create_limiter()
+    entered = Event()
+
+    def task():
+        with limiter:
+            entered.set()
+
+    with limiter, limiter:
+        thread = Thread(target=task)
+        thread.start()
+        assert not entered.wait(timeout=0.1)
+    assert entered.wait(timeout=1)
+    thread.join()
+    assert limiter.active == 0
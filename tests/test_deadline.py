@@ -0,0 +1,57 @@
+from threading import Thread
+from time import sleep
+
+from pytest import importorskip, raises
+
+# DeadlineExceeded subclasses the requests Timeout
+importorskip("requests")
+from common.utils.deadline import Deadline, DeadlineExceeded, deadline_scope, get_current_deadline
+
+
+def test_unbounded_deadline():
+    deadline = Deadline()
+    assert deadline.remaining() is None
+    assert not deadline.expired()
+    assert deadline.get_timeout(30) == 30
+
+
+def test_deadline_bounded_by_its_parent():
+    parent = Deadline(1)
+    assert 0 < Deadline(60, parent=parent).remaining() <= 1
+    assert 0 < Deadline(None, parent=parent).remaining() <= 1
+    assert Deadline(0.5, parent=Deadline()).remaining() <= 0.5
+
+
+def test_expired_deadline_raises():
+    deadline = Deadline(0.01)
+    sleep(0.02)
+    assert deadline.expired()
+    assert deadline.remaining() == 0
+    with raises(DeadlineExceeded):
+        deadline.check("GET /devices")
+    with raises(DeadlineExceeded):
+        deadline.get_timeout(30, "GET /devices")
+
+
+def test_timeout_within_the_budget():
+    deadline = Deadline(10)
+    assert deadline.get_timeout(5) == 5
+    assert 9 < deadline.get_timeout(30) <= 10
+    deadline.expires_at = deadline.expires_at - 10 + Deadline.MIN_TIMEOUT / 10
+    # never a zero timeout while some budget is left
+    assert deadline.get_timeout(30) == Deadline.MIN_TIMEOUT
+
+
+def test_deadline_scope_per_thread():
+    deadline = Deadline(10)
+    seen = []
+    with deadline_scope(deadline):
+        assert get_current_deadline() is deadline
+        with deadline_scope(None):
+            assert get_current_deadline() is None
+        assert get_current_deadline() is deadline
+        thread = Thread(target=lambda: seen.append(get_current_deadline()))
+        thread.start()
+        thread.join()
+    assert get_current_deadline() is None
+    assert seen == [None]
@@ -0,0 +1,69 @@
+from contextlib import nullcontext
+from threading import Barrier, Thread
+from time import sleep
+from types import SimpleNamespace
+
+from pytest import fixture, importorskip
+
+# DeviceManager writes the vlans through the Netbox models
+importorskip("ipam.models")
+from common.utils import device as device_module
+from common.utils.device import DeviceManager
+
+
+class VlanObjects:
+    "global vlans without unique constraint, as in Netbox"
+    def __init__(self):
+        self.vlans = []
+
+    def filter(self, vid__in, name__in):
+        return [vlan for vlan in list(self.vlans) if vlan.vid in vid__in and vlan.name in name__in]
+
+    def bulk_create(self, vlans):
+        # widens the window between the lookup and the insert
+        sleep(0.05)
+        self.vlans.extend(vlans)
+        return vlans
+
+
+@fixture
+def vlans(monkeypatch):
+    class Vlan(SimpleNamespace):
+        objects = VlanObjects()
+    monkeypatch.setattr(device_module, "VLAN", Vlan)
+    monkeypatch.setattr(device_module, "transaction", SimpleNamespace(atomic=nullcontext))
+    monkeypatch.setattr(device_module, "connection", SimpleNamespace(vendor="sqlite"))
+    return Vlan.objects
+
+
+def test_nso_vids_of_the_interfaces_config():
+    nso_interface_config = {
+        "TenGigE": [{"id": "0/0/0/0", "encapsulation": {"dot1q": {"vlan-id": [100]}}}, {"id": "0/0/0/1"}],
+        "TenGigE-subinterface": {"TenGigE": [{"id": "0/0/0/0.200", "encapsulation": {"dot1q": {"vlan-id": ["200", "201"]}}}]},
+    }
+    assert DeviceManager.get_nso_vids(nso_interface_config) == {100, 200}
+
+
+def test_concurrent_devices_share_their_vlans(vlans):
+    device_manager = DeviceManager(with_logs=False)
+    barrier = Barrier(2)
+    results = []
+
+    def onboard(vids):
+        barrier.wait()
+        results.append(device_manager.get_or_create_vlans(vids))
+
+    threads = [Thread(target=onboard, args=(vids,)) for vids in ({100, 200}, {200, 300})]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(vlan.vid for vlan in vlans.vlans) == [100, 200, 300]
+    assert results[0][200] is results[1][200]
+
+
+def test_existing_vlans_are_reused(vlans):
+    device_manager = DeviceManager(with_logs=False)
+    first_vlans = device_manager.get_or_create_vlans({"100"})
+    assert device_manager.get_or_create_vlans({100}) == first_vlans
+    assert len(vlans.vlans) == 1
@@ -0,0 +1,60 @@
+from threading import Event
+from time import sleep
+
+from pytest import raises
+
+from common.utils.functions import BoundedThreadPoolExecutor, percentile
+
+
+def test_percentile():
+    assert percentile([], 50) == 0.0
+    assert percentile([3, 1, 2, 4], 50) == 2
+    assert percentile([3, 1, 2, 4], 95) == 4
+
+
+def test_submit_blocks_once_max_pending_is_reached():
+    release = Event()
+    with BoundedThreadPoolExecutor(max_workers=1, max_pending=2) as executor:
+        executor.submit(release.wait)
+        executor.submit(release.wait)
+        assert not executor.slots.acquire(timeout=0.1)
+        release.set()
+    assert executor.get_progress()["done"] == 2
+
+
+def test_errors_keep_the_original_exception():
+    def fail():
+        raise KeyError("interface")
+
+    with BoundedThreadPoolExecutor(max_workers=2) as executor:
+        future = executor.submit_named("device-1", fail)
+        with raises(KeyError):
+            future.result()
+    assert [(error["task"], error["type"]) for error in executor.errors] == [("device-1", "KeyError")]
+    assert executor.get_progress()["failed"] == 1
+
+
+def test_fail_fast_cancels_later_tasks():
+    def fail():
+        raise ValueError("failed")
+
+    with BoundedThreadPoolExecutor(max_workers=1, fail_fast=True) as executor:
+        executor.submit(fail).exception()
+        assert executor.submit(sleep, 0).cancelled()
+
+
+def test_iter_completed_holds_at_most_window_futures():
+    max_in_flight = []
+
+    def task(item):
+        sleep(0.001 * (item % 3))
+        return item * 2
+
+    with BoundedThreadPoolExecutor(max_workers=2) as executor:
+        results = []
+        for item, future in executor.iter_completed(task, range(20), get_name=lambda item: f"item-{item}", window=3):
+            max_in_flight.append(len(executor.pending))
+            results.append((item, future.result()))
+    assert sorted(results) == [(item, item * 2) for item in range(20)]
+    assert max(max_in_flight) <= 3
+    assert len(executor.metrics) == 20
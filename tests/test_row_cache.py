@@ -0,0 +1,37 @@
+from common.utils.row_cache import ReportRowCache, get_fingerprint
+
+
+HEADERS = ["device-name", "interface-name", "MTU"]
+ROWS = [["device/1", "Gi0/0/0/0", 9000]]
+
+
+def test_fingerprint_does_not_depend_on_the_key_order():
+    assert get_fingerprint({"a": 1, "b": [1, 2]}, "x") == get_fingerprint({"b": [1, 2], "a": 1}, "x")
+    assert get_fingerprint({"a": 1}) != get_fingerprint({"a": 2})
+
+
+def test_fingerprint_changes_with_the_netbox_fingerprint(tmp_path):
+    cache = ReportRowCache(str(tmp_path), {"device/1": "netbox-1"})
+    fingerprint = cache.get_fingerprint("device/1", HEADERS, {"state": {}})
+    cache.netbox_fingerprints["device/1"] = "netbox-2"
+    assert cache.get_fingerprint("device/1", HEADERS, {"state": {}}) != fingerprint
+
+
+def test_rows_are_reused_only_for_the_same_fingerprint(tmp_path):
+    cache = ReportRowCache(str(tmp_path), {"device/1": "netbox-1"})
+    fingerprint = cache.get_fingerprint("device/1", HEADERS, {"state": {}})
+    assert cache.get("device/1", fingerprint) is None
+    assert not cache.is_reused("device/1")
+    cache.store("device/1", fingerprint, ROWS)
+    assert cache.get("device/1", fingerprint) == ROWS
+    assert cache.is_reused("device/1")
+    assert cache.get("device/1", cache.get_fingerprint("device/1", HEADERS, {"state": {"Gi0/0/0/0": {}}})) is None
+    assert cache.counters == {"reused": 1, "rebuilt": 2}
+
+
+def test_corrupted_entry_is_rebuilt(tmp_path):
+    cache = ReportRowCache(str(tmp_path), {})
+    with open(cache.get_file_path("device/1"), mode='w') as f:
+        f.write('{"fingerprint": ')
+    assert cache.get("device/1", "fingerprint") is None
+    assert cache.counters["rebuilt"] == 1
@@ -0,0 +1,41 @@
+from pytest import importorskip
+
+# CostHistory.order counts the interfaces in Netbox
+importorskip("dcim.models")
+from common.utils.scheduling import CostHistory
+
+
+def test_simulate_makespan_longest_first():
+    assert CostHistory.simulate_makespan([], 2) == 0.0
+    assert CostHistory.simulate_makespan([5, 4, 3, 3, 3], 2) == 10
+    assert CostHistory.simulate_makespan([5, 4, 3], 10) == 5
+
+
+def test_predict_from_history(tmp_path):
+    cost_history = CostHistory(str(tmp_path / "history.json"))
+    assert cost_history.predict("device-1") == CostHistory.DEFAULT_RUNTIME
+
+    cost_history.record("device-1", phases={"fetch": 10, "persist": 30}, interfaces=40)
+    cost_history.record("device-2", phases={"fetch": 5, "persist": 5}, interfaces=20)
+    assert cost_history.predict("device-1") == 40
+    # unknown devices: from their interface count, the median of the known runtimes otherwise
+    assert cost_history.predict("device-3", interfaces_count=10, runtime_per_interface=cost_history.get_runtime_per_interface()) == 7.5
+    assert cost_history.predict("device-3") == 25
+
+
+def test_history_saved_between_runs(tmp_path):
+    file_path = str(tmp_path / "cost-history" / "history.json")
+    cost_history = CostHistory(file_path)
+    cost_history.record("device-1", phases={"report": 12}, interfaces=3)
+    cost_history.save()
+    assert CostHistory(file_path).history == {"device-1": {"phases": {"report": 12}, "runtime": 12, "interfaces": 3}}
+
+
+def test_runtimes_merged_from_a_shard(tmp_path):
+    shard_history = CostHistory()
+    shard_history.record("device-1", phases={"fetch": 4, "persist": 6}, interfaces=12)
+
+    cost_history = CostHistory(str(tmp_path / "history.json"))
+    cost_history.merge(shard_history.recorded)
+    assert cost_history.history == {"device-1": {"phases": {"fetch": 4, "persist": 6}, "runtime": 10, "interfaces": 12}}
+    assert cost_history.actuals == {"device-1": 10}
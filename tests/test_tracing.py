@@ -0,0 +1,87 @@
+from json import load as json_load
+from threading import Thread
+
+from pytest import raises
+
+from common.utils.tracing import Tracer, traced
+
+
+class Device:
+    def __init__(self, name):
+        self.name = name
+
+
+class Manager:
+    def __init__(self):
+        self.tracer = Tracer()
+
+    @traced("persist")
+    def persist(self, device, fail=False):
+        with self.tracer.span(device.name, "netbox:interfaces"):
+            if fail:
+                raise ValueError("invalid interface")
+        return device.name
+
+
+def test_nested_spans():
+    tracer = Tracer()
+    with tracer.span("device-1", "fetch"):
+        assert tracer.current() == ("device-1", "fetch")
+        with tracer.span("device-1", "nso:lldp"):
+            assert tracer.current() == ("device-1", "nso:lldp")
+    assert tracer.current() is None
+    # children are recorded first, only the top level span counts in the device total
+    assert [(span["phase"], span["nested"]) for span in tracer.spans] == [("nso:lldp", True), ("fetch", False)]
+    device = tracer.get_devices()["device-1"]
+    assert device["total"] == tracer.spans[1]["duration"]
+    assert list(device["nested-phases"]) == ["nso:lldp"]
+
+
+def test_spans_inherited_by_another_thread():
+    tracer = Tracer()
+    with tracer.span("device-1", "report"):
+        stack = tracer.get_stack()
+
+        def fetch_path():
+            with tracer.inherit(stack), tracer.span("device-1", "nso:state"):
+                pass
+        thread = Thread(target=fetch_path)
+        thread.start()
+        thread.join()
+    assert [(span["phase"], span["nested"]) for span in tracer.spans] == [("nso:state", True), ("report", False)]
+
+
+def test_traced_records_exceptions():
+    manager = Manager()
+    assert manager.persist(Device("device-1")) == "device-1"
+    with raises(ValueError):
+        manager.persist(Device("device-2"), fail=True)
+    failed = {(span["device"], span["phase"]): span["failed"] for span in manager.tracer.spans}
+    assert failed == {
+        ("device-1", "netbox:interfaces"): False,
+        ("device-1", "persist"): False,
+        ("device-2", "netbox:interfaces"): True,
+        ("device-2", "persist"): True,
+    }
+
+
+def test_merged_spans_and_exported_summary(tmp_path):
+    tracer = Tracer()
+    tracer.merge([
+        {"device": "device-1", "phase": "persist", "duration": 3.0, "failed": False, "nested": False},
+        {"device": "device-1", "phase": "netbox:vlans", "duration": 2.0, "failed": False, "nested": True},
+        {"device": "device-2", "phase": "persist", "duration": 1.0, "failed": False, "nested": False},
+    ])
+    phases = tracer.get_phases()
+    assert phases["persist"]["count"] == 2 and phases["persist"]["total"] == 4.0 and phases["persist"]["max"] == 3.0
+    # the slowest nested phase is reported rather than the top level span
+    assert tracer.get_devices_summary().splitlines()[2] == "| device-1 | 3.0 | netbox:vlans: 2.0s |"
+    assert tracer.get_phases_summary().splitlines()[2].startswith("| persist | 2 |")
+
+    file_path = tmp_path / "reports" / "trace.json"
+    tracer.export(str(file_path), queries={"shapes": []})
+    with open(file_path) as f:
+        exported = json_load(f)
+    assert exported["devices"]["device-2"] == {"total": 1.0, "phases": {"persist": 1.0}, "nested-phases": {}}
+    assert exported["queries"] == {"shapes": []}
+    assert set(exported["phases"]) == {"persist", "netbox:vlans"}
@@ -0,0 +1,124 @@
+from csv import reader as csv_reader
+from gzip import open as gzip_open
+from json import load as json_load
+from json import loads as json_loads
+from re import fullmatch as re_fullmatch
+
+from pytest import importorskip, raises
+
+from common.utils.writers import CsvReportWriter, JsonlReportWriter, MultiReportWriter, ParquetReportWriter, PartitionedReportWriter, ERROR_HEADERS
+
+
+HEADERS = ["device-name", "interface-name", "MTU"]
+ROWS = [["device-1", "Gi0/0/0/0", 9000], ["device-1", "Gi0/0/0/1", "N/A"], ["device-2", "Gi0/0/0/0", 1514]]
+
+
+def read_csv(file_path):
+    with open(file_path, newline='') as f:
+        return list(csv_reader(f))
+
+
+def test_rows_are_written_in_chunks(tmp_path):
+    writer = CsvReportWriter(str(tmp_path / "report.csv"), HEADERS, chunk_size=2)
+    writer.append_rows(ROWS)
+    # the last partial chunk is only held in memory until save
+    assert writer.chunk == ROWS[2:]
+    writer.save()
+    assert writer.rows_count == 3
+    assert read_csv(tmp_path / "report.csv") == [HEADERS] + [[str(value) for value in row] for row in ROWS]
+
+
+def test_errors_are_written_to_a_separate_file(tmp_path):
+    writer = CsvReportWriter(str(tmp_path / "report.csv"), HEADERS)
+    writer.append_rows(ROWS[:1])
+    writer.append_errors([["device-3", "KeyError", "'interface'"]])
+    writer.save()
+    assert read_csv(tmp_path / "report-errors.csv") == [ERROR_HEADERS, ["device-3", "KeyError", "'interface'"]]
+
+
+def test_no_errors_file_without_errors(tmp_path):
+    writer = CsvReportWriter(str(tmp_path / "report.csv"), HEADERS)
+    writer.save()
+    assert not (tmp_path / "report-errors.csv").exists()
+
+
+def test_jsonl_rows_are_keyed_by_header(tmp_path):
+    writer = JsonlReportWriter(str(tmp_path / "report.jsonl.gz"), HEADERS)
+    writer.append_rows(ROWS)
+    writer.save()
+    with gzip_open(tmp_path / "report.jsonl.gz", mode='rt') as f:
+        assert [json_loads(line) for line in f] == [dict(zip(HEADERS, row)) for row in ROWS]
+
+
+def test_multi_writer_writes_every_format_in_one_pass(tmp_path):
+    writer = MultiReportWriter.create(["csv", "jsonl", "csv"], str(tmp_path / "report"), HEADERS)
+    writer.append_rows(ROWS)
+    writer.save()
+    assert writer.file_paths == [str(tmp_path / "report.csv"), str(tmp_path / "report.jsonl.gz")]
+    assert writer.rows_count == 3
+    assert len(read_csv(tmp_path / "report.csv")) == 4
+
+
+def test_unknown_output_formats_are_rejected():
+    with raises(ValueError):
+        MultiReportWriter.check_output_formats(["csv", "pdf"])
+    with raises(ValueError):
+        MultiReportWriter.check_output_formats([])
+
+
+def test_parquet_int_columns_are_typed(tmp_path):
+    importorskip("pyarrow")
+    from pyarrow.parquet import read_table
+    writer = ParquetReportWriter(str(tmp_path / "report.parquet"), HEADERS, column_types={"MTU": "int"})
+    writer.append_rows(ROWS)
+    writer.append_errors([["device-3", "KeyError", "'interface'"]])
+    writer.save()
+    table = read_table(tmp_path / "report.parquet")
+    assert str(table.schema.field("MTU").type) == "int64"
+    assert table.column("MTU").to_pylist() == [9000, None, 1514]
+    assert table.column("interface-name").to_pylist() == ["Gi0/0/0/0", "Gi0/0/0/1", "Gi0/0/0/0"]
+    assert read_table(tmp_path / "report-errors.parquet").column("device-name").to_pylist() == ["device-3"]
+
+
+def test_xlsx_errors_sheet(tmp_path):
+    openpyxl = importorskip("openpyxl")
+    writer = MultiReportWriter.create(["xlsx"], str(tmp_path / "report"), HEADERS)
+    writer.append_rows(ROWS)
+    writer.append_errors([["device-3", "KeyError", "'interface'"]])
+    writer.save()
+    workbook = openpyxl.load_workbook(tmp_path / "report.xlsx")
+    assert workbook.sheetnames == ["report", "errors"]
+    assert [list(row) for row in workbook["report"].iter_rows(values_only=True)] == [HEADERS] + ROWS
+
+
+def test_partition_names_are_distinct():
+    get_partition_name = PartitionedReportWriter.get_partition_name
+    assert get_partition_name("site-1") == "site-1"
+    names = {get_partition_name(partition) for partition in ("a b", "a_b", "a/b", "", "N/A")}
+    assert len(names) == 5
+    assert all(re_fullmatch(r"[A-Za-z0-9_.-]+", name) for name in names)
+
+
+def test_partitioned_writer_writes_one_file_set_per_partition(tmp_path):
+    writer = PartitionedReportWriter(["csv"], str(tmp_path / "report"), HEADERS, processes=2)
+    writer.append_rows(ROWS[:2], "site-1")
+    writer.append_rows(ROWS[2:], "site 2")
+    writer.append_errors([["device-3", "TimeoutError", "timed out"]], "site-1")
+    writer.save()
+    with open(tmp_path / "report-index.json") as f:
+        index = json_load(f)
+    site_2 = PartitionedReportWriter.get_partition_name("site 2")
+    assert sorted(index) == sorted(["site-1", site_2])
+    assert index["site-1"]["rows"] == 2 and index["site-1"]["errors"] == 1
+    assert read_csv(tmp_path / f"report-{site_2}.csv") == [HEADERS, [str(value) for value in ROWS[2]]]
+    assert read_csv(tmp_path / "report-site-1-errors.csv")[1] == ["device-3", "TimeoutError", "timed out"]
+    assert writer.rows_count == 3
+
+
+def test_partitioned_writer_save_fails_on_a_crashed_worker(tmp_path):
+    writer = PartitionedReportWriter(["csv"], str(tmp_path / "report"), HEADERS, processes=2)
+    writer.append_rows(ROWS, "site-1")
+    writer.abort()
+    with raises(RuntimeError):
+        writer.save()
+    assert not (tmp_path / "report-index.json").exists()